@@ -0,0 +1,128 @@
+# Compares the lifted and the grounded encodings of the travelling-costs problem:
+# time to build the problem, time and size of the grounding done by the unified-planning
+# grounder, and the time to solve it:
+# - engine: the planning engine listening on --port, as the NAVIGATE requests solve it
+#   (the conversion to the protobuf message, the gRPC calls and the search),
+# - local: an installed unified-planning planner, --planner or by default the first one
+#   that supports the problem; none is shown if no installed planner supports action costs.
+# The encoding picked by `auto` (problem_model.choose_encoding) is shown for every map,
+# and the fastest encoding for each solver is marked with *, so the threshold of `auto`
+# can be checked against the engine.
+#
+# The maps are made by the generators of map_generators, by default the road one.
+#
+# Usage: python benchmarks/encoding_benchmark.py [--sizes 50,200,500] [--degree 3] [--generator road] [--port PORT]
+#            [--planner NAME] [--repeat 1] [--json FILE]
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import networkx as nx
+from unified_planning.shortcuts import *
+from unified_planning.engines import CompilationKind
+import unified_planning as up
+
+from map_generators import MAP_GENERATORS, random_map
+from problem_model import ENCODING_GROUNDED, ENCODING_LIFTED, ProblemModel, choose_encoding
+
+get_environment().credits_stream = None
+
+
+def median_seconds(function: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t)
+    return statistics.median(times)
+
+
+def timed_solve(engine, problem, repeat: int, result: dict, name: str):
+    # The median time of the solve, and the status of the last one
+    statuses = []
+    result[f"{name}_seconds"] = median_seconds(lambda: statuses.append(engine.solve(problem).status), repeat)
+    result[f"{name}_status"] = statuses[-1].name
+
+
+def benchmark_encoding(graph: nx.Graph, encoding: str, engine=None, planner: Optional[str] = None, repeat: int = 1) -> dict:
+    start, destination = "L_1", f"L_{len(graph)}"
+    result = {"encoding": encoding}
+
+    t = time.perf_counter()
+    model = ProblemModel(graph, encoding)
+    problem, _ = model.problem_for(start, destination)
+    result["build_seconds"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    with Compiler(name="up_grounder") as grounder:
+        grounded = grounder.compile(problem, CompilationKind.GROUNDING).problem
+    result["grounding_seconds"] = time.perf_counter() - t
+    result["grounded_actions"] = len(grounded.actions)
+
+    if engine is not None:
+        timed_solve(engine, problem, repeat, result, "engine")
+    try:
+        local = OneshotPlanner(name=planner) if planner is not None else OneshotPlanner(problem_kind=problem.kind)
+    except up.exceptions.UPNoSuitableEngineAvailableException:
+        return result
+    with local:
+        result["local_planner"] = local.name
+        timed_solve(local, problem, repeat, result, "local")
+    return result
+
+
+def mark_fastest(results: List[dict], name: str) -> List[str]:
+    # The solve times of the encodings of a map, the fastest one marked with *
+    key = f"{name}_seconds"
+    times = [r.get(key) for r in results]
+    known = [t for t in times if t is not None]
+    return [f"{'-':>10}" if t is None else f"{t:9.3f}{'*' if t == min(known) and len(known) > 1 else ' '}" for t in times]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="50,100,200,400", help="comma separated numbers of locations")
+    parser.add_argument("--degree", type=float, default=3, help="average number of connections of a location")
+    parser.add_argument("--generator", default="road", choices=sorted(MAP_GENERATORS), help="generator of the random maps")
+    parser.add_argument("--port", type=int, default=None, help="port of a planning engine to time the solves with")
+    parser.add_argument("--planner", default=None, help="name of an installed unified-planning planner, by default the first one supporting the problem")
+    parser.add_argument("--repeat", type=int, default=1, help="solves of every problem")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="file where the results are written")
+    args = parser.parse_args()
+
+    assert args.repeat > 0
+    engine = None
+    if args.port is not None:
+        from up_graphene_engine.engine import GrapheneEngine
+        engine = GrapheneEngine(port=args.port)
+
+    results = []
+    print(f"{'locations':>9} {'connections':>11} {'encoding':>8} {'auto':>4} {'build(s)':>9} {'ground(s)':>9} {'actions':>8} {'engine(s)':>10} {'local(s)':>10}")
+    for n_locations in map(int, args.sizes.split(",")):
+        graph = random_map(n_locations, int(n_locations * args.degree / 2), 1, 100, seed=args.seed, generator=args.generator)
+        auto = choose_encoding(graph)
+        map_results = []
+        for encoding in (ENCODING_LIFTED, ENCODING_GROUNDED):
+            result = benchmark_encoding(graph, encoding, engine, args.planner, args.repeat)
+            result.update({"generator": args.generator, "locations": n_locations, "connections": graph.number_of_edges(), "auto": encoding == auto})
+            map_results.append(result)
+        for result, engine_time, local_time in zip(map_results, mark_fastest(map_results, "engine"), mark_fastest(map_results, "local")):
+            print(f"{n_locations:>9} {graph.number_of_edges():>11} {result['encoding']:>8} {'yes' if result['auto'] else '':>4} "
+                  f"{result['build_seconds']:9.3f} {result['grounding_seconds']:9.3f} {result['grounded_actions']:>8} {engine_time} {local_time}")
+        results.extend(map_results)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
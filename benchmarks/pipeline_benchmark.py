@@ -0,0 +1,280 @@
+# Times the stages of a NAVIGATE on random maps made by the generator of the RANDOMIZE
+# button, sweeping the number of locations, the average number of connections of a
+# location and the range of the distances:
+# - build: the planning problem built from the map, as planning() does after a new map,
+# - encode: the whole problem converted to the protobuf message sent to the engine; it
+#   needs the protobuf package,
+# - solve: the engine solve; by default a stub engine answering with Dijkstra, so the
+#   benchmark runs offline, or the planning engine listening on --port,
+# - validate: the check of the plan on the map, that also computes its cost,
+# - validate_full: the same with the unified-planning PlanValidator, as in the audits,
+# - layout: the layout of the map made by the render worker (Kamada-Kawai up to 200
+#   locations, then sfdp or the force layout, see graph_layout),
+# - render: the first PNG of the map, drawn from scratch,
+# - recolour: the PNG drawn again with the plan highlighted, as after a NAVIGATE.
+# Every stage is run --repeat times on the same map and query; the median, minimum and
+# maximum are reported.
+#
+# The results can be written as JSON and compared with a previous run, case by case
+# (the same sizes, generator, seed and encoding): a stage whose median is slower than in
+# the baseline by more than --tolerance (and by more than --min-delta seconds) is
+# reported as a regression, and the exit status is 1.
+#
+# Usage: python benchmarks/pipeline_benchmark.py [--sizes 50,100,200] [--degrees 3] [--costs 1-20,1-1000]
+#            [--generator gnm] [--repeat 3] [--stages build,encode,solve,validate,validate_full,layout,render,recolour] [--port PORT]
+#            [--json FILE] [--baseline FILE] [--tolerance 0.2]
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import networkx as nx
+from unified_planning.shortcuts import *
+import unified_planning as up
+
+import local_solver
+from config import CONFIG
+from graph_canvas import GraphCanvas
+from graph_layout import LayoutCache
+from map_generators import MAP_GENERATORS, RANDOM_MAP_GENERATOR, random_map
+from map_style import DESTINATION_NODE_COLOR, LABELS_MAX_LOCATIONS, NORMAL_NODE_COLOR, PATH_COLOR, START_NODE_COLOR
+from plan_cache import canonical_graph_hash
+from problem_model import ENCODING_AUTO, ProblemModel
+
+get_environment().credits_stream = None
+
+try:
+    HAS_PROTOBUF = importlib.util.find_spec("google.protobuf") is not None
+except ImportError:
+    # not even the google package is installed
+    HAS_PROTOBUF = False
+
+PLANNING_STAGES = ("build", "encode", "solve", "validate", "validate_full")
+ENCODING_STAGES = ("encode",)
+RENDER_STAGES = ("layout", "render", "recolour")
+STAGES = PLANNING_STAGES + RENDER_STAGES
+
+
+class StubEngine():
+    # Answers a query like the planning engine, with a plan made of the actions of the
+    # problem, but finds it with Dijkstra on the map
+    def __init__(self, graph: nx.Graph, start: str, destination: str):
+        self.graph = graph
+        self.start = start
+        self.destination = destination
+
+    def solve(self, problem: up.model.Problem, optimality_guarantee=None) -> up.engines.PlanGenerationResult:
+        res = local_solver.shortest_path(self.graph, self.start, self.destination)
+        if res is None:
+            return up.engines.PlanGenerationResult(up.engines.PlanGenerationResultStatus.UNSOLVABLE_PROVEN, None, "stub")
+        path, _ = res
+        if problem.has_action("move"):
+            plan = local_solver.make_plan(path, problem)
+        else:
+            # the grounded encoding has an action for every direction of every connection
+            plan = up.plans.SequentialPlan([up.plans.ActionInstance(problem.action(f"move_{f}_{t}")) for f, t in zip(path[:-1], path[1:])])
+        return up.engines.PlanGenerationResult(up.engines.PlanGenerationResultStatus.SOLVED_OPTIMALLY, plan, "stub")
+
+
+def choose_query(graph: nx.Graph, seed: int) -> Tuple[str, str]:
+    # A start and a destination connected to each other, in the largest part of the map
+    rng = random.Random(seed)
+    component = sorted(max(nx.connected_components(graph), key=len))
+    return rng.choice(component), rng.choice(component)
+
+
+def node_colors(graph: nx.Graph, start: str, destination: str, path: Optional[List[str]] = None) -> List[str]:
+    color_map = {start: START_NODE_COLOR, destination: DESTINATION_NODE_COLOR}
+    path = set(path[1:-1]) if path is not None else set()
+    return [PATH_COLOR if n in path else color_map.get(n, NORMAL_NODE_COLOR) for n in graph]
+
+
+def summary(seconds: List[float]) -> dict:
+    return {"median": statistics.median(seconds), "min": min(seconds), "max": max(seconds)}
+
+
+def benchmark_map(graph: nx.Graph, start: str, destination: str, stages: List[str], repeat: int, encoding: str, port: Optional[int]) -> dict:
+    result = {}
+    times: Dict[str, List[float]] = {s: [] for s in stages}
+    engine = None
+    if port is not None:
+        from up_graphene_engine.engine import GrapheneEngine
+        engine = GrapheneEngine(port=port)
+
+    for _ in range(repeat):
+        path = None
+        if any(s in stages for s in PLANNING_STAGES):
+            t = time.perf_counter()
+            model = ProblemModel(graph, encoding)
+            problem, metric = model.problem_for(start, destination)
+            times.get("build", []).append(time.perf_counter() - t)
+            result["encoding"] = model.encoding
+
+            if "encode" in stages:
+                from unified_planning.grpc.proto_writer import ProtobufWriter
+                t = time.perf_counter()
+                encoded = ProtobufWriter().convert(problem).SerializeToString()
+                times["encode"].append(time.perf_counter() - t)
+                result["encoded_bytes"] = len(encoded)
+
+            t = time.perf_counter()
+            res = (engine or StubEngine(graph, start, destination)).solve(problem, OptimalityGuarantee.SOLVED_OPTIMALLY)
+            times.get("solve", []).append(time.perf_counter() - t)
+
+            if res.plan is not None:
+                t = time.perf_counter()
+                plan = model.lift_plan(res.plan)
+                result["cost"] = local_solver.plan_cost(graph, plan, start, destination)
+                times.get("validate", []).append(time.perf_counter() - t)
+                path = local_solver.plan_path(plan, start)
+                result["plan_length"] = len(plan.actions)
+
+                if "validate_full" in stages:
+                    t = time.perf_counter()
+                    with PlanValidator(name="sequential_plan_validator") as validator:
+                        val_res = validator.validate(problem, res.plan)
+                    times["validate_full"].append(time.perf_counter() - t)
+                    full_cost = val_res.metric_evaluations[metric] if val_res.metric_evaluations is not None else None
+                    assert full_cost == result["cost"], f"the PlanValidator computed a cost of {full_cost}"
+
+        if any(s in stages for s in RENDER_STAGES):
+            t = time.perf_counter()
+            layout_cache = LayoutCache(scale=1)
+            positions = layout_cache.layout(graph)
+            times.get("layout", []).append(time.perf_counter() - t)
+            result["layout_engine"] = layout_cache.last_layout_engine
+
+            graph_hash = canonical_graph_hash(graph)
+            labels = len(graph) <= LABELS_MAX_LOCATIONS
+            canvas = GraphCanvas()
+            t = time.perf_counter()
+            image = canvas.render(graph, graph_hash, positions, node_colors(graph, start, destination), labels)
+            times.get("render", []).append(time.perf_counter() - t)
+            result["png_bytes"] = len(image)
+
+            if path is None:
+                path = local_solver.shortest_path(graph, start, destination)
+                path = path[0] if path is not None else None
+            t = time.perf_counter()
+            canvas.render(graph, graph_hash, positions, node_colors(graph, start, destination, path), labels)
+            times.get("recolour", []).append(time.perf_counter() - t)
+
+    result["stages"] = {s: summary(seconds) for s, seconds in times.items() if len(seconds) > 0}
+    return result
+
+
+def case_key(result: dict) -> tuple:
+    # The map and query of a case: the same sizes give another map with another generator
+    # or seed, and another problem with another encoding
+    return result["case"], result.get("generator"), result.get("requested_encoding"), result.get("seed")
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float, min_delta: float) -> List[str]:
+    # The stages slower than in the baseline, for the cases found in both runs
+    regressions = []
+    baseline_cases = {case_key(r): r for r in baseline}
+    compared = 0
+    print()
+    print(f"{'case':<40} {'stage':>8} {'baseline(s)':>11} {'now(s)':>9} {'ratio':>6}")
+    for result in results:
+        base = baseline_cases.get(case_key(result))
+        if base is None:
+            continue
+        compared += 1
+        for stage, now in result["stages"].items():
+            if stage not in base["stages"]:
+                continue
+            before = base["stages"][stage]["median"]
+            ratio = now["median"] / before if before > 0 else float("inf")
+            regressed = ratio > 1 + tolerance and now["median"] - before > min_delta
+            if regressed:
+                regressions.append(f"{result['case']} {stage}: {before:.4f}s -> {now['median']:.4f}s")
+            print(f"{result['case']:<40} {stage:>8} {before:11.4f} {now['median']:9.4f} {ratio:6.2f}{' REGRESSION' if regressed else ''}")
+    if compared == 0:
+        print("No case of the baseline has the same map, generator, encoding and seed")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="50,100,200", help="comma separated numbers of locations")
+    parser.add_argument("--degrees", default="3", help="comma separated average numbers of connections of a location")
+    parser.add_argument("--costs", default="1-20", help="comma separated ranges of the distances, as MIN-MAX")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every stage on every map")
+    default_stages = [s for s in STAGES if HAS_PROTOBUF or s not in ENCODING_STAGES]
+    parser.add_argument("--stages", default=",".join(default_stages), help="comma separated stages to time")
+    parser.add_argument("--encoding", default=CONFIG.get("encoding", ENCODING_AUTO), help="lifted, grounded or auto")
+    parser.add_argument("--port", type=int, default=None, help="port of a planning engine used instead of the stub engine")
+    parser.add_argument("--generator", default=RANDOM_MAP_GENERATOR, choices=sorted(MAP_GENERATORS), help="generator of the random maps")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="file where the results are written")
+    parser.add_argument("--baseline", default=None, help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown of a stage, as a fraction of the baseline")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="slowdowns below these seconds are not regressions")
+    args = parser.parse_args()
+
+    stages = args.stages.split(",")
+    assert all(s in STAGES for s in stages), f"the stages are {', '.join(STAGES)}"
+    assert HAS_PROTOBUF or not any(s in ENCODING_STAGES for s in stages), "the encoding stages need the protobuf package"
+    assert args.repeat > 0
+
+    results = []
+    print(f"{'case':<40} {'connections':>11} " + " ".join(f"{s:>9}" for s in stages))
+    for n_locations in map(int, args.sizes.split(",")):
+        for degree in map(float, args.degrees.split(",")):
+            for costs in args.costs.split(","):
+                min_cost, max_cost = map(int, costs.split("-"))
+                n_connections = min(int(n_locations * degree / 2), n_locations * (n_locations - 1) // 2)
+                graph = random_map(n_locations, n_connections, min_cost, max_cost, seed=args.seed, generator=args.generator)
+                start, destination = choose_query(graph, args.seed)
+                result = {
+                    "case": f"locations={n_locations} degree={degree:g} costs={min_cost}-{max_cost}",
+                    "locations": n_locations,
+                    "connections": graph.number_of_edges(),
+                    "min_cost": min_cost,
+                    "max_cost": max_cost,
+                    "generator": args.generator,
+                    "seed": args.seed,
+                    "requested_encoding": args.encoding,
+                    "start": start,
+                    "destination": destination,
+                }
+                result.update(benchmark_map(graph, start, destination, stages, args.repeat, args.encoding, args.port))
+                results.append(result)
+                print(f"{result['case']:<40} {result['connections']:>11} " + " ".join(f"{result['stages'][s]['median']:9.4f}" if s in result["stages"] else f"{'-':>9}" for s in stages))
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "engine": "stub" if args.port is None else f"port {args.port}",
+                "generator": args.generator,
+                "repeat": args.repeat,
+                "results": results,
+            }, f, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if len(regressions) > 0:
+            print(f"\n{len(regressions)} regressions:")
+            for r in regressions:
+                print(f" * {r}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
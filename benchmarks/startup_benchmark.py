@@ -0,0 +1,130 @@
+# Times the cold start of the component: run.py is started --repeat times, and the time
+# from the start of the process to the first page served on "/" is measured (the time to
+# first page). The startup lines logged by the component in the last run are shown: the
+# import time breakdown, the warm-up of the render workers and of the deferred modules.
+#
+# As with the pipeline benchmark, the results can be written as JSON and compared with a
+# previous run; a time to first page slower than in the baseline by more than --tolerance
+# is reported as a regression, and the exit status is 1.
+#
+# Usage: python benchmarks/startup_benchmark.py [--repeat 5] [--port PORT] [--timeout 120]
+#            [--command "python src/run.py"] [--json FILE] [--baseline FILE] [--tolerance 0.2]
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import List, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# justpy reads its host and port from this file, in the directory it is started from
+JUSTPY_ENV = os.path.join(ROOT, "justpy.env")
+POLL_SECONDS = 0.05
+STARTUP_LOG_MARKERS = ("Imported ", "warmed up", "Warmed up", "First page served")
+
+
+def justpy_port(default: int = 8000) -> int:
+    try:
+        with open(JUSTPY_ENV) as f:
+            for line in f:
+                key, _, value = line.partition("=")
+                if key.strip() == "PORT":
+                    return int(value.strip())
+    except OSError:
+        pass
+    return default
+
+
+def time_to_first_page(command: List[str], url: str, timeout: float) -> Tuple[float, List[str]]:
+    # The seconds from the start of the command to the first complete response on url,
+    # and the startup lines logged by the component
+    with tempfile.TemporaryFile(mode="w+") as log:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"the component exited with status {process.returncode}")
+                if time.perf_counter() - start_time > timeout:
+                    raise TimeoutError(f"no page served in {timeout}s")
+                try:
+                    with urllib.request.urlopen(url, timeout=timeout) as response:
+                        response.read()
+                    seconds = time.perf_counter() - start_time
+                    break
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(POLL_SECONDS)
+            # the lines logged by the warm-up, that goes on after the first page
+            time.sleep(1)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        log.seek(0)
+        lines = [line.rstrip() for line in log if any(m in line for m in STARTUP_LOG_MARKERS)]
+    return seconds, lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="starts of the component")
+    parser.add_argument("--port", type=int, default=None, help="port of the web server, by default the one of justpy.env")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the first page")
+    parser.add_argument("--command", default=f"{shlex.quote(sys.executable)} src/run.py", help="command starting the component, run from the root of the repository")
+    parser.add_argument("--json", default=None, help="file where the results are written")
+    parser.add_argument("--baseline", default=None, help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, as a fraction of the baseline")
+    args = parser.parse_args()
+    assert args.repeat > 0
+
+    url = f"http://127.0.0.1:{args.port or justpy_port()}/"
+    command = shlex.split(args.command)
+    times = []
+    lines = []
+    for i in range(args.repeat):
+        seconds, lines = time_to_first_page(command, url, args.timeout)
+        times.append(seconds)
+        print(f"run {i + 1}: first page after {seconds:.3f}s")
+    result = {"median": statistics.median(times), "min": min(times), "max": max(times)}
+    print(f"\ntime to first page: median {result['median']:.3f}s, min {result['min']:.3f}s, max {result['max']:.3f}s")
+    if lines:
+        print("\nstartup log of the last run:")
+        for line in lines:
+            print(f"  {line}")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "command": args.command,
+                "repeat": args.repeat,
+                "time_to_first_page": result,
+                "startup_log": lines,
+            }, f, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            before = json.load(f)["time_to_first_page"]["median"]
+        ratio = result["median"] / before if before > 0 else float("inf")
+        print(f"\nbaseline {before:.3f}s, now {result['median']:.3f}s, ratio {ratio:.2f}")
+        if ratio > 1 + args.tolerance:
+            print("REGRESSION")
+            sys.exit(1)
+        print("No regression")
+
+
+if __name__ == "__main__":
+    main()
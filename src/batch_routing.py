@@ -0,0 +1,87 @@
+from numbers import Integral
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import networkx as nx
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import dijkstra
+
+# Many (start, destination) queries on one map: the map is turned once into a sparse
+# matrix and every distinct start is answered by one single-source Dijkstra, whose
+# shortest-path tree gives the routes to all its destinations.
+
+Route = Tuple[List[str], Union[int, float]]
+# scipy marks the locations without predecessor with this value
+_NO_PREDECESSOR = -9999
+
+
+def graph_matrix(graph: nx.Graph) -> Tuple[List[str], Dict[str, int], scipy.sparse.csr_matrix]:
+    # The locations, their index and the symmetric matrix of the distances; the
+    # connections of distance 0 are stored explicitly, so scipy keeps them as edges
+    nodes = list(graph)
+    index = {n: i for i, n in enumerate(nodes)}
+    edges = list(graph.edges(data="weight"))
+    rows = np.fromiter((index[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+    cols = np.fromiter((index[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+    weights = np.fromiter((w for _, _, w in edges), dtype=np.float64, count=len(edges))
+    return nodes, index, distance_matrix(len(nodes), rows, cols, weights)
+
+
+def distance_matrix(n_locations: int, rows: np.ndarray, cols: np.ndarray, weights: np.ndarray) -> scipy.sparse.csr_matrix:
+    # The symmetric matrix of the distances of the connections from rows to cols
+    weights = np.asarray(weights, dtype=np.float64)
+    return scipy.sparse.csr_matrix(
+        (np.concatenate((weights, weights)), (np.concatenate((rows, cols)), np.concatenate((cols, rows)))),
+        shape=(n_locations, n_locations),
+    )
+
+
+def _integral_weights(graph: nx.Graph) -> bool:
+    return all(isinstance(w, Integral) for _, _, w in graph.edges(data="weight"))
+
+
+def route_batch(graph: nx.Graph, pairs: Sequence[Tuple[str, str]]) -> List[Optional[Route]]:
+    # The shortest route and its cost for every pair, or None when the destination cannot
+    # be reached or a location is not in the map. The queries are grouped by start.
+    nodes, index, matrix = graph_matrix(graph)
+    sources = sorted({index[s] for s, d in pairs if s in index and d in index})
+    if len(sources) == 0:
+        return [None] * len(pairs)
+    costs, predecessors = dijkstra(matrix, directed=False, indices=sources, return_predecessors=True)
+    row_of = {s: r for r, s in enumerate(sources)}
+    integral = _integral_weights(graph)
+
+    routes = []
+    for start, destination in pairs:
+        if start not in index or destination not in index:
+            routes.append(None)
+            continue
+        row, target = row_of[index[start]], index[destination]
+        cost = costs[row, target]
+        if not np.isfinite(cost):
+            routes.append(None)
+            continue
+        path = [target]
+        while path[-1] != index[start]:
+            path.append(predecessors[row, path[-1]])
+        routes.append(([nodes[i] for i in reversed(path)], int(round(cost)) if integral else float(cost)))
+    return routes
+
+
+def cost_matrix(graph: nx.Graph, locations: Optional[Sequence[str]] = None, sparse: bool = False) -> Tuple[List[str], Union[np.ndarray, scipy.sparse.csr_matrix]]:
+    # The costs between all the given locations (all the map by default), in their order.
+    # The dense matrix has inf for the pairs that are not connected; the sparse one stores
+    # only the connected pairs, including those with cost 0. The dense matrix of a map with
+    # n locations takes 8 n^2 bytes.
+    nodes, index, matrix = graph_matrix(graph)
+    if locations is None:
+        locations = nodes
+    selected = np.array([index[l] for l in locations], dtype=np.int64)
+    if len(selected) == 0:
+        costs = np.zeros((0, 0))
+    else:
+        costs = dijkstra(matrix, directed=False, indices=selected)[:, selected]
+    if not sparse:
+        return list(locations), costs
+    rows, cols = np.nonzero(np.isfinite(costs))
+    return list(locations), scipy.sparse.csr_matrix((costs[rows, cols], (rows, cols)), shape=costs.shape)
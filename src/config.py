@@ -0,0 +1,19 @@
+import json
+import logging
+import os
+
+# The component settings are stored in the config.json at the root of the repository;
+# every module reads the keys it needs from here and falls back on its own default
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config.json")
+
+
+def load_config(config_file: str = CONFIG_FILE) -> dict:
+    try:
+        with open(config_file) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read {config_file} ({e}); using the default configuration")
+        return {}
+
+
+CONFIG = load_config()
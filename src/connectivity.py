@@ -0,0 +1,94 @@
+from typing import Dict, Hashable, Iterable
+
+import networkx as nx
+
+from graph_events import Connection, GraphListener
+
+
+class ConnectivityIndex(GraphListener):
+    # The connected components of the graph of a Gui, kept in a union-find: an added
+    # location or connection is merged in almost constant time. A removal can split a
+    # component, which a union-find cannot undo, so after a removal the index is rebuilt
+    # from the graph at the next query, in linear time; a burst of edits costs at most one
+    # rebuild.
+    def __init__(self, graph: nx.Graph):
+        self.graph = graph
+        self.rebuilds = 0
+        self._rebuild()
+
+    def _rebuild(self):
+        self._parent: Dict[Hashable, Hashable] = {n: n for n in self.graph}
+        self._size: Dict[Hashable, int] = dict.fromkeys(self.graph, 1)
+        self.components = len(self._parent)
+        for u, v in self.graph.edges:
+            self._union(u, v)
+        self._stale = False
+        self.rebuilds += 1
+
+    def _refresh(self):
+        if self._stale:
+            self._rebuild()
+
+    def _add(self, location: Hashable):
+        if location not in self._parent:
+            self._parent[location] = location
+            self._size[location] = 1
+            self.components += 1
+
+    def _find(self, location: Hashable) -> Hashable:
+        parent = self._parent
+        root = location
+        while parent[root] != root:
+            root = parent[root]
+        # path compression
+        while parent[location] != root:
+            parent[location], location = root, parent[location]
+        return root
+
+    def _union(self, a: Hashable, b: Hashable):
+        a, b = self._find(a), self._find(b)
+        if a == b:
+            return
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size[b]
+        self.components -= 1
+
+    def connected(self, a: Hashable, b: Hashable) -> bool:
+        # Whether b can be reached from a; False if one of them is not in the map
+        self._refresh()
+        if a not in self._parent or b not in self._parent:
+            return False
+        return self._find(a) == self._find(b)
+
+    def component_count(self) -> int:
+        self._refresh()
+        return self.components
+
+    def on_graph_replaced(self, graph: nx.Graph):
+        self.graph = graph
+        self._stale = True
+
+    def on_locations_added(self, locations: Iterable[str], connections: Iterable[Connection]):
+        if self._stale:
+            return
+        for location in locations:
+            self._add(location)
+        for f, t, _ in connections:
+            self._add(f)
+            self._add(t)
+            self._union(f, t)
+
+    def on_locations_removed(self, locations: Iterable[str], connections: Iterable[Connection]):
+        self._stale = True
+
+    def on_connection_added(self, l_from: str, l_to: str, distance: int):
+        if self._stale:
+            return
+        self._add(l_from)
+        self._add(l_to)
+        self._union(l_from, l_to)
+
+    def on_connection_removed(self, l_from: str, l_to: str):
+        self._stale = True
@@ -0,0 +1,206 @@
+import logging
+import queue
+import time
+from concurrent.futures import Future, wait
+from functools import partial
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import grpc
+import networkx as nx
+from unified_planning.shortcuts import *
+from up_graphene_engine.engine import GrapheneEngine
+
+from config import CONFIG
+from problem_model import ProblemModel, expressions_lock
+
+# The port of the planning engine
+ENGINE_PORT = CONFIG.get("grpcport", 8061)
+# Connections to the engine; by default one for every planning worker
+ENGINE_POOL_SIZE = CONFIG.get("engine_pool_size", None)
+# Seconds between the checks of the idle connections, and the time a check can take
+HEALTH_CHECK_INTERVAL = CONFIG.get("engine_health_interval", 30)
+HEALTH_CHECK_TIMEOUT = 10
+# Bounds of the wait before connecting again to an engine that does not answer
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+# The gRPC options of the channels of the pooled engines: the channels are pinged while
+# idle, so a connection dropped by the engine or the network is noticed, and reopened,
+# before a NAVIGATE waits on it
+ENGINE_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+]
+
+
+# The calls running in call_in_thread, by the object they use (by default the object of
+# the method called), so that an engine is closed only when its last call is over
+_running: Dict[int, Set[Future]] = {}
+_running_lock = Lock()
+
+
+def call_in_thread(function, *args, owner: Any = None) -> Future:
+    # Runs a blocking call in its own daemon thread. A solve cannot be interrupted, so a
+    # cancelled or timed out one is left running there, without holding a planning worker
+    # or the exit of the program
+    future = Future()
+    owner = getattr(function, "__self__", None) if owner is None else owner
+    if owner is not None:
+        with _running_lock:
+            _running.setdefault(id(owner), set()).add(future)
+        future.add_done_callback(partial(_call_done, id(owner)))
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(function(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    Thread(target=run, daemon=True).start()
+    return future
+
+
+def _call_done(owner: int, future: Future):
+    with _running_lock:
+        futures = _running.get(owner)
+        if futures is not None:
+            futures.discard(future)
+            if not futures:
+                del _running[owner]
+
+
+def running_calls(owner: Any) -> List[Future]:
+    with _running_lock:
+        return list(_running.get(id(owner), ()))
+
+
+def close_engine(engine: GrapheneEngine):
+    # Releases the resources of an engine, and the gRPC channels it holds
+    try:
+        engine.destroy()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Could not close a planning engine: {e!r}")
+    for value in list(getattr(engine, "__dict__", {}).values()):
+        if isinstance(value, grpc.Channel):
+            value.close()
+
+
+def _check_problem():
+    # The smallest travelling-costs problem, solved to check that an engine answers; every
+    # check gets its own, as the engine reads it outside expressions_lock
+    graph = nx.Graph()
+    graph.add_edge("L_1", "L_2", weight=1)
+    with expressions_lock:
+        problem, _ = ProblemModel(graph).problem_for("L_1", "L_2")
+    return problem
+
+
+class EnginePool():
+    # Connections to the planning engine shared by the planning workers. Every connection
+    # solves a trivial problem before it is handed out, so the first NAVIGATE does not pay
+    # for connecting and for the first solve of the engine; the idle connections are
+    # checked in the background and replaced when the engine does not answer, e.g. after
+    # it was restarted.
+    def __init__(self, size: int, port: int = ENGINE_PORT, factory: Callable[..., GrapheneEngine] = GrapheneEngine):
+        assert size > 0
+        self.size = size
+        self.port = port
+        self.factory = factory
+        self._idle: "queue.Queue[GrapheneEngine]" = queue.Queue()
+        self._lock = Lock()
+        self._started = False
+        self.connections = 0
+        self.closed = 0
+        self.failed_checks = 0
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        # Connects and warms up the engines in the background
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            Thread(target=self._connect, daemon=True).start()
+        Thread(target=self._health_check_thread, daemon=True).start()
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[GrapheneEngine]:
+        # A warmed up engine, or None if none is ready within timeout
+        self.start()
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, engine: GrapheneEngine, healthy: bool = True):
+        # Gives back an engine; a broken one, or one still used by an abandoned solve,
+        # is replaced by a new connection
+        if healthy:
+            self._idle.put(engine)
+        else:
+            self._retire(engine)
+            Thread(target=self._connect, daemon=True).start()
+
+    def _retire(self, engine: GrapheneEngine):
+        # Closes an engine that is not used anymore, once the calls still running on it
+        # (e.g. an abandoned solve) are over
+        def close():
+            wait(running_calls(engine))
+            close_engine(engine)
+            with self._lock:
+                self.closed += 1
+        Thread(target=close, daemon=True).start()
+
+    def _check(self, engine: GrapheneEngine) -> bool:
+        problem = _check_problem()
+        try:
+            res = call_in_thread(engine.solve, problem, OptimalityGuarantee.SOLVED_OPTIMALLY).result(timeout=HEALTH_CHECK_TIMEOUT)
+            return res.plan is not None
+        except Exception as e:
+            self.logger.warning(f"The planning engine on port {self.port} did not answer: {e!r}")
+            return False
+
+    def _connect(self):
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            start_time = time.perf_counter()
+            engine = None
+            try:
+                engine = self.factory(port=self.port, options=ENGINE_CHANNEL_OPTIONS)
+                if self._check(engine):
+                    with self._lock:
+                        self.connections += 1
+                    self.logger.info(f"Connected to the planning engine on port {self.port} in {time.perf_counter() - start_time:.3f}s")
+                    self._idle.put(engine)
+                    return
+            except Exception as e:
+                self.logger.warning(f"Could not connect to the planning engine on port {self.port}: {e!r}")
+            if engine is not None:
+                self._retire(engine)
+            time.sleep(delay)
+            delay = min(2 * delay, RECONNECT_MAX_DELAY)
+
+    def _health_check_thread(self):
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            # every idle engine is checked once; the busy ones are in use anyway
+            for _ in range(self._idle.qsize()):
+                try:
+                    engine = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                healthy = self._check(engine)
+                if not healthy:
+                    with self._lock:
+                        self.failed_checks += 1
+                self.release(engine, healthy)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "connections": self.connections,
+            "closed": self.closed,
+            "failed_checks": self.failed_checks,
+        }
@@ -0,0 +1,108 @@
+import io
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import matplotlib.image
+import networkx as nx
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+FIGSIZE = 8, 8
+NODE_SIZE = 400
+NODE_LABEL_FONT_SIZE = 8
+EDGE_LABEL_FONT_SIZE = 8
+LARGE_MAP_NODE_SIZE = 20
+LARGE_MAP_EDGE_WIDTH = 0.3
+# zlib level of the images; the maps are mostly flat colours, so a fast level is almost as small
+PNG_COMPRESS_LEVEL = 1
+
+
+class GraphCanvas():
+    # A matplotlib figure kept between the redraws of a Gui. It is not registered in
+    # pyplot, so it is freed with the Gui. The connections and distances are drawn once
+    # per layout and saved as a background, and the texts above the locations (their
+    # names) are saved as a transparent layer; a redraw that only changes colours restores
+    # the background, draws the recoloured locations and puts the texts back on top,
+    # without laying out or rendering any text again, in the z-order of a full draw.
+    def __init__(self, figsize=FIGSIZE):
+        self.figure = Figure(figsize=figsize)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        self._graph_hash: Optional[str] = None
+        self._positions: Optional[Dict[Hashable, np.ndarray]] = None
+        self._labels: Optional[bool] = None
+        self._node_order: List[Hashable] = []
+        self._background = None
+        self._nodes = None
+        # the pixels covered by the texts drawn above the locations and their colour
+        self._label_pixels: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self.full_draws = 0
+        self.recolours = 0
+
+    def render(self, graph: nx.Graph, graph_hash: str, positions: Dict[Hashable, np.ndarray], node_colors: List[str], labels: bool) -> bytes:
+        # the colours are given in the order of the graph, as the artists were drawn
+        node_order = list(graph)
+        if graph_hash != self._graph_hash or positions is not self._positions or labels != self._labels or node_order != self._node_order:
+            self._draw(graph, positions, node_colors, labels)
+            self._graph_hash, self._positions, self._labels, self._node_order = graph_hash, positions, labels, node_order
+            self.full_draws += 1
+        else:
+            self.canvas.restore_region(self._background)
+            if self._nodes is not None:
+                self._nodes.set_facecolor(node_colors)
+            self.recolours += 1
+
+        if self._nodes is not None:
+            self.ax.draw_artist(self._nodes)
+        pixels = np.asarray(self.canvas.buffer_rgba())[:, :, :3]
+        if self._label_pixels is not None:
+            rows, columns, label_colors = self._label_pixels
+            alpha = label_colors[:, 3:].astype(np.uint16)
+            under = pixels[rows, columns].astype(np.uint16)
+            pixels = pixels.copy()
+            pixels[rows, columns] = ((label_colors[:, :3] * alpha + under * (255 - alpha) + 127) // 255).astype(np.uint8)
+
+        image = io.BytesIO()
+        matplotlib.image.imsave(image, pixels, format="png", pil_kwargs={"compress_level": PNG_COMPRESS_LEVEL})
+        return image.getvalue()
+
+    def _draw(self, graph: nx.Graph, positions: Dict[Hashable, np.ndarray], node_colors: List[str], labels: bool):
+        ax = self.ax
+        ax.clear()
+        ax.set_axis_off()
+        if labels:
+            nx.draw_networkx_edges(graph, positions, ax=ax)
+            edge_labels = {(u, v): graph[u][v]["weight"] for u, v in graph.edges}
+            edge_texts = list(nx.draw_networkx_edge_labels(graph, positions, edge_labels=edge_labels, ax=ax, font_color='black', font_size=EDGE_LABEL_FONT_SIZE,).values())
+            self._nodes = nx.draw_networkx_nodes(graph, positions, ax=ax, node_color=node_colors, node_size=NODE_SIZE)
+            node_labels = list(nx.draw_networkx_labels(graph, positions, ax=ax, font_size=NODE_LABEL_FONT_SIZE, font_weight="bold").values())
+        else:
+            nx.draw_networkx_edges(graph, positions, ax=ax, width=LARGE_MAP_EDGE_WIDTH)
+            self._nodes = nx.draw_networkx_nodes(graph, positions, ax=ax, node_color=node_colors, node_size=LARGE_MAP_NODE_SIZE)
+            edge_texts, node_labels = [], []
+
+        # The texts that a full draw puts above the locations go in the layer composited after
+        # them, in z-order: the names, and the distances if networkx draws them above the
+        # locations (networkx 3.6 draws them below, with zorder 1 against 2)
+        above = []
+        if self._nodes is not None:
+            nodes_zorder = self._nodes.get_zorder()
+            above = [t for t in edge_texts if t.get_zorder() > nodes_zorder] + [t for t in node_labels if t.get_zorder() >= nodes_zorder]
+            above.sort(key=lambda t: t.get_zorder())
+
+        # The locations and the texts above them are left out of the background
+        for artist in ([] if self._nodes is None else [self._nodes]) + above:
+            artist.set_animated(True)
+        self.canvas.draw()
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+        self._label_pixels = None
+        if above:
+            renderer = self.canvas.get_renderer()
+            renderer.clear()
+            for artist in above:
+                ax.draw_artist(artist)
+            layer = np.asarray(self.canvas.buffer_rgba())
+            rows, columns = np.nonzero(layer[:, :, 3])
+            self._label_pixels = rows, columns, layer[rows, columns].astype(np.uint16)
+            self.canvas.restore_region(self._background)
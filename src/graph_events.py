@@ -0,0 +1,30 @@
+from typing import Iterable, Tuple
+
+import networkx as nx
+
+
+# A connection is given as (location, location, distance)
+Connection = Tuple[str, str, int]
+
+
+class GraphListener():
+    # Notified by the Gui after every change of its graph, so that the structures derived
+    # from the graph can be updated with the change instead of being rebuilt from scratch.
+    # The default implementation ignores all the changes.
+
+    def on_graph_replaced(self, graph: nx.Graph):
+        pass
+
+    def on_locations_added(self, locations: Iterable[str], connections: Iterable[Connection]):
+        pass
+
+    def on_locations_removed(self, locations: Iterable[str], connections: Iterable[Connection]):
+        # connections are the ones removed together with the locations
+        pass
+
+    def on_connection_added(self, l_from: str, l_to: str, distance: int):
+        # also called when the distance of an existing connection changes
+        pass
+
+    def on_connection_removed(self, l_from: str, l_to: str):
+        pass
@@ -0,0 +1,271 @@
+import logging
+import random
+import subprocess
+import time
+from typing import Dict, FrozenSet, Hashable, Iterable, Optional
+
+import networkx as nx
+import numpy as np
+
+from config import CONFIG
+
+# If more than this fraction of the locations is affected by the changes since the last
+# layout, the layout is computed again from scratch instead of being relaxed locally
+FULL_LAYOUT_AFFECTED_FRACTION = 0.5
+RELAX_ITERATIONS = 50
+LAYOUT_SEED = 0
+
+# The layout engines, chosen by the size of the map:
+# - "kamada_kawai": the best looking one, but it needs all-pairs shortest paths and is
+#   roughly cubic in the number of locations,
+# - "sfdp": the multilevel force-directed layout of Graphviz, used if pygraphviz is installed,
+# - "force": a NumPy force-directed layout where the repulsion is computed only between
+#   locations in neighbouring cells of a grid, so an iteration is linear in the map size;
+#   also used to relax the layout after an edit.
+LAYOUT_KAMADA_KAWAI = "kamada_kawai"
+LAYOUT_SFDP = "sfdp"
+LAYOUT_FORCE = "force"
+KAMADA_KAWAI_MAX_LOCATIONS = 200
+FORCE_ITERATIONS = 100
+# Seconds a layout may take. Kamada-Kawai and the force layout check the time at every
+# iteration and keep the positions reached when the budget is over; sfdp cannot be
+# stopped halfway, so it is killed after this fraction of the budget and the force
+# layout uses the rest
+LAYOUT_TIME_BUDGET = CONFIG.get("layout_time_budget", 3.0)
+SFDP_BUDGET_FRACTION = 2 / 3
+
+try:
+    import pygraphviz
+    HAS_GRAPHVIZ = True
+except ImportError:
+    HAS_GRAPHVIZ = False
+
+
+def choose_layout_engine(n_locations: int) -> str:
+    if n_locations <= KAMADA_KAWAI_MAX_LOCATIONS:
+        return LAYOUT_KAMADA_KAWAI
+    return LAYOUT_SFDP if HAS_GRAPHVIZ else LAYOUT_FORCE
+
+
+def sfdp_layout(graph: nx.Graph, scale: float, timeout: Optional[float] = None) -> Dict[Hashable, np.ndarray]:
+    # What nx.nx_agraph.graphviz_layout does, but sfdp is killed (raising
+    # subprocess.TimeoutExpired) if it runs for more than timeout seconds
+    agraph = nx.nx_agraph.to_agraph(graph)
+    output = subprocess.run(["sfdp", "-Tdot"], input=agraph.string().encode(), capture_output=True, check=True, timeout=timeout).stdout
+    laid_out = pygraphviz.AGraph(string=output.decode())
+    pos = {n: np.array([float(c) for c in laid_out.get_node(str(n)).attr["pos"].split(",")[:2]]) for n in graph}
+    return nx.rescale_layout_dict(pos, scale=scale)
+
+
+def _kamada_kawai_cost(pos_vec: np.ndarray, invdist: np.ndarray, meanweight: float):
+    # The energy of the springs between all the pairs of locations, whose rest lengths
+    # are their distances on the map, and its gradient; as in networkx
+    pos = pos_vec.reshape(-1, 2)
+    n = len(pos)
+    delta = pos[:, None, :] - pos[None, :, :]
+    nodesep = np.linalg.norm(delta, axis=-1)
+    direction = delta / (nodesep + np.eye(n) * 1e-3)[:, :, None]
+    offset = nodesep * invdist - 1.0
+    offset[np.diag_indices(n)] = 0
+    cost = 0.5 * np.sum(offset ** 2)
+    grad = np.einsum("ij,ij,ijk->ik", invdist, offset, direction) - np.einsum("ij,ij,ijk->jk", invdist, offset, direction)
+    # keeps the centre of mass at the origin
+    sumpos = pos.sum(axis=0)
+    cost += 0.5 * meanweight * np.sum(sumpos ** 2)
+    grad += meanweight * sumpos
+    return cost, grad.ravel()
+
+
+def kamada_kawai_layout(graph: nx.Graph, scale: float, deadline: Optional[float] = None) -> Dict[Hashable, np.ndarray]:
+    # nx.kamada_kawai_layout, stopping the minimization at the deadline
+    from scipy.optimize import minimize
+    nodes = list(graph)
+    index = {node: i for i, node in enumerate(nodes)}
+    dist = np.full((len(nodes), len(nodes)), 1e6)
+    for source, lengths in nx.shortest_path_length(graph, weight="weight"):
+        dist[index[source], [index[n] for n in lengths]] = list(lengths.values())
+    # the locations at distance 0 are kept slightly apart: nx.kamada_kawai_layout divides
+    # by their distance, and the minimization stops at its first step
+    dist = np.maximum(dist, 1e-3)
+    initial = nx.circular_layout(graph)
+    def stop_at_deadline(xk):
+        if deadline is not None and time.perf_counter() > deadline:
+            raise StopIteration
+    result = minimize(
+        _kamada_kawai_cost,
+        np.array([initial[n] for n in nodes]).ravel(),
+        args=(1 / dist, 1e-3),
+        method="L-BFGS-B",
+        jac=True,
+        callback=stop_at_deadline,
+    )
+    return dict(zip(nodes, nx.rescale_layout(result.x.reshape(-1, 2), scale=scale)))
+
+
+def force_layout(
+    graph: nx.Graph,
+    scale: float,
+    pos: Optional[Dict[Hashable, np.ndarray]] = None,
+    fixed: Optional[Iterable[Hashable]] = None,
+    iterations: int = FORCE_ITERATIONS,
+    deadline: Optional[float] = None,
+) -> Dict[Hashable, np.ndarray]:
+    # Fruchterman-Reingold, with the repulsion cut off at twice the optimal distance:
+    # only the locations in the 9 grid cells around a location push it away
+    nodes = list(graph)
+    n = len(nodes)
+    if n == 0:
+        return {}
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in graph.edges if u != v], dtype=np.int64).reshape(-1, 2)
+
+    rng = np.random.default_rng(LAYOUT_SEED)
+    x = rng.uniform(-scale, scale, (n, 2))
+    if pos is not None:
+        for node, p in pos.items():
+            if node in index:
+                x[index[node]] = p
+    movable = np.ones(n, dtype=bool)
+    if fixed is not None:
+        movable[[index[node] for node in fixed]] = False
+    # Only the forces acting on the movable locations are computed
+    active = np.flatnonzero(movable)
+    active_edges = edges[movable[edges[:, 0]] | movable[edges[:, 1]]]
+    cell_offsets = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+    k = 2 * scale / np.sqrt(n)
+    cell = 2 * k
+    temperature = 0.1 * scale
+    cooling = temperature / (iterations + 1)
+    # The time of an iteration grows with the pairs of locations in neighbouring cells,
+    # that grow as the layout contracts: an iteration is not started if, at the speed of
+    # the previous one, it would end after the deadline
+    seconds_per_pair = None
+    for _ in range(iterations):
+        iteration_start = time.perf_counter()
+        if deadline is not None and iteration_start > deadline:
+            break
+        disp = np.zeros((n, 2))
+
+        # Repulsion between the locations of neighbouring cells
+        cells = np.floor((x - x.min(axis=0)) / cell).astype(np.int64)
+        width = cells[:, 1].max() + 3
+        keys = cells[:, 0] * width + cells[:, 1] + 1
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        neighbour_keys = (keys[active][None, :] + (cell_offsets[:, 0] * width + cell_offsets[:, 1])[:, None]).ravel()
+        lo = np.searchsorted(sorted_keys, neighbour_keys, "left")
+        counts = np.searchsorted(sorted_keys, neighbour_keys, "right") - lo
+        pairs = max(int(counts.sum()), 1)
+        if deadline is not None and seconds_per_pair is not None and time.perf_counter() + seconds_per_pair * pairs > deadline:
+            break
+        i = np.repeat(np.tile(active, len(cell_offsets)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(lo, counts) + offsets]
+        delta = x[i] - x[j]
+        dist2 = (delta ** 2).sum(axis=1)
+        near = (dist2 < cell ** 2) & (i != j)
+        force = delta[near] * (k * k / np.maximum(dist2[near], 1e-9))[:, None]
+        disp[:, 0] += np.bincount(i[near], weights=force[:, 0], minlength=n)
+        disp[:, 1] += np.bincount(i[near], weights=force[:, 1], minlength=n)
+
+        # Attraction along the connections
+        if len(active_edges) > 0:
+            u, v = active_edges[:, 0], active_edges[:, 1]
+            delta = x[u] - x[v]
+            dist = np.sqrt((delta ** 2).sum(axis=1))
+            force = delta * (dist / k)[:, None]
+            disp[:, 0] += np.bincount(v, weights=force[:, 0], minlength=n) - np.bincount(u, weights=force[:, 0], minlength=n)
+            disp[:, 1] += np.bincount(v, weights=force[:, 1], minlength=n) - np.bincount(u, weights=force[:, 1], minlength=n)
+
+        length = np.maximum(np.sqrt((disp[active] ** 2).sum(axis=1)), 1e-9)
+        x[active] += disp[active] * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+        seconds_per_pair = (time.perf_counter() - iteration_start) / pairs
+
+    if fixed is None:
+        x = nx.rescale_layout(x, scale=scale)
+    return dict(zip(nodes, x))
+
+
+class LayoutCache():
+    # Keeps the positions of the last layout with the locations and connections it was
+    # computed for: a redraw that only changes colours or distances reuses them, and
+    # after an edit only the new or affected locations are moved, starting from their
+    # previous positions, so the map doesn't jump around.
+    def __init__(self, scale: float = 1):
+        self.scale = scale
+        self.positions: Dict[Hashable, np.ndarray] = {}
+        self._nodes: FrozenSet[Hashable] = frozenset()
+        self._edges: FrozenSet[FrozenSet[Hashable]] = frozenset()
+        self.full_layouts = 0
+        self.relaxed_layouts = 0
+        self.reused_layouts = 0
+        self.last_layout_engine: Optional[str] = None
+        self.last_layout_seconds = 0.0
+        self.logger = logging.getLogger(__name__)
+
+    def layout(self, graph: nx.Graph) -> Dict[Hashable, np.ndarray]:
+        nodes = frozenset(graph.nodes)
+        edges = frozenset(frozenset(edge) for edge in graph.edges)
+        if nodes == self._nodes and edges == self._edges:
+            self.reused_layouts += 1
+            return self.positions
+
+        affected = set(nodes - self._nodes)
+        for edge in edges ^ self._edges:
+            affected.update(edge)
+        affected &= nodes
+
+        start_time = time.perf_counter()
+        deadline = start_time + LAYOUT_TIME_BUDGET
+        positions = {n: p for n, p in self.positions.items() if n in nodes}
+        if len(positions) == 0 or len(affected) > FULL_LAYOUT_AFFECTED_FRACTION * len(nodes):
+            self.positions = self._full_layout(graph, deadline)
+            self.full_layouts += 1
+        elif len(affected) > 0:
+            self.positions = self._relax(graph, positions, affected, deadline)
+            self.relaxed_layouts += 1
+        else:
+            # only locations were removed
+            self.positions = positions
+            self.reused_layouts += 1
+            self.last_layout_engine = None
+        self.last_layout_seconds = time.perf_counter() - start_time
+        self.logger.info(f"Layout of {len(nodes)} locations with {self.last_layout_engine} took {self.last_layout_seconds:.3f}s")
+        self._nodes, self._edges = nodes, edges
+        return self.positions
+
+    def _full_layout(self, graph: nx.Graph, deadline: float) -> Dict[Hashable, np.ndarray]:
+        self.last_layout_engine = choose_layout_engine(len(graph))
+        if len(graph) == 0:
+            return {}
+        if self.last_layout_engine == LAYOUT_KAMADA_KAWAI:
+            return kamada_kawai_layout(graph, self.scale, deadline)
+        if self.last_layout_engine == LAYOUT_SFDP:
+            try:
+                return sfdp_layout(graph, self.scale, timeout=SFDP_BUDGET_FRACTION * max(deadline - time.perf_counter(), 0))
+            except Exception as e:
+                self.logger.warning(f"sfdp layout failed ({e}); using the force layout")
+                self.last_layout_engine = LAYOUT_FORCE
+        return force_layout(graph, self.scale, deadline=deadline)
+
+    def _relax(self, graph: nx.Graph, positions: Dict[Hashable, np.ndarray], affected: set, deadline: float) -> Dict[Hashable, np.ndarray]:
+        rng = random.Random(LAYOUT_SEED)
+        # The new locations start next to their already placed neighbours
+        jitter = 0.05 * self.scale
+        for node in affected:
+            if node in positions:
+                continue
+            placed = [positions[n] for n in graph[node] if n in positions]
+            if placed:
+                center = np.mean(placed, axis=0)
+            else:
+                center = np.array([rng.uniform(-self.scale, self.scale), rng.uniform(-self.scale, self.scale)])
+            positions[node] = center + np.array([rng.uniform(-jitter, jitter), rng.uniform(-jitter, jitter)])
+
+        fixed = [n for n in positions if n not in affected]
+        if len(fixed) == 0:
+            return self._full_layout(graph, deadline)
+        self.last_layout_engine = LAYOUT_FORCE
+        return force_layout(graph, self.scale, pos=positions, fixed=fixed, iterations=RELAX_ITERATIONS, deadline=deadline)
@@ -0,0 +1,195 @@
+// In-browser renderer of the travelling-costs map, used with "render_mode": "svg".
+// The server sends the whole map once with load() and then only the changes with apply():
+//  - nodes: {name: [x, y, color]} new or moved locations,
+//  - colors: {name: color} locations that only changed color,
+//  - remove_nodes: [name, ...],
+//  - edges: [[from, to, distance], ...] new connections or changed distances,
+//  - remove_edges: [[from, to], ...],
+//  - labels: whether location and distance labels are drawn.
+window.travellingCostsGraph = (function () {
+    const SVG_NS = "http://www.w3.org/2000/svg";
+    const CONTAINER_CLASS = "tc-graph-svg";
+    const NODE_RADIUS = 0.035;
+    const SMALL_NODE_RADIUS = 0.008;
+    const FONT_SIZE = 0.03;
+
+    let state = {nodes: {}, edges: {}, labels: true};
+    let svg = null;
+    let nodeElements = {};
+    let edgeElements = {};
+
+    function edgeKey(from, to) {
+        return from < to ? from + "\u0000" + to : to + "\u0000" + from;
+    }
+
+    function element(tag, attributes, parent) {
+        const e = document.createElementNS(SVG_NS, tag);
+        for (const name in attributes) {
+            e.setAttribute(name, attributes[name]);
+        }
+        parent.appendChild(e);
+        return e;
+    }
+
+    function container() {
+        return document.querySelector("." + CONTAINER_CLASS);
+    }
+
+    function ensureSvg() {
+        // The svg is created again if the container was re-rendered by the page
+        const parent = container();
+        if (parent === null) {
+            return false;
+        }
+        if (svg === null || !parent.contains(svg)) {
+            parent.innerHTML = "";
+            svg = element("svg", {viewBox: "-1.1 -1.1 2.2 2.2", width: "100%"}, parent);
+            svg.appendChild(document.createElementNS(SVG_NS, "g"));
+            svg.appendChild(document.createElementNS(SVG_NS, "g"));
+            nodeElements = {};
+            edgeElements = {};
+            for (const key in state.edges) {
+                drawEdge(key);
+            }
+            for (const name in state.nodes) {
+                drawNode(name);
+            }
+            fitView();
+        }
+        return true;
+    }
+
+    function fitView() {
+        // The layout is relaxed after the edits, so the locations can leave the initial box
+        let minX = -1, minY = -1, maxX = 1, maxY = 1;
+        for (const name in state.nodes) {
+            const [x, y] = state.nodes[name];
+            minX = Math.min(minX, x);
+            maxX = Math.max(maxX, x);
+            minY = Math.min(minY, -y);
+            maxY = Math.max(maxY, -y);
+        }
+        const margin = 0.1;
+        svg.setAttribute("viewBox", `${minX - margin} ${minY - margin} ${maxX - minX + 2 * margin} ${maxY - minY + 2 * margin}`);
+    }
+
+    function drawNode(name) {
+        const [x, y, color] = state.nodes[name];
+        let e = nodeElements[name];
+        if (e === undefined) {
+            const group = element("g", {}, svg.lastChild);
+            e = {
+                circle: element("circle", {}, group),
+                label: element("text", {"text-anchor": "middle", "dominant-baseline": "central", "font-size": FONT_SIZE, "font-weight": "bold"}, group),
+                group: group,
+            };
+            nodeElements[name] = e;
+        }
+        // y grows downwards in svg
+        e.circle.setAttribute("cx", x);
+        e.circle.setAttribute("cy", -y);
+        e.circle.setAttribute("r", state.labels ? NODE_RADIUS : SMALL_NODE_RADIUS);
+        e.circle.setAttribute("fill", color);
+        e.label.setAttribute("x", x);
+        e.label.setAttribute("y", -y);
+        e.label.textContent = state.labels ? name : "";
+    }
+
+    function drawEdge(key) {
+        const [from, to, distance] = state.edges[key];
+        const a = state.nodes[from], b = state.nodes[to];
+        if (a === undefined || b === undefined) {
+            return;
+        }
+        let e = edgeElements[key];
+        if (e === undefined) {
+            const group = element("g", {}, svg.firstChild);
+            e = {
+                line: element("line", {stroke: "black", "stroke-width": 0.004}, group),
+                label: element("text", {"text-anchor": "middle", "dominant-baseline": "central", "font-size": FONT_SIZE}, group),
+                group: group,
+            };
+            edgeElements[key] = e;
+        }
+        e.line.setAttribute("x1", a[0]);
+        e.line.setAttribute("y1", -a[1]);
+        e.line.setAttribute("x2", b[0]);
+        e.line.setAttribute("y2", -b[1]);
+        e.label.setAttribute("x", (a[0] + b[0]) / 2);
+        e.label.setAttribute("y", -(a[1] + b[1]) / 2);
+        e.label.textContent = state.labels ? distance : "";
+    }
+
+    function removeNode(name) {
+        delete state.nodes[name];
+        if (nodeElements[name] !== undefined) {
+            nodeElements[name].group.remove();
+            delete nodeElements[name];
+        }
+    }
+
+    function removeEdge(key) {
+        delete state.edges[key];
+        if (edgeElements[key] !== undefined) {
+            edgeElements[key].group.remove();
+            delete edgeElements[key];
+        }
+    }
+
+    function load(data) {
+        state = {nodes: {}, edges: {}, labels: true};
+        svg = null;
+        apply(data);
+    }
+
+    function apply(diff) {
+        const relabel = diff.labels !== undefined && diff.labels !== state.labels;
+        if (diff.labels !== undefined) {
+            state.labels = diff.labels;
+        }
+        for (const [from, to] of diff.remove_edges || []) {
+            removeEdge(edgeKey(from, to));
+        }
+        for (const name of diff.remove_nodes || []) {
+            removeNode(name);
+        }
+        for (const name in diff.nodes || {}) {
+            state.nodes[name] = diff.nodes[name];
+        }
+        for (const name in diff.colors || {}) {
+            state.nodes[name][2] = diff.colors[name];
+        }
+        for (const [from, to, distance] of diff.edges || []) {
+            state.edges[edgeKey(from, to)] = [from, to, distance];
+        }
+        if (!ensureSvg()) {
+            return;
+        }
+        if (relabel) {
+            svg = null;
+            ensureSvg();
+            return;
+        }
+        for (const [from, to] of diff.edges || []) {
+            drawEdge(edgeKey(from, to));
+        }
+        const moved = new Set(Object.keys(diff.nodes || {}));
+        for (const name of moved) {
+            drawNode(name);
+        }
+        if (moved.size > 0) {
+            for (const key in edgeElements) {
+                const [from, to] = state.edges[key];
+                if (moved.has(from) || moved.has(to)) {
+                    drawEdge(key);
+                }
+            }
+            fitView();
+        }
+        for (const name in diff.colors || {}) {
+            nodeElements[name].circle.setAttribute("fill", diff.colors[name]);
+        }
+    }
+
+    return {load: load, apply: apply};
+})();
@@ -1,10 +1,13 @@
 
 import asyncio
+import time
+import uuid
 import networkx as nx
-import matplotlib.pyplot as plt
 from enum import Enum, auto
-from networkx import Graph, dense_gnm_random_graph
-from random import randint
+from concurrent.futures import Future
+from functools import partial
+from networkx import Graph
+from typing import Callable, List, Optional, Tuple
 
 import random
 import logging
@@ -17,6 +20,16 @@ import justpy as jp
 import unified_planning as up
 from unified_planning.shortcuts import *
 
+from connectivity import ConnectivityIndex
+from graph_events import GraphListener
+from map_generators import random_map
+from map_style import DESTINATION_NODE_COLOR, LABELS_MAX_LOCATIONS, NORMAL_NODE_COLOR, PATH_COLOR, START_NODE_COLOR, UNREACHABLE_NODE_COLOR
+import metrics
+from config import CONFIG
+from vector_renderer import VectorRenderer
+from plan_cache import canonical_graph_hash
+from render_store import RenderStore, render_key
+from render_worker import RenderRequest, RenderWorker
 
 
 N_STARTING_LOCATIONS = 4
@@ -26,15 +39,19 @@ BUTTON_CLASS = 'bg-transparent hover:bg-blue-500 text-blue-700 font-semibold hov
 
 GRAPH_IMAGE_LOCATION = "/logos/generated/graph"
 GRAPH_IMAGE_DIMENSIONS = "height: 400px; length: 400px;"
+# Bounds of the generated images kept on disk; identical renders share one image
+RENDER_STORE_ENTRIES = CONFIG.get("render_store_entries", 256)
+RENDER_STORE_BYTES = CONFIG.get("render_store_bytes", 64 * 1024 * 1024)
 
-FIGSIZE = 8, 8
-START_NODE_COLOR = "#02f414"
-DESTINATION_NODE_COLOR = "#fd3a00"
-NORMAL_NODE_COLOR = "#029cf4"
-PATH_COLOR = "#f5fd00"
-NODE_SIZE = 400
-NODE_LABEL_FONT_SIZE = 8
-EDGE_LABEL_FONT_SIZE = 8
+# "png" draws the map with matplotlib on the server and sends the image; "svg" sends the
+# positions and colours to a renderer in the browser, and after that only the changes
+RENDER_MODE_PNG = "png"
+RENDER_MODE_SVG = "svg"
+RENDER_MODE = CONFIG.get("render_mode", RENDER_MODE_PNG)
+assert RENDER_MODE in (RENDER_MODE_PNG, RENDER_MODE_SVG)
+
+render_worker = RenderWorker()
+render_store = RenderStore(GRAPH_IMAGE_LOCATION, RENDER_STORE_ENTRIES, RENDER_STORE_BYTES)
 
 
 class Mode(Enum):
@@ -43,20 +60,59 @@ class Mode(Enum):
 
 
 class Gui():
-    def __init__(self):
-        # a queue where the interface waits the start
-        self.start_queue = queue.Queue()
+    def __init__(self, start_queue: Optional[queue.Queue] = None):
+        # a queue where the interface waits the start; it can be shared by the guis of
+        # many sessions, the gui itself is put in the queue
+        self.start_queue = start_queue if start_queue is not None else queue.Queue()
 
         self.mode = Mode.GENERATING_PROBLEM
         self.graph = Graph()
+        # incremented at every change of the graph; the listeners are notified of every change
+        self.graph_version = 0
+        self.graph_listeners: List[GraphListener] = []
+        # which locations can reach each other, to answer the unreachable queries without planning
+        self.connectivity = ConnectivityIndex(self.graph)
+        self.add_graph_listener(self.connectivity)
+        # the persistent planning problem, set by modified_planning.attach_problem_model
+        self.problem_model = None
+        # the index answering the queries on a map that does not change, set with the problem model
+        self.route_index = None
+        # the graph_version, start and destination of the last query, with its reduced map
+        # and problem (or None if it was not reduced), set by modified_planning.reduce_query
+        self.reduced_query: Optional[tuple] = None
 
         self.plan = None
         self.plan_cost = None
         self.plan_expected: bool = False
-        self.image_id = 0
+        # why the last NAVIGATE has no plan, or no proven optimal one, when it timed out or
+        # was cancelled
+        self.planning_error: Optional[str] = None
+        # whether plan is proven optimal; in anytime mode the improving plans are shown
+        # while the search goes on
+        self.plan_optimal: bool = True
+        # incremented by every NAVIGATE and CANCEL: a request with an older generation is
+        # skipped, and its result is discarded
+        self.planning_generation = 0
+        # cancels the request being solved, set by the planning worker
+        self.cancel_planning: Optional[Callable[[], None]] = None
+        self.vector_renderer = VectorRenderer()
+        # the renders of the session are identified by session_id in the render worker;
+        # render_sequence numbers the requested renders and shown_render is the last shown
+        self.session_id = uuid.uuid4().hex
+        self.render_sequence = 0
+        self.shown_render = 0
+        # the graph_version and the layout hash of the last render: the render worker keeps
+        # the layout of the session until the map changes, so until then a stored image
+        # with the same colours and layout can be shown without rendering
+        self.rendered_layout: Optional[Tuple[int, str]] = None
 
         self.plan_div: Optional[jp.Div] = None
         self.graph_image_div: Optional[jp.Img] = None
+        # the page the graph is displayed in, used by the svg renderer
+        self.graph_page: Optional[jp.WebPage] = None
+        # the page of the session, built once by main_page; the results are pushed to its
+        # plan_div and graph_image_div
+        self.page: Optional[jp.WebPage] = None
 
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(format='%(asctime)s %(message)s')
@@ -68,6 +124,19 @@ class Gui():
         self.start = "L_1"
         self.destination = f"L_{N_STARTING_LOCATIONS}"
 
+    def add_graph_listener(self, listener: GraphListener):
+        self.graph_listeners.append(listener)
+
+    def _notify_graph_change(self, event: str, *args):
+        self.graph_version += 1
+        for listener in self.graph_listeners:
+            getattr(listener, event)(*args)
+
+    def graph_hash(self) -> str:
+        if self.problem_model is not None:
+            return self.problem_model.graph_hash()
+        return canonical_graph_hash(self.graph)
+
     def add_locations_to_graph(self, number_of_locations: int, display_graph: bool = True):
         assert number_of_locations > 0
         defined_locations = len(self.graph)
@@ -75,16 +144,20 @@ class Gui():
         self.graph.add_nodes_from(((l, {"label": l}) for l in locations_to_add))
 
         last_defined_location = f"L_{defined_locations}" if defined_locations > 0 else None
+        connections_to_add = list(zip(locations_to_add[:-1], locations_to_add[1:]))
         if last_defined_location is not None:
-            self.graph.add_edge(last_defined_location, locations_to_add[0], weight=DEFAULT_EDGE_COST)
-        self.graph.add_edges_from(zip(locations_to_add[:-1], locations_to_add[1:]), weight=DEFAULT_EDGE_COST)
+            connections_to_add.insert(0, (last_defined_location, locations_to_add[0]))
+        self.graph.add_edges_from(connections_to_add, weight=DEFAULT_EDGE_COST)
+        self._notify_graph_change("on_locations_added", locations_to_add, [(f, t, DEFAULT_EDGE_COST) for f, t in connections_to_add])
         self.display_graph(True)
 
     def remove_locations_from_graph(self, number_of_locations: int):
         defined_locations = len(self.graph)
         assert number_of_locations > 0 and number_of_locations <= defined_locations
         locations_to_remove = [f"L_{i}" for i in range(defined_locations-number_of_locations+1, defined_locations+1)]
+        connections_to_remove = list(self.graph.edges(locations_to_remove, data="weight"))
         self.graph.remove_nodes_from(locations_to_remove)
+        self._notify_graph_change("on_locations_removed", locations_to_remove, connections_to_remove)
         if self.start not in self.graph:
             self.start = f"L_{random.randint(1, len(self.graph))}"
         if self.destination not in self.graph:
@@ -92,21 +165,24 @@ class Gui():
         self.display_graph(True)
 
     def randomize_graph_click(self, n_nodes, n_edges, min_cost, max_cost):
-        random_graph = dense_gnm_random_graph(n_nodes, n_edges)
-        nodes = [f"L_{i}" for i in range(1, n_nodes+1)]
-        node_mapping = dict(zip(random_graph, nodes))
-        self.graph = Graph()
-        self.graph.add_nodes_from(nodes)
-        for random_edge in random_graph.edges:
-            edge = tuple(map(node_mapping.get, random_edge))
-            # edge = (node_mapping.get(random_edge[0]), node_mapping.get(random_edge[1]))
-            weight = randint(min_cost, max_cost)
-            self.graph.add_edge(*edge, weight=weight)
-        # self.graph.add_edges_from(map(lambda x: (node_mapping.get(x[0]), node_mapping.get(x[1])), random_graph.edges))
+        self.graph = random_map(n_nodes, n_edges, min_cost, max_cost)
+        self._notify_graph_change("on_graph_replaced", self.graph)
         self.start = f"L_{random.randint(1, len(self.graph))}"
         self.destination = f"L_{random.randint(1, len(self.graph))}"
         self.display_graph(True)
 
+    def add_connection(self, l_from: str, l_to: str, distance: int):
+        self.graph.add_edge(l_from, l_to, weight=distance)
+        self._notify_graph_change("on_connection_added", l_from, l_to, distance)
+        self.display_graph(True)
+
+    def remove_connection(self, l_from: str, l_to: str):
+        if not self.graph.has_edge(l_from, l_to):
+            return
+        self.graph.remove_edge(l_from, l_to)
+        self._notify_graph_change("on_connection_removed", l_from, l_to)
+        self.display_graph(True)
+
     def display_graph(self, reset_plan = False):
         if self.graph_image_div is None:
             return
@@ -130,26 +206,78 @@ class Gui():
         #         style=PLAN_PART_P_STYLE,
         #     )
         # pos = nx.nx_agraph.graphviz_layout(self.graph, prog="twopi")
-        scale_value = 1
-        pos = nx.kamada_kawai_layout(self.graph, scale=scale_value)
-        fig = plt.figure(figsize = FIGSIZE)
-        ax = fig.add_subplot()
         color_map = {self.start: START_NODE_COLOR, self.destination: DESTINATION_NODE_COLOR}
+        for n in self.graph:
+            if n not in color_map and not self.connectivity.connected(self.start, n):
+                color_map[n] = UNREACHABLE_NODE_COLOR
         if self.plan is not None:
             path = set((str(ai.actual_parameters[1]) for ai in self.plan.actions[0:-1]))
             node_colors = [color_map.get(n, NORMAL_NODE_COLOR) if n not in path else PATH_COLOR for n in self.graph ]
         else:
             node_colors = [color_map.get(n, NORMAL_NODE_COLOR) for n in self.graph]
 
-        nx.draw(self.graph, pos, with_labels=True, font_weight="bold", ax=ax, node_color=node_colors, font_size=NODE_LABEL_FONT_SIZE, node_size=NODE_SIZE)
-
-        edge_labels = {(u, v): self.graph[u][v]["weight"] for u, v in self.graph.edges}
-        nx.draw_networkx_edge_labels(self.graph, pos, edge_labels=edge_labels, ax=ax, font_color='black', font_size=EDGE_LABEL_FONT_SIZE,)
-
-        img_loc = f"{GRAPH_IMAGE_LOCATION}_{self.image_id}.png"
-        self.image_id += 1
-        fig.savefig(f".{img_loc}")
+        # The layout and the image are made by the render worker, and shown when ready; the
+        # previous image stays on the page until then
+        labels = len(self.graph) <= LABELS_MAX_LOCATIONS
+        png = RENDER_MODE == RENDER_MODE_PNG
+        self.render_sequence += 1
+        graph_hash = self.graph_hash()
+        if png and self.rendered_layout is not None and self.rendered_layout[0] == self.graph_version:
+            key = render_key(graph_hash, zip(map(str, self.graph), node_colors), self.rendered_layout[1], labels)
+            img_loc = render_store.get(key)
+            if img_loc is not None:
+                metrics.renders.inc(kind="stored", size=metrics.size_label(len(self.graph)))
+                self._show_image(self.render_sequence, key, img_loc)
+                return
+        request = RenderRequest(list(self.graph), list(self.graph.edges(data="weight")), node_colors, graph_hash, labels, png)
+        render_worker.submit(self.session_id, request, partial(self._render_finished, self.render_sequence, self.graph_version, request, time.perf_counter()))
+
+    def _render_finished(self, sequence: int, graph_version: int, request: RenderRequest, submitted: float, future: Future):
+        # Called from a thread of the render worker: the result is shown in the event loop
+        loop = getattr(jp.WebPage, "loop", None)
+        if loop is None or not loop.is_running():
+            self._show_render(sequence, graph_version, request, submitted, future)
+        else:
+            loop.call_soon_threadsafe(self._show_render, sequence, graph_version, request, submitted, future)
 
+    def _show_render(self, sequence: int, graph_version: int, request: RenderRequest, submitted: float, future: Future):
+        try:
+            result = future.result()
+        except Exception:
+            self.logger.exception("Could not render the map")
+            return
+        self.logger.info(f"Rendered {len(request.nodes)} locations in {result.seconds:.3f}s")
+        n_locations = len(request.nodes)
+        metrics.renders.inc(kind="png" if result.image is not None else "svg", size=metrics.size_label(n_locations))
+        metrics.observe_stage("layout", result.layout_seconds, n_locations)
+        if result.image is not None:
+            metrics.observe_stage("png", result.seconds - result.layout_seconds, n_locations)
+        # from the request to the result, including the wait for the worker
+        metrics.observe_stage("render", time.perf_counter() - submitted, n_locations)
+        if self.rendered_layout is None or graph_version >= self.rendered_layout[0]:
+            self.rendered_layout = graph_version, result.layout_hash
+        if result.image is not None:
+            key = render_key(request.graph_hash, zip(request.nodes, request.node_colors), result.layout_hash, request.labels)
+            img_loc = render_store.put(key, result.image)
+        if sequence < self.shown_render or self.graph_image_div is None:
+            # a newer image was already shown
+            return
+        if result.image is not None:
+            self._show_image(sequence, key, img_loc)
+        else:
+            graph = Graph()
+            graph.add_nodes_from(request.nodes)
+            graph.add_weighted_edges_from(request.edges)
+            self.shown_render = sequence
+            javascript = self.vector_renderer.update(graph, result.positions, request.node_colors, request.labels)
+            if javascript is not None:
+                self.run_javascript(javascript)
+
+    def _show_image(self, sequence: int, key: str, img_loc: str):
+        # Replaces the image and pushes it to the page, whether it was just rendered or
+        # found in the render store; the store keeps it while it is displayed
+        self.shown_render = sequence
+        render_store.display(self.session_id, key)
         self.graph_image_div.delete_components()
 
         _ = jp.Img(
@@ -157,6 +285,15 @@ class Gui():
             src=f"static{img_loc}",
             style='max-width: 100%; height: auto;'
         )
+        self.update_component(self.graph_image_div)
+
+    def update_component(self, component: jp.Div):
+        run_on_loop(component.update())
+
+    def run_javascript(self, javascript: str):
+        if self.graph_page is None:
+            return
+        run_on_loop(self.graph_page.run_javascript(javascript))
 
     def reset_execution(self):
         self.mode = Mode.GENERATING_PROBLEM
@@ -164,11 +301,16 @@ class Gui():
     def update_planning_execution(self):
         from main_page import PLAN_PART_P_CLASS, PLAN_PART_P_STYLE
         if self.plan_div is not None:
+            start_time = time.perf_counter()
             self.plan_div.delete_components()
             if self.plan is not None:
+                if self.mode == Mode.OPERATING:
+                    text = f"Best sequence of moves found so far from {self.start} to {self.destination}; still searching for a shorter one, press CANCEL to keep this one!"
+                else:
+                    text = f"Found a sequence of moves that connects {self.start} to {self.destination}!"
                 _ = jp.P(
                     a=self.plan_div,
-                    text=f"Found a sequence of moves that connects {self.start} to {self.destination}!",
+                    text=text,
                     classes=PLAN_PART_P_CLASS,
                     style=PLAN_PART_P_STYLE,
                 )
@@ -180,14 +322,29 @@ class Gui():
                         classes=PLAN_PART_P_CLASS,
                         style=PLAN_PART_P_STYLE,
                     )
+                optimality = "" if self.plan_optimal else " (not proven optimal)"
                 _ = jp.P(
                     a=self.plan_div,
-                    text=f"After this sequence you arrived at: {self.destination}! The calculated cost is: {self.plan_cost}",
+                    text=f"After this sequence you arrived at: {self.destination}! The calculated cost is: {self.plan_cost}{optimality}",
                     classes=PLAN_PART_P_CLASS,
                     style=PLAN_PART_P_STYLE,
                 )
+                if self.planning_error is not None:
+                    _ = jp.P(
+                        a=self.plan_div,
+                        text=self.planning_error,
+                        classes=PLAN_PART_P_CLASS,
+                        style=PLAN_PART_P_STYLE,
+                    )
             elif self.plan_expected:
-                if self.mode == Mode.GENERATING_PROBLEM:
+                if self.mode == Mode.GENERATING_PROBLEM and self.planning_error is not None:
+                    single_p = jp.P(
+                        a=self.plan_div,
+                        text=self.planning_error,
+                        classes=PLAN_PART_P_CLASS,
+                        style=PLAN_PART_P_STYLE,
+                    )
+                elif self.mode == Mode.GENERATING_PROBLEM:
                     single_p = jp.P(
                         a=self.plan_div,
                         text="No plan found; The start is not connected to the destination!",
@@ -197,7 +354,7 @@ class Gui():
                 else:
                     single_p = jp.P(
                         a=self.plan_div,
-                        text="Wait for planning to finish!",
+                        text="Wait for planning to finish, or press CANCEL!",
                         classes=PLAN_PART_P_CLASS,
                         style=PLAN_PART_P_STYLE,
                     )
@@ -208,10 +365,8 @@ class Gui():
                     classes=PLAN_PART_P_CLASS,
                     style=PLAN_PART_P_STYLE,
                 )
-            try:
-                asyncio.run(self.plan_div.update())
-            except RuntimeError:
-                self.plan_div.update()
+            run_on_loop(self.plan_div.update())
+            metrics.observe_stage("plan_update", time.perf_counter() - start_time, len(self.graph))
             self.display_graph()
 
     def clear_activities_click(self, msg):
@@ -219,6 +374,7 @@ class Gui():
         self.logger.info("Clearing")
         if self.mode == Mode.GENERATING_PROBLEM:
             self.graph = Graph()
+            self._notify_graph_change("on_graph_replaced", self.graph)
             assert N_STARTING_LOCATIONS > 1
             self.add_locations_to_graph(N_STARTING_LOCATIONS)
 
@@ -236,6 +392,18 @@ class Gui():
             return main_page(self)
         jp.justpy(get_main_page)
 
+    def close(self):
+        # Forgets the page of a session that is dropped
+        if self.page is not None:
+            self.page.remove_page()
+        self.page = None
+        self.plan_div = None
+        self.graph_image_div = None
+        self.graph_page = None
+        render_store.release(self.session_id)
+        if self.route_index is not None:
+            self.route_index.close()
+
     def generate_problem_click(self, msg):
         self.logger.info("Generating")
         if self.mode == Mode.GENERATING_PROBLEM:
@@ -243,15 +411,51 @@ class Gui():
             self.plan = None
             self.plan_cost = None
             self.plan_expected = True
+            self.planning_error = None
+            self.plan_optimal = True
+            self.planning_generation += 1
+            if not self.connectivity.connected(self.start, self.destination):
+                # answered at once, without building the problem
+                self.mode = Mode.GENERATING_PROBLEM
+                metrics.navigate_requests.inc(result="unreachable", size=metrics.size_label(len(self.graph)))
+                self.update_planning_execution()
+                return
             self.update_planning_execution()
             # unlock the planing method with the problem correctly generated
-            self.start_queue.put(None)
+            self.start_queue.put((self, self.planning_generation, time.perf_counter()))
+
+    def cancel_planning_click(self, msg):
+        self.logger.info("Cancelling")
+        if self.mode == Mode.OPERATING:
+            # the result of the request, if it ever comes, is discarded
+            self.planning_generation += 1
+            if self.cancel_planning is not None:
+                self.cancel_planning()
+            if self.plan is not None:
+                # in anytime mode the best plan found so far is kept
+                self.plan_optimal = False
+                self.planning_error = "Search stopped!"
+            else:
+                self.planning_error = "Planning cancelled!"
+            self.reset_execution()
+            self.update_planning_execution()
 
 
 def write_action_instance(action_instance: up.plans.ActionInstance) -> str:
     return str(action_instance)
 
-async def reload_page():
-    for page in jp.WebPage.instances.values():
-        if page.page_type == 'main':
-            await page.reload()
+def run_on_loop(coroutine):
+    # Runs a coroutine that talks to the pages: in the justpy event loop when called from
+    # another thread (or from the event loop of a planning worker), so that the sessions
+    # served by the planning workers are updated through the loop that owns their websockets
+    loop = getattr(jp.WebPage, "loop", None)
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is not None and loop.is_running() and running is not loop:
+        asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+    elif running is not None:
+        running.create_task(coroutine)
+    else:
+        asyncio.run(coroutine)
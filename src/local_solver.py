@@ -0,0 +1,99 @@
+import networkx as nx
+import numbers
+from typing import List, Optional, Tuple
+
+from unified_planning.shortcuts import *
+import unified_planning as up
+
+
+# The travelling-costs problem generated by `modified_planning` is always a single `move`
+# action over the edges of a weighted undirected graph, minimizing the sum of the weights;
+# this module answers it directly on the graph instead of going through a generic planner.
+
+# The `move` action used to create the plans; it has the same name and parameters
+# of the action in the planning problem, so the generated plans look the same
+_Location = UserType("Location")
+_robot_at = Fluent("robot_at", BoolType(), position=_Location)
+_move = InstantaneousAction("move", l_from=_Location, l_to=_Location)
+_move.add_precondition(_robot_at(_move.parameter("l_from")))
+_move.add_effect(_robot_at(_move.parameter("l_from")), False)
+_move.add_effect(_robot_at(_move.parameter("l_to")), True)
+
+
+def is_travelling_cost_map(graph: nx.Graph) -> bool:
+    # Dijkstra is correct only with non-negative costs on an undirected simple graph
+    if graph.is_directed() or graph.is_multigraph():
+        return False
+    for _, _, weight in graph.edges(data="weight"):
+        if not isinstance(weight, numbers.Real) or weight < 0:
+            return False
+    return True
+
+
+def is_travelling_cost_graph(graph: nx.Graph, start: str, destination: str) -> bool:
+    if start not in graph or destination not in graph:
+        return False
+    return is_travelling_cost_map(graph)
+
+
+def shortest_path(graph: nx.Graph, start: str, destination: str) -> Optional[Tuple[List[str], numbers.Real]]:
+    try:
+        cost, path = nx.bidirectional_dijkstra(graph, start, destination, weight="weight")
+    except nx.NetworkXNoPath:
+        return None
+    return path, cost
+
+
+def fewest_moves_path(graph: nx.Graph, start: str, destination: str) -> Optional[List[str]]:
+    # A route with the fewest moves, ignoring the distances: a breadth-first search, linear
+    # in the size of the map
+    try:
+        return nx.bidirectional_shortest_path(graph, start, destination)
+    except nx.NetworkXNoPath:
+        return None
+
+
+def make_plan(path: List[str], problem: Optional[up.model.Problem] = None) -> up.plans.SequentialPlan:
+    # If the problem is given, the plan refers to its action and objects (and can be validated against it)
+    if problem is not None:
+        move = problem.action("move")
+        locations = {l: problem.object(l) for l in path}
+    else:
+        move = _move
+        locations = {l: Object(l, _Location) for l in path}
+    actions = [
+        up.plans.ActionInstance(move, (ObjectExp(locations[f]), ObjectExp(locations[t])))
+        for f, t in zip(path[:-1], path[1:])
+    ]
+    return up.plans.SequentialPlan(actions)
+
+
+def plan_path(plan: up.plans.SequentialPlan, start: str) -> List[str]:
+    # The locations visited by a plan of `move` actions, starting from `start`
+    return [start] + [str(ai.actual_parameters[1]) for ai in plan.actions]
+
+
+def plan_cost(graph: nx.Graph, plan: up.plans.SequentialPlan, start: str, destination: str) -> Optional[numbers.Real]:
+    # The cost of a plan of `move` actions, or None if it is not a route on the graph from
+    # start to destination: every move must follow a connection from where the previous one
+    # arrived. Linear in the length of the plan.
+    location = start
+    cost = 0
+    for ai in plan.actions:
+        if ai.action.name != _move.name or len(ai.actual_parameters) != 2:
+            return None
+        l_from, l_to = map(str, ai.actual_parameters)
+        weight = graph.get_edge_data(l_from, l_to, default={}).get("weight")
+        if l_from != location or not isinstance(weight, numbers.Real):
+            return None
+        cost += weight
+        location = l_to
+    return cost if location == destination else None
+
+
+def solve(graph: nx.Graph, start: str, destination: str) -> Tuple[Optional[up.plans.SequentialPlan], Optional[numbers.Real]]:
+    res = shortest_path(graph, start, destination)
+    if res is None:
+        return None, None
+    path, cost = res
+    return make_plan(path), cost
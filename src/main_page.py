@@ -9,7 +9,8 @@ from functools import partial
 
 import justpy as jp
 
-from gui import Gui, Mode
+from gui import RENDER_MODE, RENDER_MODE_SVG, Gui, Mode
+from vector_renderer import CONTAINER_CLASS, RENDERER_HEAD_HTML
 
 LEFT_MARGIN, RIGHT_MARGIN = " margin-left: 10px; ", " margin-right: 20px; "
 
@@ -26,11 +27,12 @@ The text to the left of the buttons specifies the precise behavior of the button
  * Remove Locations(N): removes the last N locations from the map; if the start/destination is one of those it will be randomly reassigned.
  * Add Connection(N, M, D): adds the connection between the L_N and L_M and assigns the distance D.
  * Remove Connection(N, M): removes the connection between L_N and L_M.
- * Set Start(N): sets L_N as the starting location; the starting location is represented in GREEN.
+ * Set Start(N): sets L_N as the starting location; the starting location is represented in GREEN, and the locations that cannot be reached from it in GREY.
  * Set Destination(N): sets L_N as the destination; the destination is represented in RED.
  * Randomize Graph(N, M, MinD, MaxD): creates a new map with N locations, M random connections with random distances in [MinD, MaxD], a random Start and a random Destination.
  * RESET: restores the map to it's initial configuration.
  * NAVIGATE: prints a plan to go from the starting location to the destination; following the given map and minimizing the distance.
+ * CANCEL: stops the running NAVIGATE, keeping the best route found so far; a NAVIGATE taking too long is stopped automatically.
 """
 SINGLE_DESCRIPTION_STYLE = LEFT_MARGIN + RIGHT_MARGIN
 
@@ -87,8 +89,13 @@ PLAN_PART_P_STYLE = f"font-weight: normal; font-size: 18px;"
 
 
 def main_page(gui: Gui):
+    # The page of a session is built once and served again to every reload and browser tab
+    # of the session: the results are pushed to its plan_div and graph_image_div only
+    if gui.page is not None:
+        return gui.page
     wp = jp.WebPage(delete_flag = False)
     wp.page_type = 'main'
+    gui.page = wp
     title_div = jp.Div(
         a=wp,
         classes=TITLE_DIV_CLASS,
@@ -288,8 +295,7 @@ def main_page(gui: Gui):
             return
 
         if gui.mode == Mode.GENERATING_PROBLEM:
-            gui.graph.add_edge(f"L_{value_1}", f"L_{value_2}", weight=value_3)
-            gui.display_graph(True)
+            gui.add_connection(f"L_{value_1}", f"L_{value_2}", value_3)
             add_connection_text_1.value = ADD_CONNECTION_TEXT_PLACEHOLDER
             add_connection_text_2.value = ADD_CONNECTION_TEXT_PLACEHOLDER
             add_connection_text_3.value = ADD_CONNECTION_TEXT_PLACEHOLDER
@@ -352,8 +358,7 @@ def main_page(gui: Gui):
             return
 
         if gui.mode == Mode.GENERATING_PROBLEM:
-            gui.graph.remove_edge(f"L_{value_1}", f"L_{value_2}")
-            gui.display_graph(True)
+            gui.remove_connection(f"L_{value_1}", f"L_{value_2}")
             remove_connection_text_1.value = REMOVE_CONNECTION_TEXT_PLACEHOLDER
             remove_connection_text_2.value = REMOVE_CONNECTION_TEXT_PLACEHOLDER
     remove_connection_button.on('click', partial(remove_connection_button_click, remove_connection_text_1, remove_connection_text_2, gui))
@@ -527,6 +532,14 @@ def main_page(gui: Gui):
         style=ADD_BUTTON_STYLE,
     )
     solve.on('click', gui.generate_problem_click)
+    cancel = jp.Input(
+        a=actions_div,
+        value="CANCEL",
+        type="submit",
+        classes=ADD_BUTTON_CLASS,
+        style=ADD_BUTTON_STYLE,
+    )
+    cancel.on('click', gui.cancel_planning_click)
 
     goals_div = jp.Div(
         a=main_body_div,
@@ -542,6 +555,26 @@ def main_page(gui: Gui):
     )
     gui.graph_image_div = graph_image_div
 
+    if RENDER_MODE == RENDER_MODE_SVG:
+        # The map is drawn in the browser: the whole map is sent when the page is ready,
+        # and then only the changes
+        wp.head_html = RENDERER_HEAD_HTML
+        _ = jp.Div(
+            a=graph_image_div,
+            classes=CONTAINER_CLASS,
+            style="max-width: 100%;",
+        )
+        gui.graph_page = wp
+        gui.vector_renderer.reset()
+        async def page_ready(gui: Gui, page, msg):
+            await page.run_javascript(gui.vector_renderer.load_javascript())
+        wp.on('page_ready', partial(page_ready, gui))
+    else:
+        # The image is rendered in the background and can be ready before the page connects
+        async def page_ready(gui: Gui, page, msg):
+            await gui.graph_image_div.update()
+        wp.on('page_ready', partial(page_ready, gui))
+
     gui.display_graph()
 
     plan_div = jp.Div(
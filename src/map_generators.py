@@ -0,0 +1,189 @@
+import math
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+from config import CONFIG
+
+# The random maps of the RANDOMIZE button, also used by the benchmarks so that they
+# measure the maps the users actually get. Every generator takes the number of locations
+# and of connections, the range of the distances and a seed, and makes the map as arrays
+# in O(n + m) time and memory: the connections are drawn in batches of pairs and the
+# duplicates are dropped, instead of walking all the n^2 pairs, and the distances are
+# drawn or computed in one NumPy call. The arrays can be used directly (see
+# MapArrays.to_matrix) when a networkx graph of a million connections is not needed.
+# - gnm: the connections are picked uniformly among all the pairs of locations,
+# - road: the locations are on a grid, moved randomly within their cell, and connected
+#   to some of their neighbours; the distances follow the lengths of the connections,
+# - geometric: the locations are at random in a square, and connected when they are
+#   close; the distances follow the lengths of the connections,
+# - scale_free: a few locations have many connections and most have few (Chung-Lu model).
+
+# The generator of the RANDOMIZE button: gnm, road, geometric or scale_free
+RANDOM_MAP_GENERATOR = CONFIG.get("random_map_generator", "gnm")
+# How far a location of a road map is moved from the centre of its cell, in cells
+ROAD_JITTER = 0.3
+# The exponent of the power law of the number of connections of the scale-free maps
+SCALE_FREE_EXPONENT = 2.5
+# Batches of scale-free pairs drawn before drawing the missing pairs uniformly: when most
+# of the pairs of the hubs are taken, the duplicates would make the batches useless
+MAX_PAIR_BATCHES = 20
+
+
+class MapArrays(NamedTuple):
+    # A map as arrays: the connection k joins the locations sources[k] and targets[k], with
+    # distance costs[k]; the locations are numbered from 0, and named L_1, L_2, ... in a graph
+    n_locations: int
+    sources: np.ndarray
+    targets: np.ndarray
+    costs: np.ndarray
+    # the coordinates of the locations of the road and geometric maps
+    positions: Optional[np.ndarray] = None
+
+    def to_graph(self) -> nx.Graph:
+        nodes = [f"L_{i}" for i in range(1, self.n_locations + 1)]
+        graph = nx.Graph()
+        graph.add_nodes_from(nodes)
+        graph.add_weighted_edges_from(
+            (nodes[u], nodes[v], c) for u, v, c in zip(self.sources.tolist(), self.targets.tolist(), self.costs.tolist())
+        )
+        return graph
+
+    def to_matrix(self):
+        # The symmetric sparse matrix of the distances, as batch_routing.graph_matrix makes it
+        from batch_routing import distance_matrix
+        return distance_matrix(self.n_locations, self.sources, self.targets, self.costs)
+
+
+def _max_connections(n_locations: int) -> int:
+    return n_locations * (n_locations - 1) // 2
+
+
+def _distinct_pairs(rng: np.random.Generator, n_locations: int, n_connections: int, draw: Callable[[int], Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    # n_connections distinct pairs of different locations, drawn in batches by draw until
+    # there are enough, and then picked at random among the ones drawn; the pair (u, v)
+    # with u < v is kept as the key u * n_locations + v
+    keys = np.empty(0, dtype=np.int64)
+    batches = 0
+    while len(keys) < n_connections:
+        missing = n_connections - len(keys)
+        size = missing + missing // 10 + 16
+        if batches < MAX_PAIR_BATCHES:
+            u, v = draw(size)
+        else:
+            u, v = _uniform_pairs(rng, n_locations, size)
+        batches += 1
+        u, v = np.minimum(u, v), np.maximum(u, v)
+        distinct = u != v
+        keys = np.union1d(keys, u[distinct] * n_locations + v[distinct])
+    if len(keys) > n_connections:
+        keys = np.sort(rng.choice(keys, n_connections, replace=False))
+    return keys // n_locations, keys % n_locations
+
+
+def _uniform_pairs(rng: np.random.Generator, n_locations: int, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    # pairs of different locations
+    u = rng.integers(0, n_locations, size=size)
+    v = rng.integers(0, n_locations - 1, size=size)
+    return u, v + (v >= u)
+
+
+def _random_costs(rng: np.random.Generator, n_connections: int, min_cost: int, max_cost: int) -> np.ndarray:
+    return rng.integers(min_cost, max_cost, size=n_connections, endpoint=True)
+
+
+def _length_costs(positions: np.ndarray, sources: np.ndarray, targets: np.ndarray, min_cost: int, max_cost: int) -> np.ndarray:
+    # Integer distances proportional to the lengths of the connections, the longest one
+    # having max_cost, and at least min_cost
+    lengths = np.linalg.norm(positions[sources] - positions[targets], axis=1)
+    if len(lengths) == 0:
+        return np.empty(0, dtype=np.int64)
+    costs = np.rint(lengths * (max_cost / max(lengths.max(), 1e-12)))
+    return np.clip(costs, min_cost, max_cost).astype(np.int64)
+
+
+def gnm_map_arrays(n_locations: int, n_connections: int, min_cost: int, max_cost: int, seed: Optional[int] = None) -> MapArrays:
+    # n_connections connections picked uniformly among all the pairs (all of them if there
+    # are fewer), with integer distances uniformly in [min_cost, max_cost]
+    rng = np.random.default_rng(seed)
+    total = _max_connections(n_locations)
+    n_connections = min(n_connections, total)
+    if n_connections > total // 2:
+        # a dense map: most of the pairs are taken, picking among all of them is as cheap
+        # as drawing batches
+        sources, targets = np.triu_indices(n_locations, 1)
+        picked = np.sort(rng.choice(total, n_connections, replace=False))
+        sources, targets = sources[picked], targets[picked]
+    else:
+        sources, targets = _distinct_pairs(rng, n_locations, n_connections, lambda size: _uniform_pairs(rng, n_locations, size))
+    return MapArrays(n_locations, sources, targets, _random_costs(rng, len(sources), min_cost, max_cost))
+
+
+def road_map_arrays(n_locations: int, n_connections: int, min_cost: int, max_cost: int, seed: Optional[int] = None) -> MapArrays:
+    # The locations fill the rows of a square grid; every location can be connected to its
+    # neighbours on the right, below and below on the right, and n_connections of these
+    # connections are picked at random (all of them if there are fewer)
+    rng = np.random.default_rng(seed)
+    side = max(1, math.ceil(math.sqrt(n_locations)))
+    index = np.arange(n_locations)
+    row, column = index // side, index % side
+    positions = np.column_stack((column, row)) + rng.uniform(-ROAD_JITTER, ROAD_JITTER, size=(n_locations, 2))
+    right = index[(column < side - 1) & (index + 1 < n_locations)]
+    below = index[index + side < n_locations]
+    diagonal = index[(column < side - 1) & (index + side + 1 < n_locations)]
+    sources = np.concatenate((right, below, diagonal))
+    targets = np.concatenate((right + 1, below + side, diagonal + side + 1))
+    if n_connections < len(sources):
+        picked = np.sort(rng.choice(len(sources), n_connections, replace=False))
+        sources, targets = sources[picked], targets[picked]
+    return MapArrays(n_locations, sources, targets, _length_costs(positions, sources, targets, min_cost, max_cost), positions)
+
+
+def geometric_map_arrays(n_locations: int, n_connections: int, min_cost: int, max_cost: int, seed: Optional[int] = None) -> MapArrays:
+    # The locations are at random in the unit square, and connected when they are closer
+    # than the radius that gives n_connections connections on average (a bit fewer, as the
+    # locations near the border have fewer neighbours)
+    from scipy.spatial import cKDTree
+    rng = np.random.default_rng(seed)
+    positions = rng.random((n_locations, 2))
+    total = _max_connections(n_locations)
+    if total == 0:
+        pairs = np.empty((0, 2), dtype=np.int64)
+    else:
+        radius = math.sqrt(min(n_connections, total) / (math.pi * total))
+        pairs = cKDTree(positions).query_pairs(radius, output_type="ndarray")
+    sources, targets = pairs[:, 0], pairs[:, 1]
+    return MapArrays(n_locations, sources, targets, _length_costs(positions, sources, targets, min_cost, max_cost), positions)
+
+
+def scale_free_map_arrays(n_locations: int, n_connections: int, min_cost: int, max_cost: int, seed: Optional[int] = None, exponent: float = SCALE_FREE_EXPONENT) -> MapArrays:
+    # Both the locations of a connection are drawn with a probability proportional to their
+    # expected number of connections, that follows a power law with the given exponent;
+    # unlike preferential attachment, all the connections are drawn at once
+    rng = np.random.default_rng(seed)
+    n_connections = min(n_connections, _max_connections(n_locations))
+    weights = (np.arange(n_locations) + 1.0) ** (-1 / (exponent - 1))
+    probabilities = weights / weights.sum()
+    # the hubs are spread among the names of the locations
+    order = rng.permutation(n_locations)
+    def draw(size: int) -> Tuple[np.ndarray, np.ndarray]:
+        return order[rng.choice(n_locations, size, p=probabilities)], order[rng.choice(n_locations, size, p=probabilities)]
+    sources, targets = _distinct_pairs(rng, n_locations, n_connections, draw)
+    return MapArrays(n_locations, sources, targets, _random_costs(rng, len(sources), min_cost, max_cost))
+
+
+MAP_GENERATORS: Dict[str, Callable[..., MapArrays]] = {
+    "gnm": gnm_map_arrays,
+    "road": road_map_arrays,
+    "geometric": geometric_map_arrays,
+    "scale_free": scale_free_map_arrays,
+}
+assert RANDOM_MAP_GENERATOR in MAP_GENERATORS
+
+
+def random_map(n_locations: int, n_connections: int, min_cost: int, max_cost: int, seed: Optional[int] = None, generator: str = RANDOM_MAP_GENERATOR) -> nx.Graph:
+    # A map made by the given generator with n_locations locations and (about)
+    # n_connections connections, with integer distances in [min_cost, max_cost]; the same
+    # seed gives the same map
+    return MAP_GENERATORS[generator](n_locations, n_connections, min_cost, max_cost, seed).to_graph()
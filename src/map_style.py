@@ -0,0 +1,12 @@
+# The colours of the locations and the label threshold of the map drawn by the Gui, kept
+# apart so that the benchmarks draw the same map without importing the web server
+
+START_NODE_COLOR = "#02f414"
+DESTINATION_NODE_COLOR = "#fd3a00"
+NORMAL_NODE_COLOR = "#029cf4"
+PATH_COLOR = "#f5fd00"
+# the locations that cannot be reached from the start
+UNREACHABLE_NODE_COLOR = "#b0b0b0"
+# Drawing one label per location and connection takes most of the rendering time on
+# large maps (tens of seconds with thousands of connections), so they are omitted there
+LABELS_MAX_LOCATIONS = 100
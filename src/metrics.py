@@ -0,0 +1,161 @@
+import bisect
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import CONFIG
+
+# Counters and latency histograms of the stages of a NAVIGATE and of a redraw, exposed in
+# the Prometheus text format. The stages are labelled with the size class of the map, so
+# that a slow request can be told apart from a large map.
+
+# The path of the metrics endpoint on the web server; null disables it
+METRICS_PATH = CONFIG.get("metrics_path", "/metrics")
+# If set, every NAVIGATE is also logged as one JSON line with the time of its stages
+REQUEST_LOG = CONFIG.get("request_log", False)
+METRICS_PREFIX = "travelling_costs_"
+# Upper bounds in seconds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Upper bounds of the number of locations of the size classes of the maps
+SIZE_CLASSES = (10, 50, 200, 1000, 5000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def size_label(n_locations: int) -> str:
+    # The size class of a map, e.g. "51-200"; a bounded set of values, unlike the exact size
+    lower = 0
+    for upper in SIZE_CLASSES:
+        if n_locations <= upper:
+            return f"{lower}-{upper}"
+        lower = upper + 1
+    return f"{lower}+"
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    labels = tuple(labels) + tuple(extra)
+    if len(labels) == 0:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+class Counter():
+    def __init__(self, name: str, help: str):
+        self.name = METRICS_PREFIX + name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def exposition(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value:g}")
+        return lines
+
+
+class Histogram():
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = SECONDS_BUCKETS):
+        self.name = METRICS_PREFIX + name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # by labels: the count of every bucket (not cumulative), the sum and the count
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def count(self, **labels) -> int:
+        values = self._values.get(_labels(labels))
+        return 0 if values is None else sum(values[0])
+
+    def exposition(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total[0]:g}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+stage_seconds = Histogram("stage_seconds", "Seconds spent in a stage of a NAVIGATE or of a redraw, by stage and size class of the map.")
+navigate_requests = Counter("navigate_requests_total", "NAVIGATE requests by result and size class of the map.")
+plan_cache_lookups = Counter("plan_cache_lookups_total", "Lookups of the plan cache by result.")
+renders = Counter("renders_total", "Maps drawn by the render worker, by kind and size class of the map.")
+METRICS = [stage_seconds, navigate_requests, plan_cache_lookups, renders]
+
+
+# The stage times of the NAVIGATE served by the current thread, for its log line; the
+# solve runs in tasks that copy the context of the planning worker, so they see its dict
+_request_stages: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar("request_stages", default=None)
+
+
+def observe_stage(stage: str, seconds: float, n_locations: Optional[int] = None):
+    if n_locations is None:
+        stage_seconds.observe(seconds, stage=stage)
+    else:
+        stage_seconds.observe(seconds, stage=stage, size=size_label(n_locations))
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0) + seconds
+
+
+@contextmanager
+def timed(stage: str, n_locations: Optional[int] = None) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start_time, n_locations)
+
+
+def start_request() -> Dict[str, float]:
+    # The stage times of the NAVIGATE that the calling planning worker starts to serve,
+    # filled until it starts the next one; see log_request
+    stages: Dict[str, float] = {}
+    _request_stages.set(stages)
+    return stages
+
+
+def log_request(**fields):
+    if REQUEST_LOG:
+        logging.getLogger(__name__).info(json.dumps(fields, sort_keys=True, default=str))
+
+
+def exposition() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.exposition())
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_endpoint(request):
+    from starlette.responses import PlainTextResponse
+    return PlainTextResponse(exposition(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,8 +1,19 @@
+import asyncio
 import networkx as nx
+import numbers
 import logging
-from typing import Tuple
+import random
+from typing import Callable, List, Optional, Sequence, Tuple
 from up_graphene_engine.engine import  GrapheneEngine
 from gui import Gui
+from config import CONFIG
+import local_solver
+import metrics
+from engine_pool import call_in_thread
+from plan_cache import PlanCache
+from problem_model import ENCODING_AUTO, ProblemModel, expressions_lock
+from problem_reduction import Reduction
+from route_index import ROUTE_INDEX, RouteIndex
 
 from unified_planning.shortcuts import *
 import unified_planning as up
@@ -12,72 +23,260 @@ import unified_planning.model.metrics
 
 get_environment().credits_stream = None
 
+# How the NAVIGATE requests are solved:
+# - "remote": the problem is always sent to the planning engine,
+# - "local": the travelling-costs problem is solved in-process with Dijkstra,
+# - "local_checked": like "local", but a sample of the requests is also solved by
+#   the engine and the two costs are compared.
+SOLVER_MODE_REMOTE = "remote"
+SOLVER_MODE_LOCAL = "local"
+SOLVER_MODE_LOCAL_CHECKED = "local_checked"
+SOLVER_MODE = CONFIG.get("solver_mode", SOLVER_MODE_REMOTE)
+assert SOLVER_MODE in (SOLVER_MODE_REMOTE, SOLVER_MODE_LOCAL, SOLVER_MODE_LOCAL_CHECKED)
+CROSS_CHECK_RATE = CONFIG.get("cross_check_rate", 0.1)
+assert 0 <= CROSS_CHECK_RATE <= 1
+# The plans of the engine are checked, and their cost computed, by walking them on the
+# graph; this fraction of them is also replayed by the unified-planning PlanValidator,
+# logging a warning if the two disagree (1 always uses the PlanValidator)
+VALIDATION_AUDIT_RATE = CONFIG.get("validation_audit_rate", 0.01)
+assert 0 <= VALIDATION_AUDIT_RATE <= 1
 
+# The found plans are cached by graph, start and destination; setting
+# plan_cache_entries to 0 disables the cache
+PLAN_CACHE_ENTRIES = CONFIG.get("plan_cache_entries", 1024)
+PLAN_CACHE_BYTES = CONFIG.get("plan_cache_bytes", 16 * 1024 * 1024)
+PLAN_CACHE_FILE = CONFIG.get("plan_cache_file", None)
+plan_cache = PlanCache(PLAN_CACHE_ENTRIES, PLAN_CACHE_BYTES, PLAN_CACHE_FILE) if PLAN_CACHE_ENTRIES > 0 else None
+
+# The encoding of the problem sent to the engine: "lifted", "grounded" or "auto" (see problem_model)
+ENCODING = CONFIG.get("encoding", ENCODING_AUTO)
+
+# The engine gets the problem of the map reduced to what can matter for the query (see
+# problem_reduction) when the reduced map has at most REDUCTION_MAX_RATIO of the connections;
+# otherwise the problem kept in sync with the map is cheaper to send than a new one.
+# The reduced problem is built for the query and kept until the map changes; its
+# connections count REDUCTION_BUILD_COST more when it has to be built, the time to build a
+# grounded action relative to the time to convert it to the protobuf message of the engine
+# (0.12ms against 0.44ms on a 2000-location map)
+PROBLEM_REDUCTION = CONFIG.get("problem_reduction", True)
+DISTANCE_BOUND_PRUNING = CONFIG.get("distance_bound_pruning", False)
+REDUCTION_MAX_RATIO = 0.75
+REDUCTION_BUILD_COST = 0.3
+
+# Seconds a NAVIGATE request can take before it is abandoned; 0 waits forever
+PLANNING_TIMEOUT = CONFIG.get("planning_timeout", 60)
+assert PLANNING_TIMEOUT >= 0
+
+# In anytime mode a route with the fewest moves is shown as soon as NAVIGATE is pressed,
+# and then the better plans found by an anytime engine, until the optimal one
+ANYTIME = CONFIG.get("anytime", True)
+# Called with every improving plan, its cost and whether it is proven optimal
+PlanCallback = Callable[[up.plans.SequentialPlan, numbers.Real, bool], None]
+
+
+def attach_problem_model(gui: Gui) -> ProblemModel:
+    # Keeps a planning problem in sync with the graph of the gui, so that a query
+    # does not have to build the problem from scratch
+    model = ProblemModel(gui.graph, ENCODING)
+    gui.problem_model = model
+    gui.add_graph_listener(model)
+    if ROUTE_INDEX:
+        gui.route_index = RouteIndex(gui.graph)
+        gui.add_graph_listener(gui.route_index)
+    return model
+
+
+def get_problem_model(gui: Gui) -> ProblemModel:
+    if gui.problem_model is not None:
+        return gui.problem_model
+    return ProblemModel(gui.graph, ENCODING)
+
+
+async def planning(engine: GrapheneEngine, gui: Gui, on_plan: Optional[PlanCallback] = None):
+    # the query is the one selected when NAVIGATE was pressed, even if the selection
+    # changes during the solve
+    start, destination = gui.start, gui.destination
+    if plan_cache is None:
+        return await solve(engine, gui, start, destination, on_plan)
+
+    with metrics.timed("plan_cache", len(gui.graph)):
+        graph_hash = gui.graph_hash()
+        cached = plan_cache.get(graph_hash, start, destination)
+    metrics.plan_cache_lookups.inc(result="miss" if cached is None else "hit")
+    if cached is not None:
+        path, cost = cached
+        logging.info(f"Plan found in cache; cache stats: {plan_cache.stats()}")
+        with expressions_lock:
+            return local_solver.make_plan(path), cost
+
+    plan, cost = await solve(engine, gui, start, destination, on_plan)
+    # an invalid plan of the engine has no cost, and is not cached
+    if plan is not None and cost is not None:
+        plan_cache.put(graph_hash, start, destination, local_solver.plan_path(plan, start), cost)
+    return plan, cost
 
-def planning(engine: GrapheneEngine, gui: Gui, reload_page):
-    logging.info("Generating planning problem...")
 
-    # First, we declare a "Location" type
-    Location = UserType("Location")
-
-    # We create a new problem
-    problem = Problem("robot")
-
-    # Declare the fluents:
-    # - `robot_at` is a predicate modeling the robot position,
-    # - `connected` is a static fluent for modeling the graph connectivity relation
-    robot_at = Fluent("robot_at", BoolType(), position=Location)
-    connected = Fluent("connected", BoolType(), l_from=Location, l_to=Location)
-    distance = Fluent("distance", IntType(), l_from=Location, l_to=Location)
-
-    # Add the fluents to the problem, a Fluent can be resused in many problems
-    # The default values are optional and can be any value (not forcing closed-world assumption)
-    problem.add_fluent(robot_at, default_initial_value=False)
-    problem.add_fluent(connected, default_initial_value=False)
-    problem.add_fluent(distance, default_initial_value=0)
-
-    # Create a simple `move` action
-    move = InstantaneousAction("move", l_from=Location, l_to=Location)
-    l_from = move.parameter("l_from")
-    l_to = move.parameter("l_to")
-    move.add_precondition(robot_at(l_from))
-    move.add_precondition(connected(l_from, l_to))
-    move.add_effect(robot_at(l_from), False)
-    move.add_effect(robot_at(l_to), True)
-    problem.add_action(move)
-
-    # Programmatically create a map from location name to a new `Object` of type `Location`
-    locations = {str(l) : Object(str(l), Location) for l in gui.graph.nodes}
-
-    # Add all the objects to the problem
-    problem.add_objects(locations.values())
-
-    # Setting the initial location
-    problem.set_initial_value(robot_at(locations[gui.start]), True)
-
-    # Initializing the connectivity relations by iterating over the graph edges
-    for (f, t, d) in gui.graph.edges(data=True):
-        edge_distance = d["weight"]
-        problem.set_initial_value(distance(locations[str(f)], locations[str(t)]), edge_distance)
-        problem.set_initial_value(distance(locations[str(t)], locations[str(f)]), edge_distance)
-        problem.set_initial_value(connected(locations[str(f)], locations[str(t)]), True)
-        problem.set_initial_value(connected(locations[str(t)], locations[str(f)]), True)
-
-    # Setting the goal
-    problem.add_goal(robot_at(locations[gui.destination]))
-    metric = MinimizeActionCosts({move: distance(l_from, l_to)})
-    problem.add_quality_metric(metric)
+async def solve(engine: GrapheneEngine, gui: Gui, start: str, destination: str, on_plan: Optional[PlanCallback] = None):
+    hierarchy = gui.route_index.current() if gui.route_index is not None else None
+    if hierarchy is not None and start in gui.graph and destination in gui.graph:
+        # the map has not changed for a while and is indexed, see route_index
+        with metrics.timed("route_index", len(gui.graph)):
+            route = hierarchy.route(start, destination)
+        if route is None:
+            return None, None
+        path, cost = route
+        with expressions_lock:
+            return local_solver.make_plan(path), cost
+    if SOLVER_MODE != SOLVER_MODE_REMOTE and local_solver.is_travelling_cost_graph(gui.graph, start, destination):
+        logging.info("Planning locally...")
+        with expressions_lock, metrics.timed("local_solve", len(gui.graph)):
+            plan, cost = local_solver.solve(gui.graph, start, destination)
+        if SOLVER_MODE == SOLVER_MODE_LOCAL_CHECKED and random.random() < CROSS_CHECK_RATE:
+            _, remote_cost = await remote_planning(engine, gui, start, destination)
+            if remote_cost != cost:
+                logging.warning(f"Local and remote planning disagree: local cost {cost}, remote cost {remote_cost}")
+        return plan, cost
+    if on_plan is not None and local_solver.is_travelling_cost_graph(gui.graph, start, destination):
+        # a first route, found in linear time, while the engine looks for the optimal one
+        with metrics.timed("first_route", len(gui.graph)):
+            path = local_solver.fewest_moves_path(gui.graph, start, destination)
+        if path is not None:
+            with expressions_lock:
+                plan = local_solver.make_plan(path)
+            on_plan(plan, nx.path_weight(gui.graph, path, "weight"), False)
+    return await remote_planning(engine, gui, start, destination, on_plan=on_plan)
 
 
+async def remote_planning(engine: GrapheneEngine, gui: Gui, start: Optional[str] = None, destination: Optional[str] = None, on_plan: Optional[PlanCallback] = None):
+    # Plans from start to destination, by default those of the gui
+    start = gui.start if start is None else start
+    destination = gui.destination if destination is None else destination
+    logging.info("Generating planning problem...")
+    n_locations = len(gui.graph)
+    reduction, model = reduce_query(gui, start, destination)
+    if reduction is None:
+        with expressions_lock, metrics.timed("build", n_locations):
+            # the engine reads the problem while the map of the session can change
+            model = get_problem_model(gui)
+            problem, metric = model.snapshot_for(start, destination)
+    else:
+        with expressions_lock:
+            problem, metric = model.problem_for(start, destination)
+
     logging.info("Planning...")
 
-    res = engine.solve(problem, OptimalityGuarantee.SOLVED_OPTIMALLY)
-    plan = res.plan
+    if on_plan is not None and isinstance(engine, up.engines.mixins.AnytimePlannerMixin):
+        # the engine gives better and better plans, each one is shown as it arrives
+        solutions = engine.get_solutions(problem)
+        plan, cost = None, None
+        while True:
+            with metrics.timed("solve", n_locations):
+                res = await asyncio.wrap_future(call_in_thread(next, solutions, None, owner=engine))
+            if res is None:
+                return plan, cost
+            if res.plan is not None:
+                plan, cost = _validated(gui.graph, model, problem, metric, res.plan, start, destination, reduction)
+                on_plan(plan, cost, res.status == up.engines.PlanGenerationResultStatus.SOLVED_OPTIMALLY)
+
+    # the round trip to the engine: the gRPC calls and the search
+    with metrics.timed("solve", n_locations):
+        res = await asyncio.wrap_future(call_in_thread(engine.solve, problem, OptimalityGuarantee.SOLVED_OPTIMALLY))
+    return _validated(gui.graph, model, problem, metric, res.plan, start, destination, reduction)
+
+
+def reduce_query(gui: Gui, start: str, destination: str) -> Tuple[Optional[Reduction], Optional[ProblemModel]]:
+    # The reduced map for the query and its problem, if it is worth a problem of its own
+    if not PROBLEM_REDUCTION or not local_solver.is_travelling_cost_graph(gui.graph, start, destination):
+        return None, None
+    key = (gui.graph_version, start, destination)
+    if gui.reduced_query is not None and gui.reduced_query[:3] == key:
+        return gui.reduced_query[3:]
+    with metrics.timed("reduce", len(gui.graph)):
+        reduction = Reduction(gui.graph, start, destination, DISTANCE_BOUND_PRUNING)
+    reduction.log()
+    model = None
+    reduced_cost = (1 + REDUCTION_BUILD_COST) * reduction.graph.number_of_edges()
+    if destination not in reduction.graph or reduced_cost > REDUCTION_MAX_RATIO * gui.graph.number_of_edges():
+        reduction = None
+    else:
+        with expressions_lock, metrics.timed("build", len(gui.graph)):
+            model = ProblemModel(reduction.graph, ENCODING)
+    gui.reduced_query = key + (reduction, model)
+    return reduction, model
+
+
+def _validated(graph: nx.Graph, model: ProblemModel, problem: up.model.Problem, metric, plan: Optional[up.plans.SequentialPlan], start: str, destination: str, reduction: Optional[Reduction] = None):
+    # The lifted plan on the graph and its cost; the cost is None if the plan is not a valid route
     cost = None
-    if plan is not None:
-        with PlanValidator(name="sequential_plan_validator") as validator:
-            val_res = validator.validate(problem, plan)
-            if val_res.metric_evaluations is not None:
-                cost = val_res.metric_evaluations[metric]
+    with expressions_lock:
+        lifted_plan = model.lift_plan(plan)
+        if plan is None:
+            return lifted_plan, cost
+        if reduction is not None:
+            lifted_plan = local_solver.make_plan(reduction.expand_path(local_solver.plan_path(lifted_plan, start)))
+        # checked in constant time; plan_cost checks only the distances of the plan
+        fast = not graph.is_directed() and not graph.is_multigraph()
+        if fast:
+            with metrics.timed("validate", len(graph)):
+                cost = local_solver.plan_cost(graph, lifted_plan, start, destination)
+            if cost is None:
+                logging.warning(f"The engine returned an invalid plan from {start} to {destination}")
+        if not fast or random.random() < VALIDATION_AUDIT_RATE:
+            with metrics.timed("validate_full", len(graph)), PlanValidator(name="sequential_plan_validator") as validator:
+                val_res = validator.validate(problem, plan)
+            full_cost = val_res.metric_evaluations[metric] if val_res.metric_evaluations is not None else None
+            if fast and full_cost != cost:
+                logging.warning(f"The plan costs {cost} on the graph but {full_cost} for the PlanValidator")
+            cost = full_cost
+        return lifted_plan, cost
 
-    return plan, cost
+
+async def planning_batch(engine: GrapheneEngine, gui: Gui, pairs: Sequence[Tuple[str, str]]) -> List[Tuple[Optional[up.plans.SequentialPlan], Optional[numbers.Real]]]:
+    # The plan and cost of many (start, destination) queries on the map of the gui. On a
+    # travelling-costs map the queries are answered with one shortest-path tree for every
+    # start, whatever the solver mode; otherwise the engine solves them one by one on the
+    # same problem, which only changes the start and the goal between the queries.
+    if not local_solver.is_travelling_cost_map(gui.graph):
+        return [await remote_planning(engine, gui, start, destination) for start, destination in pairs]
+
+    routes = route_pairs(gui.graph, gui.graph_hash(), pairs)
+    with expressions_lock:
+        return [(None, None) if route is None else (local_solver.make_plan(route[0]), route[1]) for route in routes]
+
+
+def route_pairs(graph: nx.Graph, graph_hash: Optional[str], pairs: Sequence[Tuple[str, str]]) -> List[Optional[Tuple[List[str], numbers.Real]]]:
+    # The shortest route and its cost for many queries on a travelling-costs map, with one
+    # shortest-path tree for every start; the routes found are put in the plan cache of
+    # the map with the given hash. Used by planning_batch and by the routes endpoint.
+    # scipy is imported by the first batch, unless the startup warm-up did it
+    import batch_routing
+    with metrics.timed("batch_routing", len(graph)):
+        routes = batch_routing.route_batch(graph, pairs)
+    if plan_cache is not None and graph_hash is not None:
+        for (start, destination), route in zip(pairs, routes):
+            if route is not None:
+                plan_cache.put(graph_hash, start, destination, *route)
+    logging.info(f"Answered {len(pairs)} queries from {len({s for s, _ in pairs})} starts")
+    return routes
+
+
+async def planning_with_deadline(engine: GrapheneEngine, gui: Gui, on_plan: Optional[PlanCallback] = None, timeout: float = PLANNING_TIMEOUT) -> Tuple[Optional[up.plans.SequentialPlan], Optional[numbers.Real], Optional[str]]:
+    # The plan and its cost, or the reason why there is none when the request timed out or
+    # was cancelled. gui.cancel_planning cancels the request from any thread.
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    cancel = lambda: loop.call_soon_threadsafe(task.cancel)
+    gui.cancel_planning = cancel
+    try:
+        plan, cost = await asyncio.wait_for(planning(engine, gui, on_plan), timeout if timeout > 0 else None)
+        return plan, cost, None
+    except asyncio.TimeoutError:
+        logging.warning(f"Planning timed out after {timeout}s")
+        return None, None, f"Planning timed out after {timeout} seconds!"
+    except asyncio.CancelledError:
+        logging.info("Planning cancelled")
+        return None, None, "Planning cancelled!"
+    finally:
+        # a newer request of the session may have set its own
+        if gui.cancel_planning is cancel:
+            gui.cancel_planning = None
@@ -0,0 +1,164 @@
+import atexit
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from collections import OrderedDict
+from numbers import Real
+from threading import Lock, Timer
+from typing import List, Optional, Tuple
+
+import networkx as nx
+
+# Seconds between a change of the cache and its save to the persistence file: the changes
+# made in the meantime, e.g. by a batch of queries, are saved together
+SAVE_DELAY = 5
+
+
+def canonical_graph_hash(graph: nx.Graph) -> str:
+    # The hash does not depend on the insertion order of nodes and edges, nor on the
+    # direction an undirected edge was added with
+    h = hashlib.sha256()
+    for node in sorted(map(str, graph.nodes)):
+        h.update(node.encode())
+        h.update(b"\0")
+    h.update(b"\1")
+    edges = sorted((min(str(u), str(v)), max(str(u), str(v)), w) for u, v, w in graph.edges(data="weight"))
+    for u, v, w in edges:
+        h.update(f"{u}\0{v}\0{w!r}\1".encode())
+    return h.hexdigest()
+
+
+def _entry_size(key, value) -> int:
+    # Rough size of an entry, used to bound the memory of the cache
+    path, _ = value
+    return sys.getsizeof(key) + sum(map(sys.getsizeof, key)) + sys.getsizeof(path) + sum(map(sys.getsizeof, path)) + 64
+
+
+class PlanCache():
+    # Stores the path and the cost found for a (graph, start, destination) query;
+    # the least recently used entries are evicted when the cache exceeds max_entries or max_bytes
+    def __init__(self, max_entries: int, max_bytes: int, persistence_file: Optional[str] = None):
+        assert max_entries > 0 and max_bytes > 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.persistence_file = persistence_file
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[List[str], Real]]" = OrderedDict()
+        self._lock = Lock()
+        # the changes not saved yet, and the timer of the next save
+        self._dirty = False
+        self._save_timer: Optional[Timer] = None
+        # a single save at a time writes the persistence file
+        self._save_lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        if persistence_file is not None:
+            self.load()
+            # the last changes are saved at the exit
+            atexit.register(self.close)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, graph_hash: str, start: str, destination: str) -> Optional[Tuple[List[str], Real]]:
+        key = (graph_hash, start, destination)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, graph_hash: str, start: str, destination: str, path: List[str], cost: Real):
+        key = (graph_hash, start, destination)
+        value = (list(path), cost)
+        with self._lock:
+            old_value = self._entries.pop(key, None)
+            if old_value is not None:
+                self.size_bytes -= _entry_size(key, old_value)
+            self._entries[key] = value
+            self.size_bytes += _entry_size(key, value)
+            self._evict()
+            if self.persistence_file is not None:
+                self._dirty = True
+                if self._save_timer is None:
+                    self._save_timer = Timer(SAVE_DELAY, self.save)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes):
+            key, value = self._entries.popitem(last=False)
+            self.size_bytes -= _entry_size(key, value)
+            self.evictions += 1
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                entries = list(self._entries.items())
+                self._dirty = False
+                self._save_timer = None
+            # Write to a temporary file of its own first, so a crash never leaves a truncated
+            # cache behind
+            directory, name = os.path.split(os.path.abspath(self.persistence_file))
+            tmp_file = None
+            try:
+                with tempfile.NamedTemporaryFile(dir=directory, prefix=f"{name}.", suffix=".tmp", delete=False) as f:
+                    tmp_file = f.name
+                    pickle.dump(entries, f)
+                os.replace(tmp_file, self.persistence_file)
+            except OSError as e:
+                self.logger.warning(f"Could not save the plan cache to {self.persistence_file}: {e}")
+                if tmp_file is not None and os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                with self._lock:
+                    self._dirty = True
+
+    def close(self):
+        # Saves the changes not saved yet
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            dirty = self._dirty
+        if dirty:
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.persistence_file, "rb") as f:
+                entries = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            self.logger.warning(f"Could not load the plan cache from {self.persistence_file}: {e}")
+            return
+        with self._lock:
+            for key, value in entries:
+                self._entries[key] = value
+                self.size_bytes += _entry_size(key, value)
+            self._evict()
+        self.logger.info(f"Loaded {len(self._entries)} cached plans from {self.persistence_file}")
@@ -0,0 +1,294 @@
+from threading import RLock
+from typing import Dict, Iterable, Optional, Tuple
+
+import networkx as nx
+
+from unified_planning.shortcuts import *
+import unified_planning as up
+
+from graph_events import Connection, GraphListener
+from plan_cache import canonical_graph_hash
+import local_solver
+
+# The unified-planning environment is shared by the sessions and its expression manager
+# is not thread-safe: problems and plans are built, changed and validated holding this lock
+expressions_lock = RLock()
+
+# The problem can be encoded in two ways:
+# - "lifted": a single `move(l_from, l_to)` action guarded by the static `connected` fluent;
+#   a planner grounding it sees |V|^2 candidate actions and |V|^2 `distance` values,
+# - "grounded": one parameterless `move_<from>_<to>` action for every direction of every
+#   connection, with its distance as constant cost; a planner sees only 2|E| actions.
+# "auto" picks the grounded encoding but for the smallest maps.
+ENCODING_LIFTED = "lifted"
+ENCODING_GROUNDED = "grounded"
+ENCODING_AUTO = "auto"
+# With "auto", maps with at least these many locations use the grounded encoding: with
+# encoding_benchmark.py, building the grounded problem and grounding it takes less time
+# than the lifted one from 10 locations on, at every density up to the complete map
+# (0.06s against 2.2s for 50 locations and 75 connections, 1.9s against 3.5s for 50
+# locations and 1000 connections)
+AUTO_GROUNDED_MIN_LOCATIONS = 10
+
+
+def choose_encoding(graph: nx.Graph) -> str:
+    return ENCODING_GROUNDED if len(graph) >= AUTO_GROUNDED_MIN_LOCATIONS else ENCODING_LIFTED
+
+
+class ProblemModel(GraphListener):
+    # A planning problem kept in sync with the graph of a Gui: every change of the graph
+    # is applied to the problem as a delta, and a query only swaps the initial
+    # position of the robot and the goal.
+    def __init__(self, graph: nx.Graph, encoding: str = ENCODING_LIFTED):
+        assert encoding in (ENCODING_LIFTED, ENCODING_GROUNDED, ENCODING_AUTO)
+        self.encoding_mode = encoding
+        # incremented at every change of the problem, to know when an encoding of it is outdated
+        self.version = 0
+        with expressions_lock:
+            self._build(graph)
+
+    def _build(self, graph: nx.Graph):
+        self.graph = graph
+        self.encoding = choose_encoding(graph) if self.encoding_mode == ENCODING_AUTO else self.encoding_mode
+        self._graph_hash: Optional[str] = None
+        self.version += 1
+        # the copy of the problem last given to an engine, see snapshot_for
+        self._snapshot: Optional[Tuple[int, str, str, up.model.Problem, up.model.metrics.PlanQualityMetric]] = None
+        self._start: Optional[str] = None
+        self._destination: Optional[str] = None
+        # facts left in the problem by the removed locations and connections; when they
+        # outnumber the live ones the problem is rebuilt from the graph
+        self._stale_facts = 0
+
+        # First, we declare a "Location" type
+        Location = UserType("Location")
+        self.Location = Location
+
+        # We create a new problem
+        problem = Problem("robot")
+        self.problem = problem
+
+        # Declare the fluents:
+        # - `robot_at` is a predicate modeling the robot position,
+        # - `connected` is a static fluent for modeling the graph connectivity relation
+        self.robot_at = Fluent("robot_at", BoolType(), position=Location)
+        problem.add_fluent(self.robot_at, default_initial_value=False)
+
+        if self.encoding == ENCODING_LIFTED:
+            self._build_lifted_move()
+        else:
+            # the grounded actions by connection direction; an action is in the problem and
+            # in the costs of the metric while its connection is in the graph
+            self._grounded_actions: Dict[Tuple[str, str], up.model.InstantaneousAction] = {}
+            self._grounded_connections: Dict[up.model.InstantaneousAction, Tuple[str, str]] = {}
+            # robot_at(location) by location name, shared by the actions of its connections
+            self._grounded_at: Dict[str, up.model.FNode] = {}
+            self.metric = MinimizeActionCosts({})
+            problem.add_quality_metric(self.metric)
+
+        # The objects of the problem, by location name; the objects of the removed
+        # locations stay in the problem (without connections) and are reused if the
+        # location is added again
+        self.locations: Dict[str, up.model.Object] = {}
+        self._add_locations(map(str, graph.nodes))
+        for (f, t, d) in graph.edges(data="weight"):
+            self._set_connection(str(f), str(t), d)
+
+    def _build_lifted_move(self):
+        problem, Location = self.problem, self.Location
+        self.connected = Fluent("connected", BoolType(), l_from=Location, l_to=Location)
+        self.distance = Fluent("distance", IntType(), l_from=Location, l_to=Location)
+
+        # Add the fluents to the problem, a Fluent can be resused in many problems
+        # The default values are optional and can be any value (not forcing closed-world assumption)
+        problem.add_fluent(self.connected, default_initial_value=False)
+        problem.add_fluent(self.distance, default_initial_value=0)
+
+        # Create a simple `move` action
+        move = InstantaneousAction("move", l_from=Location, l_to=Location)
+        l_from = move.parameter("l_from")
+        l_to = move.parameter("l_to")
+        move.add_precondition(self.robot_at(l_from))
+        move.add_precondition(self.connected(l_from, l_to))
+        move.add_effect(self.robot_at(l_from), False)
+        move.add_effect(self.robot_at(l_to), True)
+        problem.add_action(move)
+        self.move = move
+
+        self.metric = MinimizeActionCosts({move: self.distance(l_from, l_to)})
+        problem.add_quality_metric(self.metric)
+
+    def _grounded_move(self, f: str, t: str) -> up.model.InstantaneousAction:
+        move = self._grounded_actions.get((f, t))
+        if move is None:
+            at_f, at_t = self._grounded_robot_at(f), self._grounded_robot_at(t)
+            move = InstantaneousAction(f"move_{f}_{t}")
+            move.add_precondition(at_f)
+            move.add_effect(at_f, False)
+            move.add_effect(at_t, True)
+            self._grounded_actions[(f, t)] = move
+            self._grounded_connections[move] = (f, t)
+        return move
+
+    def _grounded_robot_at(self, location: str) -> up.model.FNode:
+        at = self._grounded_at.get(location)
+        if at is None:
+            at = self._grounded_at[location] = self.robot_at(self.locations[location])
+        return at
+
+    def _set_grounded_move(self, move: up.model.InstantaneousAction, edge_distance: int):
+        costs = self.metric.costs
+        if move not in costs:
+            # The names move_<from>_<to> are unique, so the action is appended without
+            # Problem.add_action, whose name check scans all the actions of the problem
+            self.problem.actions.append(move)
+        costs[move] = Int(edge_distance)
+
+    def _unset_grounded_move(self, move: up.model.InstantaneousAction):
+        if self.metric.costs.pop(move, None) is not None:
+            actions = self.problem.actions
+            del actions[next(i for i, a in enumerate(actions) if a is move)]
+
+    def _add_locations(self, locations: Iterable[str]):
+        # self.locations already keeps the names unique, so the objects are appended without
+        # Problem.add_objects, whose name check scans all the objects of the problem
+        objects = self.problem.all_objects
+        for l in locations:
+            if l not in self.locations:
+                self.locations[l] = Object(l, self.Location)
+                objects.append(self.locations[l])
+
+    def _set_connection(self, f: str, t: str, edge_distance: int):
+        if self.encoding == ENCODING_GROUNDED:
+            self._set_grounded_move(self._grounded_move(f, t), edge_distance)
+            self._set_grounded_move(self._grounded_move(t, f), edge_distance)
+            return
+        locations, problem = self.locations, self.problem
+        problem.set_initial_value(self.distance(locations[f], locations[t]), edge_distance)
+        problem.set_initial_value(self.distance(locations[t], locations[f]), edge_distance)
+        problem.set_initial_value(self.connected(locations[f], locations[t]), True)
+        problem.set_initial_value(self.connected(locations[t], locations[f]), True)
+
+    def _unset_connection(self, f: str, t: str):
+        if self.encoding == ENCODING_GROUNDED:
+            self._unset_grounded_move(self._grounded_move(f, t))
+            self._unset_grounded_move(self._grounded_move(t, f))
+            return
+        locations, problem = self.locations, self.problem
+        problem.set_initial_value(self.distance(locations[f], locations[t]), 0)
+        problem.set_initial_value(self.distance(locations[t], locations[f]), 0)
+        problem.set_initial_value(self.connected(locations[f], locations[t]), False)
+        problem.set_initial_value(self.connected(locations[t], locations[f]), False)
+        self._stale_facts += 4
+
+    def _compact_if_needed(self):
+        if self._stale_facts > 4 * self.graph.number_of_edges() + len(self.graph):
+            self._build(self.graph)
+
+    def on_graph_replaced(self, graph: nx.Graph):
+        with expressions_lock:
+            self._build(graph)
+
+    def on_locations_added(self, locations: Iterable[str], connections: Iterable[Connection]):
+        self._graph_hash = None
+        with expressions_lock:
+            self.version += 1
+            self._add_locations(locations)
+            for f, t, d in connections:
+                self._set_connection(f, t, d)
+
+    def on_locations_removed(self, locations: Iterable[str], connections: Iterable[Connection]):
+        self._graph_hash = None
+        with expressions_lock:
+            self.version += 1
+            for f, t, _ in connections:
+                self._unset_connection(str(f), str(t))
+            for l in locations:
+                if l == self._start:
+                    self.problem.set_initial_value(self.robot_at(self.locations[l]), False)
+                    self._start = None
+                if l == self._destination:
+                    self.problem.clear_goals()
+                    self._destination = None
+                self._stale_facts += 1
+            self._compact_if_needed()
+
+    def on_connection_added(self, l_from: str, l_to: str, distance: int):
+        self._graph_hash = None
+        with expressions_lock:
+            self.version += 1
+            self._set_connection(l_from, l_to, distance)
+
+    def on_connection_removed(self, l_from: str, l_to: str):
+        self._graph_hash = None
+        with expressions_lock:
+            self.version += 1
+            self._unset_connection(l_from, l_to)
+            self._compact_if_needed()
+
+    def graph_hash(self) -> str:
+        # canonical_graph_hash of the graph, computed again only after a change
+        if self._graph_hash is None:
+            self._graph_hash = canonical_graph_hash(self.graph)
+        return self._graph_hash
+
+    def problem_for(self, start: str, destination: str) -> Tuple[up.model.Problem, up.model.metrics.PlanQualityMetric]:
+        if self.encoding_mode == ENCODING_AUTO and choose_encoding(self.graph) != self.encoding:
+            self._build(self.graph)
+
+        # Setting the initial location
+        if start != self._start:
+            if self._start is not None:
+                self.problem.set_initial_value(self.robot_at(self.locations[self._start]), False)
+            self.problem.set_initial_value(self.robot_at(self.locations[start]), True)
+            self._start = start
+
+        # Setting the goal
+        if destination != self._destination:
+            self.problem.clear_goals()
+            self.problem.add_goal(self.robot_at(self.locations[destination]))
+            self._destination = destination
+
+        return self.problem, self.metric
+
+    def snapshot_for(self, start: str, destination: str) -> Tuple[up.model.Problem, up.model.metrics.PlanQualityMetric]:
+        # The problem of the query as a copy that nothing changes afterwards, for an engine
+        # that reads it outside expressions_lock while the map can be edited; to be called
+        # holding the lock. The copy is reused by the same query until the map changes.
+        problem, metric = self.problem_for(start, destination)
+        if self._snapshot is None or self._snapshot[:3] != (self.version, start, destination):
+            self._snapshot = (self.version, start, destination) + snapshot_problem(problem)
+        return self._snapshot[3:]
+
+    def lift_plan(self, plan: Optional[up.plans.SequentialPlan]) -> Optional[up.plans.SequentialPlan]:
+        # Plans of the grounded encoding are translated back to `move(l_from, l_to)` actions
+        if plan is None or self.encoding == ENCODING_LIFTED:
+            return plan
+        if len(plan.actions) == 0:
+            return local_solver.make_plan([])
+        connections = [self._grounded_connections[ai.action] for ai in plan.actions]
+        return local_solver.make_plan([connections[0][0]] + [t for _, t in connections])
+
+
+def snapshot_problem(problem: up.model.Problem) -> Tuple[up.model.Problem, up.model.metrics.PlanQualityMetric]:
+    # A problem with the fluents, objects and actions of the given one, and copies of its
+    # initial state, goals and metric. ProblemModel never changes a fluent, an object or
+    # an action once it is in the problem, so they are shared instead of cloned as
+    # Problem.clone does; the objects and actions are appended without the name checks
+    # of add_objects and add_actions, since their names are already unique.
+    snapshot = Problem(problem.name)
+    for fluent in problem.fluents:
+        snapshot.add_fluent(fluent, default_initial_value=problem.fluents_defaults[fluent])
+    snapshot.all_objects.extend(problem.all_objects)
+    snapshot.actions.extend(problem.actions)
+    for fluent, value in problem.explicit_initial_values.items():
+        snapshot.set_initial_value(fluent, value)
+    for goal in problem.goals:
+        snapshot.add_goal(goal)
+    for metric in problem.quality_metrics:
+        if metric.is_minimize_action_costs():
+            costs = metric.costs
+            metric = MinimizeActionCosts({}, default=metric.default)
+            metric.costs.update(costs)
+        snapshot.add_quality_metric(metric)
+    return snapshot, snapshot.quality_metrics[0]
@@ -0,0 +1,144 @@
+import logging
+from collections import deque
+from typing import Dict, List, Tuple
+
+import networkx as nx
+
+# Before a query is sent to the engine, the map is reduced to the part that can matter
+# for a shortest route from the start to the destination:
+# - the locations that cannot be reached from the start are dropped,
+# - the dead ends are dropped: a location other than the start and the destination with
+#   a single connection is never crossed by a route between them, and removing it can
+#   make a dead end of its neighbour, so whole trees hanging off the map go away,
+# - the chains of locations with exactly two connections are contracted into a single
+#   connection, whose distance is the sum of the distances of the chain; when two
+#   connections end up joining the same locations only the shorter one is kept,
+# - optionally, the locations farther from the start plus from the destination than the
+#   shortest route are dropped; this needs two Dijkstra runs, so it is off by default.
+# The plans of the reduced map are expanded back to the locations of the whole map.
+
+
+class Reduction():
+    def __init__(self, graph: nx.Graph, start: str, destination: str, distance_bounds: bool = False):
+        self.original_locations = len(graph)
+        self.original_connections = graph.number_of_edges()
+        self.start = start
+        self.destination = destination
+        self._keep = {start, destination}
+        # the locations of the whole map crossed by a contracted connection, from its first
+        # to its second location
+        self._chains: Dict[Tuple[str, str], List[str]] = {}
+        self.stats = {"other_components": 0, "dead_ends": 0, "contracted": 0, "bound_pruned": 0}
+
+        component = nx.node_connected_component(graph, start)
+        self.stats["other_components"] = len(graph) - len(component)
+        self.graph = graph.subgraph(component).copy()
+        if destination not in self.graph:
+            return
+        self._simplify()
+        if distance_bounds:
+            self._prune_by_distance()
+            self._simplify()
+
+    def _simplify(self):
+        # dropping a dead end or merging two connections can make new ones
+        while self._drop_dead_ends() + self._contract_chains() > 0:
+            pass
+
+    def _drop_dead_ends(self) -> int:
+        g = self.graph
+        queue = deque(n for n in g if g.degree(n) <= 1 and n not in self._keep)
+        dropped = 0
+        while queue:
+            n = queue.popleft()
+            if n not in g:
+                continue
+            neighbours = list(g[n])
+            g.remove_node(n)
+            dropped += 1
+            for m in neighbours:
+                if g.degree(m) <= 1 and m not in self._keep:
+                    queue.append(m)
+        self.stats["dead_ends"] += dropped
+        return dropped
+
+    def _edge_path(self, f: str, t: str) -> List[str]:
+        # the locations of the whole map crossed by the connection from f to t
+        path = self._chains.get((f, t))
+        if path is not None:
+            return path
+        path = self._chains.get((t, f))
+        if path is not None:
+            return path[::-1]
+        return [f, t]
+
+    def _set_chain(self, f: str, t: str, path: List[str]):
+        self._chains.pop((t, f), None)
+        self._chains[(f, t)] = path
+
+    def _contract_chains(self) -> int:
+        # The connections removed by merging a chain with a parallel connection or by
+        # dropping a chain that is a loop; 0 if the degrees of the other locations did not
+        # change
+        g = self.graph
+        removed = 0
+        for x in list(g):
+            if x not in g or x in self._keep or g.degree(x) != 2:
+                continue
+            ends = []
+            for first in g[x]:
+                prev, current, segment = x, first, []
+                while current not in self._keep and g.degree(current) == 2 and current != x:
+                    segment.append(current)
+                    prev, current = current, next(n for n in g[current] if n != prev)
+                ends.append((current, segment))
+            (a, segment_a), (b, segment_b) = ends
+            if a == x:
+                # a ring of locations with two connections, not connected to the rest
+                continue
+            locations = [a] + segment_a[::-1] + [x] + segment_b + [b]
+            path = [a]
+            weight = 0
+            for f, t in zip(locations[:-1], locations[1:]):
+                path.extend(self._edge_path(f, t)[1:])
+                weight += g[f][t]["weight"]
+            g.remove_nodes_from(locations[1:-1])
+            self.stats["contracted"] += len(locations) - 2
+            if a == b:
+                # a loop never belongs to a shortest route
+                removed += 2
+            elif g.has_edge(a, b):
+                if weight < g[a][b]["weight"]:
+                    g[a][b]["weight"] = weight
+                    self._set_chain(a, b, path)
+                removed += 1
+            else:
+                g.add_edge(a, b, weight=weight)
+                self._set_chain(a, b, path)
+        return removed
+
+    def _prune_by_distance(self):
+        g = self.graph
+        from_start = nx.single_source_dijkstra_path_length(g, self.start, weight="weight")
+        from_destination = nx.single_source_dijkstra_path_length(g, self.destination, weight="weight")
+        shortest = from_start[self.destination]
+        far = [n for n in g if from_start[n] + from_destination[n] > shortest]
+        g.remove_nodes_from(far)
+        self.stats["bound_pruned"] += len(far)
+
+    def reduced(self) -> bool:
+        return self.graph.number_of_edges() < self.original_connections
+
+    def expand_path(self, path: List[str]) -> List[str]:
+        # The locations of the whole map visited by a route on the reduced map
+        expanded = path[:1]
+        for f, t in zip(path[:-1], path[1:]):
+            expanded.extend(self._edge_path(f, t)[1:])
+        return expanded
+
+    def log(self):
+        logging.info(
+            f"Reduced the problem from {self.original_locations} locations and {self.original_connections} connections "
+            f"to {len(self.graph)} locations and {self.graph.number_of_edges()} connections: "
+            + ", ".join(f"{k} {v}" for k, v in self.stats.items())
+        )
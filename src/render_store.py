@@ -0,0 +1,123 @@
+import glob
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Hashable, Iterable, Mapping, Optional, Tuple
+
+import numpy as np
+
+
+def positions_hash(nodes: Iterable[Hashable], positions: Mapping[Hashable, np.ndarray]) -> str:
+    # The layout of a render: the same map is drawn differently by sessions that edited it
+    # in different orders
+    return hashlib.sha256(np.array([positions[n] for n in nodes], dtype=np.float64).tobytes()).hexdigest()[:16]
+
+
+def render_key(graph_hash: str, node_colors: Iterable[Tuple[str, str]], layout_hash: str, *options) -> str:
+    # Renders of the same map with the same layout and the same colour for each location
+    # are the same image
+    h = hashlib.sha256(f"{graph_hash}\0{layout_hash}".encode())
+    for node, color in sorted(node_colors):
+        h.update(f"{node}\0{color}\1".encode())
+    for option in options:
+        h.update(f"\0{option!r}".encode())
+    return h.hexdigest()[:32]
+
+
+class RenderStore():
+    # The generated images of the map, stored as files named after their content in a
+    # directory served by the static handler; the least recently used images are
+    # deleted when the store exceeds max_entries or max_bytes, except the ones displayed
+    # by a session, that a reload of its page fetches again (so the store can exceed its
+    # bounds when more sessions display an image than max_entries)
+    def __init__(self, image_location: str, max_entries: int, max_bytes: int):
+        assert max_entries > 0 and max_bytes > 0
+        # the url of an image is static{image_location}_{key}.png, the file is .{image_location}_{key}.png
+        self.image_location = image_location
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        # the key of the image displayed by every session
+        self._displayed: Dict[str, str] = {}
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        # Creates the directory of the images, and removes the images of a previous run,
+        # which are not tracked; called once at startup, before the first image is stored
+        directory = os.path.dirname(f".{self.image_location}")
+        os.makedirs(directory, exist_ok=True)
+        for file in glob.glob(f".{self.image_location}_*.png"):
+            os.remove(file)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _file(self, key: str) -> str:
+        return f".{self.image_location}_{key}.png"
+
+    def get(self, key: str) -> Optional[str]:
+        # The location of the image with the given key, if it is stored
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return f"{self.image_location}_{key}.png"
+
+    def put(self, key: str, image: bytes) -> str:
+        with open(self._file(key), "wb") as f:
+            f.write(image)
+        with self._lock:
+            self.size_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(image)
+            self.size_bytes += len(image)
+            self._evict()
+        return f"{self.image_location}_{key}.png"
+
+    def display(self, session: str, key: str):
+        # Records the image displayed by a session; the one it displayed before can be evicted
+        with self._lock:
+            self._displayed[session] = key
+            self._evict()
+
+    def release(self, session: str):
+        # Forgets the image displayed by a session that is dropped
+        with self._lock:
+            self._displayed.pop(session, None)
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held. The newest image is never evicted, it is about to be
+        # displayed
+        displayed = set(self._displayed.values())
+        for old_key in list(self._entries)[:-1]:
+            if len(self._entries) <= self.max_entries and self.size_bytes <= self.max_bytes:
+                break
+            if old_key in displayed:
+                continue
+            self.size_bytes -= self._entries.pop(old_key)
+            self.evictions += 1
+            try:
+                os.remove(self._file(old_key))
+            except OSError as e:
+                self.logger.warning(f"Could not remove the evicted image {self._file(old_key)}: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "displayed": len(set(self._displayed.values())),
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
@@ -0,0 +1,158 @@
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+from config import CONFIG
+from render_store import positions_hash
+
+# Processes that lay out and draw the map; 0 renders in the calling thread
+RENDER_WORKERS = CONFIG.get("render_workers", 1)
+assert RENDER_WORKERS >= 0
+# Sessions whose layout and figure are kept by each worker process
+WORKER_SESSIONS = 32
+
+
+class RenderRequest(NamedTuple):
+    # A snapshot of the map to render; the locations and colours are in the same order
+    nodes: List[str]
+    edges: List[Tuple[str, str, int]]
+    node_colors: List[str]
+    graph_hash: str
+    labels: bool
+    # False when only the layout is needed (svg render mode)
+    png: bool
+
+
+class RenderResult(NamedTuple):
+    positions: Optional[Dict[Hashable, np.ndarray]]
+    image: Optional[bytes]
+    seconds: float
+    # the part of seconds spent laying out the map
+    layout_seconds: float
+    # render_store.positions_hash of the layout
+    layout_hash: str
+
+
+# The state of the sessions rendered by this process: every session keeps its layout, so
+# that edits only relax the locations they affect, and its figure, so that colour changes
+# only recolour the locations
+_sessions: "OrderedDict[str, Tuple[LayoutCache, GraphCanvas]]" = OrderedDict()
+
+
+def _warm_up() -> float:
+    # Imports matplotlib and draws a small map, which loads the fonts (and builds the font
+    # cache of matplotlib on a new container); the seconds taken are returned
+    start_time = time.perf_counter()
+    from graph_canvas import GraphCanvas
+    graph = nx.Graph()
+    graph.add_edge("L_1", "L_2", weight=1)
+    GraphCanvas(figsize=(1, 1)).render(graph, "", {"L_1": np.zeros(2), "L_2": np.ones(2)}, ["#ffffff"] * 2, True)
+    return time.perf_counter() - start_time
+
+
+def render(session: str, request: RenderRequest) -> RenderResult:
+    # matplotlib is imported by the first render of the process, unless _warm_up did it
+    from graph_canvas import GraphCanvas
+    from graph_layout import LayoutCache
+    start_time = time.perf_counter()
+    if session not in _sessions:
+        _sessions[session] = LayoutCache(scale=1), GraphCanvas()
+        while len(_sessions) > WORKER_SESSIONS:
+            _sessions.popitem(last=False)
+    _sessions.move_to_end(session)
+    layout_cache, canvas = _sessions[session]
+
+    graph = nx.Graph()
+    graph.add_nodes_from(request.nodes)
+    graph.add_weighted_edges_from(request.edges)
+    positions = layout_cache.layout(graph)
+    layout_seconds = time.perf_counter() - start_time
+    layout_hash = positions_hash(request.nodes, positions)
+    if request.png:
+        image = canvas.render(graph, request.graph_hash, positions, request.node_colors, request.labels)
+        return RenderResult(None, image, time.perf_counter() - start_time, layout_seconds, layout_hash)
+    return RenderResult(positions, None, time.perf_counter() - start_time, layout_seconds, layout_hash)
+
+
+class RenderWorker():
+    # Renders the map outside of the justpy event loop. Every session has at most one
+    # render in flight and one waiting: a request that arrives while a render is in flight
+    # replaces the waiting one, so a burst of edits renders only the latest map. The
+    # sessions are always sent to the same process, which keeps their layout and figure.
+    def __init__(self, workers: int = RENDER_WORKERS):
+        self.workers = workers
+        self._executors: List[ProcessPoolExecutor] = []
+        self._in_flight = set()
+        self._waiting: Dict[str, Tuple[RenderRequest, Callable[[Future], None]]] = {}
+        self._lock = Lock()
+        self.submitted = 0
+        self.coalesced = 0
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        # The processes are forked here, so this must be called before the program starts
+        # other threads or opens connections; they warm up in the background, and the
+        # first renders wait for them
+        if self._executors or self.workers == 0:
+            return
+        self._executors = [ProcessPoolExecutor(max_workers=1) for _ in range(self.workers)]
+        for i, executor in enumerate(self._executors):
+            executor.submit(_warm_up).add_done_callback(partial(self._warmed_up, i))
+
+    def _warmed_up(self, worker: int, future: Future):
+        try:
+            self.logger.info(f"Render worker {worker} warmed up in {future.result():.2f}s")
+        except Exception:
+            self.logger.exception(f"Render worker {worker} failed to warm up")
+
+    def submit(self, session: str, request: RenderRequest, callback: Callable[[Future], None]):
+        # callback is called with the future of the render, from a thread of the worker
+        with self._lock:
+            if session in self._in_flight:
+                if session in self._waiting:
+                    self.coalesced += 1
+                self._waiting[session] = request, callback
+                return
+            self._in_flight.add(session)
+        self._start(session, request, callback)
+
+    def _start(self, session: str, request: RenderRequest, callback: Callable[[Future], None]):
+        self.submitted += 1
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(render(session, request))
+            except Exception as e:
+                future.set_exception(e)
+            self._done(session, callback, future)
+            return
+        self.start()
+        executor = self._executors[hash(session) % len(self._executors)]
+        future = executor.submit(render, session, request)
+        future.add_done_callback(lambda f: self._done(session, callback, f))
+
+    def _done(self, session: str, callback: Callable[[Future], None], future: Future):
+        with self._lock:
+            waiting = self._waiting.pop(session, None)
+            if waiting is None:
+                self._in_flight.discard(session)
+        try:
+            callback(future)
+        except Exception:
+            self.logger.exception("Error while showing a render")
+        if waiting is not None:
+            self._start(session, *waiting)
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,313 @@
+import heapq
+import logging
+import numbers
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock, Timer
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import networkx as nx
+
+from config import CONFIG
+from graph_events import Connection, GraphListener
+import metrics
+
+# A map that is queried many times without being edited is indexed with a contraction
+# hierarchy: the locations are ranked, and every location is "contracted" in rank order,
+# adding a shortcut between two of its neighbours when it lies on their only shortest
+# connection. A query then only searches upwards in rank from both the start and the
+# destination, settling a few hundred locations instead of the whole map, and the
+# shortcuts of the route are unpacked back to connections of the map.
+
+# Whether the maps are indexed; the index answers the NAVIGATE requests instead of the engine
+ROUTE_INDEX = CONFIG.get("route_index", False)
+# Seconds without edits after which a map is considered frozen and indexed in the background
+ROUTE_INDEX_DELAY = CONFIG.get("route_index_delay", 5)
+# Processes that build the indexes, which is pure Python and would hold the GIL of the
+# web server for seconds; it is also the number of builds running at once, the others
+# wait for their turn. 0 builds in a thread of the web server, one at a time
+ROUTE_INDEX_WORKERS = CONFIG.get("route_index_workers", 1)
+assert ROUTE_INDEX_WORKERS >= 0
+# Locations settled by a witness search before assuming that a shortcut is needed; a
+# lower limit builds faster but adds more (harmless) shortcuts
+WITNESS_SEARCH_LIMIT = 200
+# the same when estimating the shortcuts added by a contraction, to order the locations
+PRIORITY_WITNESS_SEARCH_LIMIT = 30
+
+
+class ContractionHierarchy():
+    def __init__(self, locations: Iterable[Hashable], connections: Iterable[Tuple[Hashable, Hashable, numbers.Real]]):
+        start_time = time.perf_counter()
+        self.locations: List[Hashable] = list(locations)
+        self._index = {l: i for i, l in enumerate(self.locations)}
+        n = len(self.locations)
+        # the remaining graph during the contraction, with the shortcuts
+        adjacency: List[Dict[int, numbers.Real]] = [{} for _ in range(n)]
+        for f, t, w in connections:
+            f, t = self._index[f], self._index[t]
+            if f != t and (t not in adjacency[f] or w < adjacency[f][t]):
+                adjacency[f][t] = adjacency[t][f] = w
+        # the connections of every location towards the higher ranked ones
+        self._up: List[List[Tuple[int, numbers.Real]]] = [[] for _ in range(n)]
+        # the location contracted by a shortcut, by its two locations in increasing order
+        self._middle: Dict[Tuple[int, int], int] = {}
+        self.shortcuts = 0
+
+        contracted_neighbours = [0] * n
+        level = [0] * n
+        priority = [self._priority(adjacency, u, contracted_neighbours, level) for u in range(n)]
+        queue = [(p, u) for u, p in enumerate(priority)]
+        heapq.heapify(queue)
+        contracted = [False] * n
+        while queue:
+            p, u = heapq.heappop(queue)
+            if contracted[u] or p != priority[u]:
+                # an outdated entry
+                continue
+            # lazy update: the priority may have grown since it was computed
+            priority[u] = self._priority(adjacency, u, contracted_neighbours, level)
+            if queue and priority[u] > queue[0][0]:
+                heapq.heappush(queue, (priority[u], u))
+                continue
+            for v, w, weight in self._shortcuts(adjacency, u, WITNESS_SEARCH_LIMIT):
+                if w not in adjacency[v] or weight < adjacency[v][w]:
+                    adjacency[v][w] = adjacency[w][v] = weight
+                    self._middle[(v, w) if v < w else (w, v)] = u
+                    self.shortcuts += 1
+            contracted[u] = True
+            # the neighbours left are all contracted later, so they are ranked higher
+            for v, weight in adjacency[u].items():
+                self._up[u].append((v, weight))
+                del adjacency[v][u]
+                contracted_neighbours[v] += 1
+                level[v] = max(level[v], level[u] + 1)
+            for v, _ in self._up[u]:
+                priority[v] = self._priority(adjacency, v, contracted_neighbours, level)
+                heapq.heappush(queue, (priority[v], v))
+            adjacency[u] = {}
+        self.build_seconds = time.perf_counter() - start_time
+        self.memory_bytes = self._memory_bytes()
+
+    def _witness_distances(self, adjacency: List[Dict[int, numbers.Real]], source: int, avoid: int, limit: numbers.Real, max_settled: int) -> Dict[int, numbers.Real]:
+        # distances from source not going through avoid, up to limit
+        distances = {source: 0}
+        queue = [(0, source)]
+        settled = 0
+        while queue and settled < max_settled:
+            d, v = heapq.heappop(queue)
+            if d > distances[v]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            for x, w in adjacency[v].items():
+                if x != avoid and (x not in distances or d + w < distances[x]):
+                    distances[x] = d + w
+                    heapq.heappush(queue, (d + w, x))
+        return distances
+
+    def _shortcuts(self, adjacency: List[Dict[int, numbers.Real]], u: int, max_settled: int) -> List[Tuple[int, int, numbers.Real]]:
+        # The pairs of neighbours of u that need a shortcut when u is contracted, with its distance
+        neighbours = list(adjacency[u].items())
+        needed = []
+        for i, (v, d_v) in enumerate(neighbours[:-1]):
+            others = neighbours[i + 1:]
+            limit = d_v + max(d for _, d in others)
+            distances = self._witness_distances(adjacency, v, u, limit, max_settled)
+            for w, d_w in others:
+                if distances.get(w, limit + 1) > d_v + d_w:
+                    needed.append((v, w, d_v + d_w))
+        return needed
+
+    def _priority(self, adjacency: List[Dict[int, numbers.Real]], u: int, contracted_neighbours: List[int], level: List[int]) -> int:
+        # Contracting first the locations that add few shortcuts and remove many connections
+        # (the edge difference) keeps the hierarchy small; preferring the locations with few
+        # contracted neighbours and a low level spreads the contraction evenly on the map,
+        # which keeps the upward searches short
+        shortcuts = len(self._shortcuts(adjacency, u, PRIORITY_WITNESS_SEARCH_LIMIT))
+        return 2 * (shortcuts - len(adjacency[u])) + contracted_neighbours[u] + level[u]
+
+    def _memory_bytes(self) -> int:
+        size = sys.getsizeof(self._up) + sys.getsizeof(self._middle) + sys.getsizeof(self._index)
+        for edges in self._up:
+            size += sys.getsizeof(edges) + sum(sys.getsizeof(e) for e in edges)
+        size += sum(sys.getsizeof(k) for k in self._middle)
+        return size
+
+    def _unpack(self, a: int, b: int, path: List[int]):
+        # appends to path the locations of the map from a (excluded) to b
+        middle = self._middle.get((a, b) if a < b else (b, a))
+        if middle is None:
+            path.append(b)
+        else:
+            self._unpack(a, middle, path)
+            self._unpack(middle, b, path)
+
+    def route(self, start: Hashable, destination: Hashable) -> Optional[Tuple[List[Hashable], numbers.Real]]:
+        # The shortest route and its cost, or None if the destination cannot be reached.
+        # Two upward searches, from the start and from the destination, run in turns; a
+        # search stops when its next location is farther than the best route found through
+        # a location reached by both. A location reached more cheaply from a higher ranked
+        # one is not expanded (stall-on-demand): it cannot be on the shortest route.
+        s, t = self._index[start], self._index[destination]
+        up = self._up
+        distances = ({s: 0}, {t: 0})
+        parents = ({}, {})
+        queues = ([(0, s)], [(0, t)])
+        best, meeting = (0, s) if s == t else (None, None)
+        side = 0
+        while queues[0] or queues[1]:
+            if not queues[side]:
+                side = 1 - side
+            queue, dist, other = queues[side], distances[side], distances[1 - side]
+            d, v = heapq.heappop(queue)
+            if d > dist[v]:
+                continue
+            if best is not None and d >= best:
+                # nothing left on this side can improve the route
+                queue.clear()
+                continue
+            if v in other and (best is None or d + other[v] < best):
+                best, meeting = d + other[v], v
+            if not any(x in dist and dist[x] + w < d for x, w in up[v]):
+                for x, w in up[v]:
+                    if x not in dist or d + w < dist[x]:
+                        dist[x] = d + w
+                        parents[side][x] = v
+                        heapq.heappush(queue, (d + w, x))
+            side = 1 - side
+        if meeting is None:
+            return None
+        hops = [meeting]
+        while hops[-1] != s:
+            hops.append(parents[0][hops[-1]])
+        hops.reverse()
+        v = meeting
+        while v != t:
+            v = parents[1][v]
+            hops.append(v)
+        path = [s]
+        for a, b in zip(hops[:-1], hops[1:]):
+            self._unpack(a, b, path)
+        return [self.locations[i] for i in path], best
+
+
+_build_executor: Optional[ProcessPoolExecutor] = None
+_build_slots = BoundedSemaphore(max(ROUTE_INDEX_WORKERS, 1))
+
+
+def start_build_workers():
+    # The processes are forked here, so this must be called before the program starts
+    # other threads or opens connections; without them the indexes are built in threads
+    global _build_executor
+    if _build_executor is None and ROUTE_INDEX_WORKERS > 0:
+        _build_executor = ProcessPoolExecutor(max_workers=ROUTE_INDEX_WORKERS)
+        # the processes are forked by the first task
+        _build_executor.submit(int)
+
+
+def build_hierarchy(locations: List[Hashable], connections: List[Tuple[Hashable, Hashable, numbers.Real]]) -> ContractionHierarchy:
+    # Builds the index in a build process if they are started; the caller holds a build slot
+    if _build_executor is None:
+        return ContractionHierarchy(locations, connections)
+    return _build_executor.submit(ContractionHierarchy, locations, connections).result()
+
+
+class RouteIndex(GraphListener):
+    # The contraction hierarchy of the graph of a Gui. Every change of the graph drops the
+    # index and restarts a timer; when the graph has not changed for ROUTE_INDEX_DELAY
+    # seconds, the timer thread copies the graph, waits for a build slot and has the index
+    # built by a build process; it is kept only if the graph did not change in the meantime.
+    def __init__(self, graph: nx.Graph, delay: float = ROUTE_INDEX_DELAY):
+        self.graph = graph
+        self.delay = delay
+        self.builds = 0
+        self._version = 0
+        self._hierarchy: Optional[ContractionHierarchy] = None
+        self._timer: Optional[Timer] = None
+        self._lock = Lock()
+        self._closed = False
+        self.logger = logging.getLogger(__name__)
+        self._schedule()
+
+    def _schedule(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            if self._closed:
+                return
+            self._timer = Timer(self.delay, self._build, args=(self._version,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _changed(self):
+        with self._lock:
+            self._version += 1
+            self._hierarchy = None
+        self._schedule()
+
+    def _build(self, version: int):
+        graph = self.graph
+        try:
+            locations = list(graph)
+            connections = list(graph.edges(data="weight"))
+        except RuntimeError:
+            # the graph changed while it was copied, a new build is already scheduled
+            return
+        if any(not isinstance(w, numbers.Real) or w < 0 for _, _, w in connections):
+            return
+        with _build_slots:
+            # the graph may have changed while waiting
+            with self._lock:
+                if version != self._version or self._closed:
+                    return
+            try:
+                hierarchy = build_hierarchy(locations, connections)
+            except Exception:
+                self.logger.exception(f"Could not build the route index of {len(locations)} locations")
+                return
+        with self._lock:
+            if version != self._version or self._closed:
+                return
+            self._hierarchy = hierarchy
+            self.builds += 1
+        metrics.observe_stage("route_index_build", hierarchy.build_seconds, len(locations))
+        self.logger.info(
+            f"Route index of {len(locations)} locations and {len(connections)} connections built in "
+            f"{hierarchy.build_seconds:.2f}s: {hierarchy.shortcuts} shortcuts, {hierarchy.memory_bytes / 1e6:.1f}MB"
+        )
+
+    def current(self) -> Optional[ContractionHierarchy]:
+        # The index of the graph as it is now, None if it is being built or the graph is changing
+        return self._hierarchy
+
+    def stats(self) -> dict:
+        hierarchy = self._hierarchy
+        if hierarchy is None:
+            return {"builds": self.builds, "ready": False}
+        return {"builds": self.builds, "ready": True, "build_seconds": hierarchy.build_seconds,
+                "shortcuts": hierarchy.shortcuts, "memory_bytes": hierarchy.memory_bytes}
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._hierarchy = None
+        self._schedule()
+
+    def on_graph_replaced(self, graph: nx.Graph):
+        self.graph = graph
+        self._changed()
+
+    def on_locations_added(self, locations: Iterable[str], connections: Iterable[Connection]):
+        self._changed()
+
+    def on_locations_removed(self, locations: Iterable[str], connections: Iterable[Connection]):
+        self._changed()
+
+    def on_connection_added(self, l_from: str, l_to: str, distance: int):
+        self._changed()
+
+    def on_connection_removed(self, l_from: str, l_to: str):
+        self._changed()
@@ -9,42 +9,138 @@ import os
 # sys.path.append(tsb_space_src_dir)
 
 
+# times the imports below, see startup
+import startup
+startup.import_timer.install()
+
 import asyncio
 from functools import partial
 import sys
 import logging
+import queue
+import time
 import justpy as jp
 
-from up_graphene_engine.engine import GrapheneEngine
-
 
-from gui import Gui, Mode, reload_page
-from modified_planning import planning
+from config import CONFIG
+import metrics
+from gui import Gui, render_store, render_worker
+from engine_pool import ENGINE_POOL_SIZE, EnginePool
+from modified_planning import ANYTIME, PLANNING_TIMEOUT, SOLVER_MODE, SOLVER_MODE_LOCAL, attach_problem_model, planning_with_deadline
+from route_index import ROUTE_INDEX, start_build_workers
+from sessions import Sessions
 from threading import Thread
+from typing import Dict, Optional
 
 
 
-def main():
-
-    engine = GrapheneEngine(port=8061)
-
-    gui = Gui()
+# Threads serving the NAVIGATE requests of all the sessions
+PLANNING_WORKERS = CONFIG.get("planning_workers", 4)
+assert PLANNING_WORKERS > 0
 
-    gui_thread = Thread(target=gui.show_gui_thread)
-    gui_thread.start()
 
+def planning_worker(start_queue: queue.Queue, engine_pool: Optional[EnginePool]):
+    # the solves of this worker are awaited in its own event loop, with their deadline
+    loop = asyncio.new_event_loop()
     while True:
         # wait for the user input to start planning
-        gui.start_queue.get(block=True)
-        gui.plan, gui.plan_cost = planning(engine, gui, reload_page)
-
+        gui, generation, requested = start_queue.get(block=True)
+        n_locations = len(gui.graph)
+        if generation != gui.planning_generation:
+            # cancelled before it was started
+            metrics.navigate_requests.inc(result="cancelled", size=metrics.size_label(n_locations))
+            continue
+        stages = metrics.start_request()
+        metrics.observe_stage("queue", time.perf_counter() - requested, n_locations)
+        best = []
+        def publish(plan, cost, optimal):
+            # shows an improving plan while the search goes on, unless the request was cancelled
+            best[:] = [plan, cost]
+            if generation == gui.planning_generation:
+                gui.plan, gui.plan_cost, gui.plan_optimal = plan, cost, optimal
+                gui.update_planning_execution()
+
+        # with the "local" solver mode the engine is not used
+        engine = None
+        if engine_pool is not None:
+            with metrics.timed("engine_acquire", n_locations):
+                engine = engine_pool.acquire(timeout=PLANNING_TIMEOUT if PLANNING_TIMEOUT > 0 else None)
+        if engine is None and engine_pool is not None:
+            plan, cost, error = None, None, "The planning engine is not available!"
+            result = "engine_unavailable"
+        else:
+            try:
+                plan, cost, error = loop.run_until_complete(planning_with_deadline(engine, gui, publish if ANYTIME else None))
+                # a cancelled request is told apart below
+                result = "timeout" if error is not None else "solved" if plan is not None else "unsolvable"
+            except Exception:
+                logging.exception("Planning failed")
+                plan, cost, error = None, None, "Planning failed!"
+                result = "failed"
+            if engine is not None:
+                # the engine of a failed request can be broken; a timed out or cancelled solve
+                # goes on in its own thread, and the channel of the engine takes the calls of
+                # the next requests meanwhile
+                engine_pool.release(engine, healthy=result != "failed")
+        if generation != gui.planning_generation:
+            # cancelled by the user, the gui was already updated
+            log_navigate(gui, n_locations, requested, "cancelled", stages)
+            continue
+        if plan is None and best:
+            # timed out, the best plan found is kept
+            plan, cost = best
+        gui.plan, gui.plan_cost, gui.planning_error = plan, cost, error
+        gui.plan_optimal = error is None
+
+        # only the plan and the map are pushed to the page of the session
+        gui.reset_execution()
         gui.update_planning_execution()
+        log_navigate(gui, n_locations, requested, result, stages)
 
-        gui.reset_execution()
-        asyncio.run(reload_page())
 
+def log_navigate(gui: Gui, n_locations: int, requested: float, result: str, stages: Dict[str, float]):
+    seconds = time.perf_counter() - requested
+    metrics.observe_stage("navigate", seconds, n_locations)
+    metrics.navigate_requests.inc(result=result, size=metrics.size_label(n_locations))
+    metrics.log_request(
+        event="navigate",
+        session=gui.session_id,
+        locations=n_locations,
+        connections=gui.graph.number_of_edges(),
+        result=result,
+        seconds=round(seconds, 6),
+        stages={stage: round(s, 6) for stage, s in stages.items()},
+    )
 
-    server.wait_for_termination()
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(message)s')
+    startup.report_imports()
+
+    # the render and route index processes are forked before the engine connections and the threads exist
+    with metrics.timed("startup_render_workers"):
+        render_store.start()
+        render_worker.start()
+        if ROUTE_INDEX:
+            start_build_workers()
+
+    # the engines connect and warm up while the page starts
+    engine_pool = None
+    if SOLVER_MODE != SOLVER_MODE_LOCAL:
+        engine_pool = EnginePool(ENGINE_POOL_SIZE or PLANNING_WORKERS)
+        engine_pool.start()
+
+    start_queue = queue.Queue()
+    sessions = Sessions(start_queue, attach_problem_model)
+
+    workers = [Thread(target=planning_worker, args=(start_queue, engine_pool), daemon=True) for _ in range(PLANNING_WORKERS)]
+    for worker in workers:
+        worker.start()
+
+    gui_thread = Thread(target=sessions.show_gui_thread)
+    gui_thread.start()
+    # the modules not needed by the first page are loaded while it is served
+    startup.start_warm_up()
 
     gui_thread.join()
 
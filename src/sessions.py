@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import numbers
+import queue
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, List, Optional
+
+import justpy as jp
+import networkx as nx
+from starlette.routing import Route
+
+from config import CONFIG
+from engine_pool import call_in_thread
+from gui import Gui, Mode
+import local_solver
+import metrics
+from modified_planning import route_pairs
+import startup
+
+# The browser sessions whose map is kept; the least recently used ones are dropped
+MAX_SESSIONS = CONFIG.get("max_sessions", 100)
+assert MAX_SESSIONS > 0
+# The path of the batch routing endpoint (see Sessions.routes_endpoint); null disables it
+ROUTES_PATH = CONFIG.get("routes_path", "/routes")
+# The locations of a cost matrix, that takes 8 bytes for every pair
+ROUTES_MAX_MATRIX_LOCATIONS = 2000
+
+
+class RoutesRequestError(ValueError):
+    pass
+
+
+def _location_list(value, name: str) -> List[str]:
+    if not isinstance(value, list) or not all(isinstance(l, str) for l in value):
+        raise RoutesRequestError(f"{name} must be a list of location names")
+    return value
+
+
+def _request_graph(body: dict) -> nx.Graph:
+    # The map given as {"locations": [...], "connections": [[l_from, l_to, distance], ...]}
+    graph = nx.Graph()
+    graph.add_nodes_from(_location_list(body.get("locations", []), "locations"))
+    connections = body.get("connections")
+    if not isinstance(connections, list):
+        raise RoutesRequestError("connections must be a list of [l_from, l_to, distance]")
+    for connection in connections:
+        if (not isinstance(connection, list) or len(connection) != 3 or not all(isinstance(l, str) for l in connection[:2])
+                or isinstance(connection[2], bool) or not isinstance(connection[2], numbers.Real) or connection[2] < 0):
+            raise RoutesRequestError(f"invalid connection {connection!r}: it must be [l_from, l_to, distance] with distance >= 0")
+        graph.add_edge(connection[0], connection[1], weight=connection[2])
+    return graph
+
+
+def _answer_routes(graph: nx.Graph, graph_hash: Optional[str], pairs: list, matrix: Optional[List[str]]) -> dict:
+    answer = {}
+    if pairs:
+        routes = route_pairs(graph, graph_hash, [tuple(p) for p in pairs])
+        answer["routes"] = [None if route is None else {"path": route[0], "cost": route[1]} for route in routes]
+    if matrix is not None:
+        import batch_routing
+        locations, costs = batch_routing.cost_matrix(graph, matrix)
+        answer["matrix"] = {"locations": locations, "costs": [[c if c != float("inf") else None for c in row] for row in costs.tolist()]}
+    return answer
+
+
+class Sessions():
+    # The Gui of every justpy session: every browser edits its own map, and the NAVIGATE
+    # requests of all the sessions are put in the shared start_queue
+    def __init__(self, start_queue: queue.Queue, on_new_gui: Optional[Callable[[Gui], None]] = None, max_sessions: int = MAX_SESSIONS):
+        self.start_queue = start_queue
+        self.on_new_gui = on_new_gui
+        self.max_sessions = max_sessions
+        self._guis: "OrderedDict[str, Gui]" = OrderedDict()
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def __len__(self) -> int:
+        return len(self._guis)
+
+    def get(self, session_id: str) -> Gui:
+        with self._lock:
+            gui = self._guis.get(session_id)
+            if gui is not None:
+                self._guis.move_to_end(session_id)
+                return gui
+            gui = Gui(self.start_queue)
+            if self.on_new_gui is not None:
+                self.on_new_gui(gui)
+            self._guis[session_id] = gui
+            self._evict()
+            return gui
+
+    def _evict(self):
+        # a session waiting for its plan is kept, the planning worker still uses it
+        for session_id in list(self._guis):
+            if len(self._guis) <= self.max_sessions:
+                break
+            gui = self._guis[session_id]
+            if gui.mode == Mode.OPERATING:
+                continue
+            del self._guis[session_id]
+            gui.close()
+            self.logger.info(f"Dropped the session {session_id}; {len(self._guis)} sessions left")
+
+    def _session_gui(self, session: str) -> Optional[Gui]:
+        with self._lock:
+            return next((gui for gui in self._guis.values() if gui.session_id == session), None)
+
+    async def routes_endpoint(self, request):
+        # Answers many queries at once with batch_routing, without the planning engine:
+        # POST {"session": id, "pairs": [[start, destination], ...]} on the map of a session
+        # (its id is the "session" of the request log), or {"locations": [...],
+        # "connections": [[l_from, l_to, distance], ...], "pairs": ...} on the given map.
+        # The answer has a route {"path": [...], "cost": cost} for every pair, or null
+        # when the destination cannot be reached; with "matrix": [locations], it also has
+        # the costs between these locations, null for the pairs that are not connected.
+        from starlette.responses import JSONResponse
+        try:
+            try:
+                body = await request.json()
+            except ValueError:
+                raise RoutesRequestError("the body must be a JSON object")
+            if not isinstance(body, dict):
+                raise RoutesRequestError("the body must be a JSON object")
+            pairs = body.get("pairs", [])
+            if not isinstance(pairs, list) or not all(isinstance(p, list) and len(p) == 2 and all(isinstance(l, str) for l in p) for p in pairs):
+                raise RoutesRequestError("pairs must be a list of [start, destination]")
+            matrix = body.get("matrix")
+            if matrix is not None and len(_location_list(matrix, "matrix")) > ROUTES_MAX_MATRIX_LOCATIONS:
+                raise RoutesRequestError(f"matrix can have at most {ROUTES_MAX_MATRIX_LOCATIONS} locations")
+            if "session" in body:
+                gui = self._session_gui(body["session"])
+                if gui is None:
+                    return JSONResponse({"error": f"unknown session {body['session']!r}"}, status_code=404)
+                # the map can change while the queries are answered in another thread
+                graph, graph_hash = gui.graph.copy(), gui.graph_hash()
+            else:
+                graph, graph_hash = _request_graph(body), None
+            if matrix is not None and any(l not in graph for l in matrix):
+                raise RoutesRequestError("the locations of matrix must be in the map")
+            if not local_solver.is_travelling_cost_map(graph):
+                raise RoutesRequestError("the map has negative distances, use NAVIGATE")
+        except RoutesRequestError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        answer = await asyncio.wrap_future(call_in_thread(_answer_routes, graph, graph_hash, pairs, matrix))
+        return JSONResponse(answer)
+
+    def show_gui_thread(self):
+        from main_page import main_page
+        # before the routes of justpy, which could match any path
+        if metrics.METRICS_PATH is not None:
+            jp.app.router.routes.insert(0, Route(metrics.METRICS_PATH, metrics.metrics_endpoint))
+        if ROUTES_PATH is not None:
+            jp.app.router.routes.insert(0, Route(ROUTES_PATH, self.routes_endpoint, methods=["POST"]))
+        @jp.SetRoute("/")
+        def get_main_page(request):
+            page = main_page(self.get(request.session_id))
+            startup.first_page_served()
+            return page
+        jp.justpy(get_main_page)
@@ -0,0 +1,149 @@
+import importlib.abc
+import logging
+import sys
+import time
+from threading import Thread
+from typing import Dict, List, Tuple
+
+from config import CONFIG
+import metrics
+
+# The cold start of the component. The modules imported before the page can be served are
+# timed, and the slowest packages are logged. The heavy modules that the first page does
+# not need are imported where they are first used:
+# - matplotlib, by the render worker processes,
+# - scipy, by the first batch of queries.
+# A warm-up thread imports and runs them once while the page is already being served. The
+# engines connect in the background (see EnginePool.start), and the render workers load
+# matplotlib and its fonts by themselves (see render_worker._warm_up).
+
+# Whether the modules deferred to their first use are warmed up in the background at the start
+STARTUP_WARMUP = CONFIG.get("startup_warmup", True)
+# The number of packages in the import time breakdown logged at the start
+IMPORT_BREAKDOWN_TOP = 15
+
+# the start of the component: this module is the first one imported by run.py
+START_TIME = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class _TimedLoader(importlib.abc.Loader):
+    # Times the loading of a module, and gives the module its own loader back before
+    # running it
+    def __init__(self, loader: importlib.abc.Loader, timer: "ImportTimer"):
+        self.loader = loader
+        self.timer = timer
+
+    def create_module(self, spec):
+        # an extension module is loaded here
+        self.timer._enter()
+        try:
+            return self.loader.create_module(spec)
+        finally:
+            self.timer._exit(spec.name)
+
+    def exec_module(self, module):
+        module.__loader__ = module.__spec__.loader = self.loader
+        self.timer._enter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timer._exit(module.__name__)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    # Times the modules imported while it is installed, like `python -X importtime`: the
+    # seconds of a module do not include the modules it imports. It is meant for the
+    # start of the program, before it starts other threads.
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        # for every module being loaded, its start and the time spent loading the modules it imports
+        self._stack: List[List[float]] = []
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def _enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def _exit(self, name: str):
+        start_time, children = self._stack.pop()
+        seconds = time.perf_counter() - start_time
+        self.seconds[name] = self.seconds.get(name, 0) + seconds - children
+        if self._stack:
+            self._stack[-1][1] += seconds
+
+    def breakdown(self, top: int = IMPORT_BREAKDOWN_TOP) -> List[Tuple[str, float]]:
+        # The seconds spent importing each top-level package, the slowest first; the
+        # modules of the component are top-level packages of their own
+        packages: Dict[str, float] = {}
+        for name, seconds in self.seconds.items():
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + seconds
+        return sorted(packages.items(), key=lambda p: p[1], reverse=True)[:top]
+
+
+import_timer = ImportTimer()
+_first_page_served = False
+
+
+def report_imports():
+    # Stops timing the imports and logs the slowest packages
+    import_timer.uninstall()
+    total = sum(import_timer.seconds.values())
+    metrics.observe_stage("startup_imports", total)
+    logger.info(
+        f"Imported {len(import_timer.seconds)} modules in {total:.2f}s; slowest packages: "
+        + ", ".join(f"{package} {seconds:.3f}s" for package, seconds in import_timer.breakdown())
+    )
+
+
+def first_page_served():
+    # Called with every page served; logs the time from the start to the first one
+    global _first_page_served
+    if _first_page_served:
+        return
+    _first_page_served = True
+    seconds = time.perf_counter() - START_TIME
+    metrics.observe_stage("startup_first_page", seconds)
+    logger.info(f"First page served {seconds:.2f}s after the start")
+
+
+def _warm_up():
+    start_time = time.perf_counter()
+    import networkx as nx
+    import batch_routing
+    import render_worker
+
+    graph = nx.Graph()
+    graph.add_edge("L_1", "L_2", weight=1)
+    batch_routing.route_batch(graph, [("L_1", "L_2")])
+    if render_worker.RENDER_WORKERS == 0:
+        # the renders are made in this process
+        render_worker._warm_up()
+    seconds = time.perf_counter() - start_time
+    metrics.observe_stage("startup_warmup", seconds)
+    logger.info(f"Warmed up in the background in {seconds:.2f}s")
+
+
+def start_warm_up():
+    if STARTUP_WARMUP:
+        Thread(target=_warm_up, daemon=True).start()
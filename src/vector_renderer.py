@@ -0,0 +1,76 @@
+import json
+import os
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+# The javascript renderer, added to the head of the page in "svg" render mode
+RENDERER_JS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "graph_renderer.js")
+with open(RENDERER_JS_FILE) as f:
+    RENDERER_HEAD_HTML = f"<script>{f.read()}</script>"
+# The class of the div the renderer draws in
+CONTAINER_CLASS = "tc-graph-svg"
+# Digits kept for the positions sent to the browser
+POSITION_DIGITS = 4
+
+
+def _to_json(data: dict) -> str:
+    return json.dumps(data, separators=(",", ":"))
+
+
+class VectorRenderer():
+    # Remembers the map as last sent to the browser and turns every redraw into the
+    # javascript call that applies only the differences (new colours, connections, ...)
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._nodes: Dict[str, Tuple[float, float, str]] = {}
+        self._edges: Dict[Tuple[str, str], Tuple[str, str, int]] = {}
+        self._labels: Optional[bool] = None
+        self.sent_bytes = 0
+
+    def load_javascript(self) -> str:
+        # The call that draws the whole map, for a page that just connected
+        data = {"nodes": self._nodes, "edges": list(self._edges.values()), "labels": self._labels}
+        return f"travellingCostsGraph.load({_to_json(data)})"
+
+    def update(self, graph: nx.Graph, positions: Dict[Hashable, np.ndarray], node_colors: List[str], labels: bool) -> Optional[str]:
+        nodes = {
+            str(n): (round(float(positions[n][0]), POSITION_DIGITS), round(float(positions[n][1]), POSITION_DIGITS), color)
+            for n, color in zip(graph, node_colors)
+        }
+        edges = {}
+        for u, v, w in graph.edges(data="weight"):
+            u, v = str(u), str(v)
+            edges[(min(u, v), max(u, v))] = (u, v, w)
+
+        if self._labels is None:
+            self._nodes, self._edges, self._labels = nodes, edges, labels
+            javascript = self.load_javascript()
+        else:
+            diff = {}
+            moved = {n: p for n, p in nodes.items() if self._nodes.get(n, p)[:2] != p[:2] or n not in self._nodes}
+            if moved:
+                diff["nodes"] = moved
+            colors = {n: p[2] for n, p in nodes.items() if n not in moved and self._nodes[n][2] != p[2]}
+            if colors:
+                diff["colors"] = colors
+            removed_nodes = [n for n in self._nodes if n not in nodes]
+            if removed_nodes:
+                diff["remove_nodes"] = removed_nodes
+            changed_edges = [e for k, e in edges.items() if self._edges.get(k) is None or self._edges[k][2] != e[2]]
+            if changed_edges:
+                diff["edges"] = changed_edges
+            removed_edges = [k for k in self._edges if k not in edges]
+            if removed_edges:
+                diff["remove_edges"] = removed_edges
+            if labels != self._labels:
+                diff["labels"] = labels
+            self._nodes, self._edges, self._labels = nodes, edges, labels
+            if not diff:
+                return None
+            javascript = f"travellingCostsGraph.apply({_to_json(diff)})"
+        self.sent_bytes += len(javascript)
+        return javascript
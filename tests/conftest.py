@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the component are imported from src, as run.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,39 @@
+import io
+import random
+
+import matplotlib.image
+import networkx as nx
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from graph_canvas import EDGE_LABEL_FONT_SIZE, FIGSIZE, NODE_LABEL_FONT_SIZE, NODE_SIZE, GraphCanvas
+
+
+def full_draw(graph: nx.Graph, positions, node_colors) -> np.ndarray:
+    # The map drawn from scratch, as the Gui drew it before the canvas was kept
+    figure = Figure(figsize=FIGSIZE)
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    nx.draw(graph, positions, with_labels=True, font_weight="bold", ax=ax, node_color=node_colors, font_size=NODE_LABEL_FONT_SIZE, node_size=NODE_SIZE)
+    edge_labels = {(u, v): graph[u][v]["weight"] for u, v in graph.edges}
+    nx.draw_networkx_edge_labels(graph, positions, edge_labels=edge_labels, ax=ax, font_color='black', font_size=EDGE_LABEL_FONT_SIZE)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[:, :, :3].astype(int)
+
+
+def test_recoloured_map_matches_a_full_draw():
+    for seed in range(2):
+        rng = random.Random(seed)
+        graph = nx.relabel_nodes(nx.gnm_random_graph(15, 30, seed=seed), lambda n: f"L_{n + 1}")
+        for f, t in graph.edges:
+            graph[f][t]["weight"] = rng.randint(0, 99)
+        positions = nx.spring_layout(graph, seed=seed)
+        canvas = GraphCanvas()
+        for _ in range(3):
+            node_colors = [rng.choice(("#ff0000", "#00ff00", "#aaaaff")) for _ in graph]
+            image = matplotlib.image.imread(io.BytesIO(canvas.render(graph, "map", positions, node_colors, True)))
+            pixels = (image[:, :, :3] * 255).round().astype(int)
+            # the texts, the locations and the connections are stacked as in a full draw
+            assert (np.abs(pixels - full_draw(graph, positions, node_colors)).max(axis=2) > 8).sum() == 0
+        assert canvas.full_draws == 1 and canvas.recolours == 2
@@ -0,0 +1,62 @@
+import random
+
+import networkx as nx
+import numpy as np
+
+from graph_layout import LayoutCache
+
+
+def weighted_map(seed: int, n_locations: int = 30, n_connections: int = 45) -> nx.Graph:
+    rng = random.Random(seed)
+    graph = nx.relabel_nodes(nx.gnm_random_graph(n_locations, n_connections, seed=seed), lambda n: f"L_{n + 1}")
+    for f, t in graph.edges:
+        graph[f][t]["weight"] = rng.randint(1, 20)
+    return graph
+
+
+def test_layout_cache_reuses_the_layout_of_an_unchanged_map():
+    for seed in range(4):
+        graph = weighted_map(seed)
+        cache = LayoutCache()
+        positions = cache.layout(graph)
+        assert set(positions) == set(graph)
+        assert all(np.isfinite(p).all() for p in positions.values())
+        assert cache.layout(graph.copy()) is positions
+        assert cache.full_layouts == 1 and cache.reused_layouts == 1
+
+
+def test_layout_cache_moves_only_the_locations_affected_by_an_edit():
+    for seed in range(4):
+        graph = weighted_map(seed)
+        cache = LayoutCache()
+        positions = dict(cache.layout(graph))
+        graph.add_edge("L_1", "new", weight=3)
+        moved = cache.layout(graph)
+        assert set(moved) == set(graph)
+        assert cache.relaxed_layouts == 1
+        assert all((moved[n] == p).all() for n, p in positions.items() if n != "L_1")
+        graph.remove_node("new")
+        assert set(cache.layout(graph)) == set(graph)
+
+
+def test_layout_cache_keeps_the_layout_when_only_distances_change():
+    for seed in range(4):
+        graph = weighted_map(seed)
+        cache = LayoutCache()
+        positions = cache.layout(graph)
+        for f, t in list(graph.edges)[:3]:
+            graph[f][t]["weight"] += 1
+        assert cache.layout(graph) is positions
+
+
+def test_layout_of_connections_of_distance_0():
+    for seed in range(4):
+        graph = weighted_map(seed, 12, 20)
+        zero = list(graph.edges)[:3]
+        for f, t in zero:
+            graph[f][t]["weight"] = 0
+        positions = LayoutCache().layout(graph)
+        assert all(np.isfinite(p).all() for p in positions.values())
+        # the locations at distance 0 are laid out next to each other
+        lengths = [np.linalg.norm(positions[f] - positions[t]) for f, t in graph.edges if (f, t) not in zero]
+        assert all(np.linalg.norm(positions[f] - positions[t]) < 0.1 * np.mean(lengths) for f, t in zero)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from map_generators import MAP_GENERATORS, random_map
+
+
+@pytest.mark.parametrize("generator", sorted(MAP_GENERATORS))
+@pytest.mark.parametrize("n_locations, n_connections", [(1, 5), (2, 1), (10, 45), (10, 100), (100, 150), (1000, 3000)])
+def test_maps_have_distinct_connections_within_the_bounds(generator, n_locations, n_connections):
+    arrays = MAP_GENERATORS[generator](n_locations, n_connections, 3, 40, seed=7)
+    sources, targets, costs = arrays.sources, arrays.targets, arrays.costs
+    assert len(sources) == len(targets) == len(costs)
+    assert ((0 <= sources) & (sources < n_locations) & (0 <= targets) & (targets < n_locations)).all()
+    assert (sources != targets).all()
+    pairs = np.minimum(sources, targets) * n_locations + np.maximum(sources, targets)
+    assert len(np.unique(pairs)) == len(pairs)
+    assert ((3 <= costs) & (costs <= 40)).all()
+    possible = n_locations * (n_locations - 1) // 2
+    if generator in ("gnm", "scale_free"):
+        assert len(sources) == min(n_connections, possible)
+    else:
+        assert len(sources) <= possible
+
+    graph = arrays.to_graph()
+    assert len(graph) == n_locations and graph.number_of_edges() == len(sources)
+    matrix = arrays.to_matrix()
+    assert matrix.shape == (n_locations, n_locations)
+    assert (matrix != matrix.T).nnz == 0 and matrix.sum() == 2 * costs.sum()
+
+
+@pytest.mark.parametrize("generator", sorted(MAP_GENERATORS))
+def test_the_same_seed_gives_the_same_map(generator):
+    first = random_map(200, 400, 1, 100, seed=3, generator=generator)
+    second = random_map(200, 400, 1, 100, seed=3, generator=generator)
+    other = random_map(200, 400, 1, 100, seed=4, generator=generator)
+    assert list(first.edges(data="weight")) == list(second.edges(data="weight"))
+    assert list(first.edges(data="weight")) != list(other.edges(data="weight"))
@@ -0,0 +1,66 @@
+import os
+import random
+from collections import OrderedDict
+
+import networkx as nx
+
+from plan_cache import PlanCache, _entry_size, canonical_graph_hash
+
+
+def test_plan_cache_is_a_bounded_lru():
+    for seed in range(6):
+        rng = random.Random(seed)
+        cache = PlanCache(max_entries=rng.randint(1, 8), max_bytes=rng.choice((600, 2000, 10 ** 6)))
+        # the entries the cache should hold, least recently used first, within max_entries
+        model = OrderedDict()
+        for _ in range(300):
+            key = ("map", f"L_{rng.randint(1, 12)}", f"L_{rng.randint(1, 12)}")
+            if rng.random() < 0.5:
+                value = ([key[1]] * rng.randint(1, 5) + [key[2]], rng.randint(0, 100))
+                cache.put(*key, *value)
+                model.pop(key, None)
+                model[key] = value
+                while len(model) > cache.max_entries:
+                    model.popitem(last=False)
+            else:
+                value = cache.get(*key)
+                assert value is None or value == model.get(key)
+                if value is not None:
+                    model.move_to_end(key)
+            entries = cache._entries
+            assert len(entries) <= cache.max_entries
+            assert cache.size_bytes <= cache.max_bytes or len(entries) == 1
+            assert cache.size_bytes == sum(_entry_size(k, v) for k, v in entries.items())
+            # the byte bound can only evict more than the model
+            assert list(entries) == list(model)[len(model) - len(entries):]
+            assert all(entries[k] == model[k] for k in entries)
+
+
+def test_plan_cache_persists_its_entries(tmp_path):
+    file = str(tmp_path / "plans.pickle")
+    cache = PlanCache(10, 10 ** 6, file)
+    for i in range(15):
+        cache.put("map", "L_1", f"L_{i}", ["L_1", f"L_{i}"], i)
+    # the changes are saved in the background, and at the latest by close
+    cache.close()
+    assert os.listdir(tmp_path) == ["plans.pickle"]
+    loaded = PlanCache(10, 10 ** 6, file)
+    assert list(loaded._entries.items()) == list(cache._entries.items())
+    loaded.close()
+
+
+def test_canonical_graph_hash_ignores_the_insertion_order():
+    for seed in range(6):
+        rng = random.Random(seed)
+        edges = [(f"L_{u}", f"L_{v}", rng.randint(0, 20)) for u, v in nx.gnm_random_graph(20, 30, seed=seed).edges]
+        graph = nx.Graph()
+        graph.add_nodes_from(f"L_{i}" for i in range(20))
+        graph.add_weighted_edges_from(edges)
+        rng.shuffle(edges)
+        shuffled = nx.Graph()
+        shuffled.add_nodes_from(reversed(list(graph)))
+        shuffled.add_weighted_edges_from((t, f, w) for f, t, w in edges)
+        assert canonical_graph_hash(shuffled) == canonical_graph_hash(graph)
+        f, t, w = edges[0]
+        shuffled[f][t]["weight"] = w + 1
+        assert canonical_graph_hash(shuffled) != canonical_graph_hash(graph)
@@ -0,0 +1,95 @@
+import random
+
+import networkx as nx
+import pytest
+
+from problem_model import ENCODING_AUTO, ENCODING_GROUNDED, ENCODING_LIFTED, ProblemModel, expressions_lock
+
+
+def problem_facts(model: ProblemModel, start: str, destination: str) -> tuple:
+    # What a planner sees of the map, in terms of location names: the connections with
+    # their distances, the initial position and the goal
+    with expressions_lock:
+        problem, metric = model.problem_for(start, destination)
+        if model.encoding == ENCODING_LIFTED:
+            locations = sorted(model.graph)
+            objects = {l: model.locations[l] for l in locations}
+            connections = {
+                (f, t): problem.initial_value(model.distance(objects[f], objects[t])).constant_value()
+                for f in locations for t in locations
+                if problem.initial_value(model.connected(objects[f], objects[t])).bool_constant_value()
+            }
+        else:
+            assert len(problem.actions) == len(metric.costs)
+            connections = {model._grounded_connections[a]: metric.costs[a].constant_value() for a in problem.actions}
+        at = sorted(str(f.arg(0)) for f, v in problem.initial_values.items() if f.fluent() == model.robot_at and v.bool_constant_value())
+        goals = [str(g) for g in problem.goals]
+    return connections, at, goals
+
+
+def edit_map(graph: nx.Graph, model: ProblemModel, rng: random.Random):
+    # A random edit of the map notified as the Gui does
+    action = rng.choice(("add_locations", "remove_locations", "add_connection", "remove_connection"))
+    nodes = sorted(graph, key=lambda n: int(n[2:]))
+    if action == "add_locations":
+        last = int(nodes[-1][2:]) if nodes else 0
+        locations = [f"L_{i}" for i in range(last + 1, last + rng.randint(1, 3) + 1)]
+        connections = [(f, t, rng.randint(0, 20)) for f, t in zip(([nodes[-1]] if nodes else []) + locations, locations)]
+        graph.add_nodes_from(locations)
+        graph.add_weighted_edges_from(connections)
+        model.on_locations_added(locations, connections)
+    elif action == "remove_locations" and len(nodes) > 2:
+        locations = nodes[-rng.randint(1, 2):]
+        connections = list(graph.edges(locations, data="weight"))
+        graph.remove_nodes_from(locations)
+        model.on_locations_removed(locations, connections)
+    elif action == "add_connection" and len(nodes) > 1:
+        f, t = rng.sample(nodes, 2)
+        distance = rng.randint(0, 20)
+        graph.add_edge(f, t, weight=distance)
+        model.on_connection_added(f, t, distance)
+    elif action == "remove_connection" and graph.number_of_edges() > 0:
+        f, t = rng.choice(list(graph.edges))
+        graph.remove_edge(f, t)
+        model.on_connection_removed(f, t)
+
+
+def small_map(rng: random.Random) -> nx.Graph:
+    graph = nx.relabel_nodes(nx.gnm_random_graph(12, rng.randint(0, 30), seed=rng.randint(0, 1000)), lambda n: f"L_{n + 1}")
+    for f, t in graph.edges:
+        graph[f][t]["weight"] = rng.randint(0, 20)
+    return graph
+
+
+@pytest.mark.parametrize("encoding", [ENCODING_LIFTED, ENCODING_GROUNDED, ENCODING_AUTO])
+def test_incremental_problem_matches_a_fresh_build(encoding):
+    for seed in range(6):
+        rng = random.Random(seed)
+        graph = small_map(rng)
+        model = ProblemModel(graph, encoding)
+        for _ in range(25):
+            edit_map(graph, model, rng)
+            if len(graph) < 2 or rng.random() < 0.5:
+                continue
+            start, destination = rng.sample(sorted(graph), 2)
+            assert model.graph_hash() == ProblemModel(graph.copy()).graph_hash()
+            fresh = ProblemModel(graph.copy(), encoding)
+            assert problem_facts(model, start, destination) == problem_facts(fresh, start, destination)
+            # with auto, the encoding follows the size of the map at the query
+            assert model.encoding == fresh.encoding
+
+
+@pytest.mark.parametrize("encoding", [ENCODING_LIFTED, ENCODING_GROUNDED])
+def test_snapshot_is_not_changed_by_edits(encoding):
+    graph = small_map(random.Random(0))
+    model = ProblemModel(graph, encoding)
+    with expressions_lock:
+        snapshot, _ = model.snapshot_for("L_1", "L_2")
+        assert snapshot == model.problem_for("L_1", "L_2")[0]
+        actions = sorted(a.name for a in snapshot.actions)
+        assert model.snapshot_for("L_1", "L_2")[0] is snapshot
+    graph.add_edge("L_1", "L_3", weight=1000)
+    model.on_connection_added("L_1", "L_3", 1000)
+    with expressions_lock:
+        assert sorted(a.name for a in snapshot.actions) == actions
+        assert model.snapshot_for("L_1", "L_2")[0] is not snapshot
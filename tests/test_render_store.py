@@ -0,0 +1,54 @@
+import os
+import random
+
+from render_store import RenderStore, render_key
+
+
+def test_render_key_ignores_the_order_of_the_locations():
+    colors = [(f"L_{i}", "red" if i % 3 == 0 else "blue") for i in range(20)]
+    assert render_key("map", colors, "layout", 1) == render_key("map", reversed(colors), "layout", 1)
+    assert render_key("map", colors, "layout", 1) != render_key("map", colors, "layout", 2)
+    assert render_key("map", colors, "layout") != render_key("map", colors, "moved")
+    assert render_key("map", colors, "layout") != render_key("map", colors[:1] + [("L_1", "red")] + colors[2:], "layout")
+
+
+def test_render_store_keeps_the_displayed_images(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for seed in range(6):
+        rng = random.Random(seed)
+        store = RenderStore(f"/generated_{seed}/graph", max_entries=rng.randint(1, 5), max_bytes=rng.choice((10, 1000)))
+        store.start()
+        displayed = {}
+        for _ in range(200):
+            key = f"k{rng.randint(0, 15)}"
+            if rng.random() < 0.6:
+                store.put(key, b"x" * rng.randint(1, 8))
+                if rng.random() < 0.5:
+                    session = f"s{rng.randint(0, 3)}"
+                    store.display(session, key)
+                    displayed[session] = key
+            elif displayed and rng.random() < 0.3:
+                session = rng.choice(sorted(displayed))
+                store.release(session)
+                del displayed[session]
+            else:
+                # a lookup changes the order of eviction, the bounds are enforced by the next change
+                store.get(key)
+                continue
+            entries = store._entries
+            assert set(displayed.values()) <= set(entries)
+            assert store.size_bytes == sum(entries.values())
+            # only the displayed images and the newest one can exceed the bounds
+            evictable = [k for k in list(entries)[:-1] if k not in displayed.values()]
+            assert not evictable or (len(entries) <= store.max_entries and store.size_bytes <= store.max_bytes)
+            assert sorted(os.listdir(tmp_path / f"generated_{seed}")) == sorted(f"graph_{k}.png" for k in entries)
+
+
+def test_render_store_removes_the_old_images_only_when_started(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "generated").mkdir()
+    (tmp_path / "generated" / "graph_old.png").write_bytes(b"x")
+    store = RenderStore("/generated/graph", max_entries=2, max_bytes=100)
+    assert os.listdir(tmp_path / "generated") == ["graph_old.png"]
+    store.start()
+    assert os.listdir(tmp_path / "generated") == []
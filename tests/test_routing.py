@@ -0,0 +1,103 @@
+import random
+
+import networkx as nx
+import pytest
+
+from batch_routing import cost_matrix, route_batch
+from problem_reduction import Reduction
+from route_index import ContractionHierarchy
+
+
+def weighted_map(seed: int) -> nx.Graph:
+    # sparse (so often disconnected) and denser maps, with distances of 0 and ties between routes
+    rng = random.Random(seed)
+    n_locations = rng.randint(2, 60)
+    n_connections = n_locations * rng.choice((1, 2, 3, 6)) // 2
+    graph = nx.relabel_nodes(nx.gnm_random_graph(n_locations, n_connections, seed=seed), lambda n: f"L_{n + 1}")
+    max_distance = rng.choice((1, 5, 100))
+    for f, t in graph.edges:
+        graph[f][t]["weight"] = rng.randint(0, max_distance)
+    return graph
+
+
+def random_pairs(graph: nx.Graph, seed: int, count: int = 20):
+    rng = random.Random(seed)
+    nodes = list(graph)
+    return [(rng.choice(nodes), rng.choice(nodes)) for _ in range(count)]
+
+
+def shortest_cost(graph: nx.Graph, start: str, destination: str):
+    try:
+        return nx.shortest_path_length(graph, start, destination, weight="weight")
+    except nx.NetworkXNoPath:
+        return None
+
+
+def path_cost(graph: nx.Graph, path) -> float:
+    # the cost of a path following connections of the map, failing if one is missing
+    assert all(graph.has_edge(f, t) for f, t in zip(path[:-1], path[1:])), f"{path} does not follow the map"
+    return sum(graph[f][t]["weight"] for f, t in zip(path[:-1], path[1:]))
+
+
+def test_route_batch_matches_dijkstra():
+    for seed in range(8):
+        graph = weighted_map(seed)
+        pairs = random_pairs(graph, seed) + [("L_1", "missing"), ("missing", "L_1")]
+        for (start, destination), route in zip(pairs, route_batch(graph, pairs)):
+            expected = shortest_cost(graph, start, destination) if start in graph and destination in graph else None
+            if expected is None:
+                assert route is None
+                continue
+            path, cost = route
+            assert cost == expected and type(cost) is int
+            assert path[0] == start and path[-1] == destination
+            assert path_cost(graph, path) == expected
+
+
+def test_cost_matrix_matches_dijkstra():
+    for seed in range(8):
+        graph = weighted_map(seed)
+        locations = sorted(graph)[:10]
+        names, costs = cost_matrix(graph, locations)
+        assert names == locations
+        _, sparse = cost_matrix(graph, locations, sparse=True)
+        for i, start in enumerate(locations):
+            for j, destination in enumerate(locations):
+                expected = shortest_cost(graph, start, destination)
+                assert costs[i, j] == (float("inf") if expected is None else expected)
+                if expected is not None:
+                    assert sparse[i, j] == expected
+
+
+@pytest.mark.parametrize("distance_bounds", [False, True])
+def test_reduction_expands_to_a_shortest_route(distance_bounds):
+    for seed in range(8):
+        graph = weighted_map(seed)
+        for start, destination in random_pairs(graph, seed, count=8):
+            expected = shortest_cost(graph, start, destination)
+            reduction = Reduction(graph, start, destination, distance_bounds)
+            if expected is None:
+                assert destination not in reduction.graph
+                continue
+            assert reduction.graph.number_of_edges() <= graph.number_of_edges()
+            reduced_path = nx.dijkstra_path(reduction.graph, start, destination, weight="weight")
+            assert path_cost(reduction.graph, reduced_path) == expected
+            path = reduction.expand_path(reduced_path)
+            assert path[0] == start and path[-1] == destination
+            assert path_cost(graph, path) == expected
+
+
+def test_contraction_hierarchy_matches_dijkstra():
+    for seed in range(8):
+        graph = weighted_map(seed)
+        hierarchy = ContractionHierarchy(graph, graph.edges(data="weight"))
+        for start, destination in random_pairs(graph, seed):
+            expected = shortest_cost(graph, start, destination)
+            route = hierarchy.route(start, destination)
+            if expected is None:
+                assert route is None
+                continue
+            path, cost = route
+            assert cost == expected
+            assert path[0] == start and path[-1] == destination
+            assert path_cost(graph, path) == expected